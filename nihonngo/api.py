@@ -1,12 +1,19 @@
-from django.db import transaction
-from django.db.models import Q
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import Q, F, Count, Min, Max, Sum
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 
 from nihonngo.models import User, SignInToken
 from nihonngo.models import Word, WordClass, Meaning, Example, Question, LearnedWord, UpdateHistory
+from nihonngo.models import KanaNeighbor, SearchGram, LookupCache, UserStatistics, DailyStatistics, ChangeVersion
 from nihonngo.extract import WordExtractor
+from nihonngo.bulk_lookup import BulkLookup
+from nihonngo.similarity import LCSScorer, lcs_length
+from nihonngo.sampler import UnfamiliaritySampler
+from nihonngo.metrics import instrument_module
 
-import random, hashlib, json, re, inspect
+import random, hashlib, binascii, os, sys, json, re, inspect, functools, collections, itertools, multiprocessing, threading, time
 from datetime import date, datetime, timedelta
 
 """
@@ -18,10 +25,38 @@ from datetime import date, datetime, timedelta
     则简单描述为调用失败。
 """
 
+"""
+    每个 API 抛出 APIException 的次数，键为 API 的函数名，供监控使用。
+"""
+API_ERROR_COUNTS = collections.Counter()
+API_ERROR_COUNTS_LOCK = threading.Lock()
+
+"""
+    p_validated 生成的参数校验包装函数的代码对象，校验失败时据此找到被包装的 API。
+"""
+VALIDATED_WRAPPER_CODES = set()
+
+def p_find_caller_api(frame):
+    """
+    沿调用栈向上查找最近的 api_ 函数的名称，只读取帧对象的函数名，不读取源码。
+    找不到时返回 frame 的上一层函数的名称。
+    """
+    caller = frame.f_back if frame.f_back is not None else frame
+    while frame is not None:
+        if frame.f_code.co_name.startswith('api_'):
+            return frame.f_code.co_name
+        if frame.f_code in VALIDATED_WRAPPER_CODES:
+            return frame.f_locals['function'].__name__
+        frame = frame.f_back
+    return caller.f_code.co_name
+
 class APIException(Exception):
     def __init__(self, value):
-        self.caller_api = inspect.stack()[2][3]
+        super(APIException, self).__init__(value)
+        self.caller_api = p_find_caller_api(sys._getframe(1))
         self.value = value
+        with API_ERROR_COUNTS_LOCK:
+            API_ERROR_COUNTS[self.caller_api] += 1
 
     def __str__(self):
         return repr(self.value)
@@ -35,53 +70,146 @@ class InvalidArgumentException(APIException):
     pass
 
 
+def api_get_error_counts():
+    """
+    获取每个 API 抛出 APIException 的次数。
+        返回值：
+            API 函数名到次数的 dict 实例。
+    """
+    with API_ERROR_COUNTS_LOCK:
+        return dict(API_ERROR_COUNTS)
+
+
+# MARK - Change Versions
+
+"""
+    持久化的变更版本号（ChangeVersion），供缓存判断其内容是否过期。版本号存于数据库中，
+    因此多个进程的缓存都能看到其他进程的修改。键 vocabulary 在生词表变化时递增，
+    键 learned.<user_id> 在用户的已学习生词被批量重新计算时递增。
+"""
+
+def p_touch_change_version(key):
+    """
+    递增持久化的变更版本号 key，并记录变更时间。应在变更数据的事务中调用。
+    """
+    now = timezone.now()
+    if ChangeVersion.objects.filter(key = key).update(version = F('version') + 1, modified_date = now) > 0:
+        return
+    try:
+        with transaction.atomic():
+            ChangeVersion.objects.create(key = key, version = 1, modified_date = now)
+    except IntegrityError:
+        ChangeVersion.objects.filter(key = key).update(version = F('version') + 1, modified_date = now)
+
+def p_learned_version_key(user_id):
+    return 'learned.{0}'.format(user_id)
+
+def p_get_versions(*keys):
+    """
+    一次查询读取若干个变更版本号。
+        返回值：
+            与 keys 一一对应的版本号的元组，从未变更过的键为 0。
+    """
+    versions = dict(ChangeVersion.objects.filter(key__in = keys).values_list('key', 'version'))
+    return tuple(versions.get(key, 0) for key in keys)
+
+
 # MARK - Content Filter and Validator
 
 def p_caller_name(stack_index = 2):
-    return inspect.stack()[stack_index][3]
-
-def p_validate_argument(*args, allow_blank = False):
-    """
-    校验参数的合法性，在不合法时抛出 InvalidArgumentException。
-        参数：
-            *args  个数应为3的倍数，每组参数的形式为 (name, value, type）。
-    """
-    assert len(args) % 3 == 0, 'p_validate_argument 函数的变参数个数必须为3的倍数。'
-    while len(args) > 0:
-        assert type(args[0]) is str, '{0} 不是 str 类型。'.format(args[0])
-        if not isinstance(args[1], args[2]):
-            raise InvalidArgumentException('参数 {0} 不是 {1} 类型。其类型为：{2}'.format(args[0], args[2], type(args[1])))
-        if not allow_blank:
-            if isinstance(args[1], str) and args[1] == '':
-                raise InvalidArgumentException('参数 {0} 不能为空。其值为：{1}'.format(args[0], args[1]))
-        args = args[3:]
-
-def p_validate_dictionary(name, dictionary, *args):
-    """
-    校验字典实例的合法性，在不合法时抛出 InvalidArgumentException。
-        参数：
-            name        字典的名称，用于报错；
-            dictionary  待校验的字典实例；
-            *args       个数为3的倍数，每组参数的形式为（key, type, allow_blank）。
-    """
-    if not isinstance(dictionary, dict):
-        raise InvalidArgumentException('{1} 不是 dict 类型。'.format(p_caller_name, name))
-    assert len(args) % 3 == 0, 'p_validate_dictionary 函数的变参数个数必须为3的倍数。'
-    while len(args) > 0:
-        assert type(args[2]) is bool, '{0} 不是 bool 类型。'.format(args[2])
-        if args[0] not in dictionary:
-            raise InvalidArgumentException('{0} 不在字典 {1} 中。'.format(args[0], name))
-        key, value = args[0], dictionary[args[0]]
-        if not isinstance(value, args[1]):
-            raise InvalidArgumentException('键 {0} 的值不是 {1} 类型。其值为：{2}'.format(key, args[1], value))
-        if not args[2]:
-            if isinstance(value, str) and value == '':
-                raise InvalidArgumentException('字符串类型的键 {0} 的值不能为空。'.format(key))
-            if (isinstance(value, list) or isinstance(value, tuple)) and len(value) == 0:
-                raise InvalidArgumentException('序列类型的的键 {0} 的值不能为空。'.format(key))
-            if isinstance(value, dict) and len(value == 0):
-                raise InvalidArgumentException('字典类型的的键 {0} 的值不能为空。'.format(key))
-        args = args[3:]
+    return sys._getframe(stack_index).f_code.co_name
+
+"""
+    参数校验。API 函数以注解声明参数的模式，由 p_validated 在定义函数时编译为校验函数：
+        类型或类型的元组  值须为该类型的实例，且不能为空；
+        Blank(模式)       允许值为空；
+        ListOf(模式)      值须为 list 实例，且其中每一项均符合给定的模式；
+        DictOf(名称, 键到模式的 dict)
+                          值须为 dict 实例，且包含所有的键，每个键的值均符合对应的模式。
+    空字符串、空 list、空 tuple 及空 dict 视为空。校验失败时抛出 InvalidArgumentException。
+    未给出、使用默认值的参数不做校验。
+"""
+
+class Blank(object):
+    def __init__(self, schema):
+        self.schema = schema
+
+class ListOf(object):
+    def __init__(self, schema):
+        self.schema = schema
+
+class DictOf(object):
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+def p_compile_schema(schema, name, is_key = False):
+    """
+    将模式编译为校验函数。
+        参数：
+            schema  模式；
+            name    参数名或键名，用于报错；
+            is_key  name 是否为字典的键名。
+        返回值：
+            接受一个值、在值不合法时抛出 InvalidArgumentException 的函数。
+    """
+    allow_blank = isinstance(schema, Blank)
+    if allow_blank:
+        schema = schema.schema
+
+    if isinstance(schema, DictOf):
+        expected_type, dict_name = dict, schema.name
+        field_checkers = [(key, p_compile_schema(field, key, is_key = True)) for key, field in schema.fields.items()]
+    else:
+        expected_type, dict_name, field_checkers = list if isinstance(schema, ListOf) else schema, None, None
+    item_checker = p_compile_schema(schema.schema, name, is_key = True) if isinstance(schema, ListOf) else None
+    label = ('键 {0} 的值' if is_key else '参数 {0}').format(name)
+
+    def check(value):
+        if not isinstance(value, expected_type):
+            if dict_name is not None:
+                raise InvalidArgumentException('{0} 不是 dict 类型。'.format(dict_name))
+            raise InvalidArgumentException('{0} 不是 {1} 类型。其值为：{2}'.format(label, expected_type, repr(value)))
+        if not allow_blank and isinstance(value, (str, list, tuple, dict)) and len(value) == 0:
+            raise InvalidArgumentException('{0} 不能为空。'.format(label))
+        if field_checkers is not None:
+            for key, check_field in field_checkers:
+                if key not in value:
+                    raise InvalidArgumentException('{0} 不在字典 {1} 中。'.format(key, dict_name))
+                check_field(value[key])
+        if item_checker is not None:
+            for item in value:
+                item_checker(item)
+    return check
+
+def p_validated(function):
+    """
+    根据参数的注解为函数生成参数校验，校验函数在定义时编译一次。被包装的原函数保存在
+    trusted 属性中，已经校验过参数的内部调用者可以直接调用它来跳过校验。
+    """
+    parameters = list(inspect.signature(function).parameters.values())
+    checkers = [(index, parameter.name, p_compile_schema(parameter.annotation, parameter.name))
+                for index, parameter in enumerate(parameters) if parameter.annotation is not parameter.empty]
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        for index, name, check in checkers:
+            if index < len(args):
+                check(args[index])
+            elif name in kwargs:
+                check(kwargs[name])
+        return function(*args, **kwargs)
+    wrapper.trusted = function
+    VALIDATED_WRAPPER_CODES.add(wrapper.__code__)
+    return wrapper
+
+
+"""
+    生词的基本信息，用于 api_insert_new_word 及 api_insert_new_words。
+"""
+
+MEANING_SCHEMA = DictOf('meaning', {'text': str, 'examples': Blank(ListOf(str))})
+WORD_INFO_SCHEMA = DictOf('word_info', {'kannji': str, 'kana': str, 'word_classes': ListOf(str), 'meanings': ListOf(MEANING_SCHEMA)})
 
 
 def p_remove_invalid_characters(string):
@@ -127,7 +255,8 @@ def p_validate_word_class(word_class):
     所有的认证 API 的前缀均为 api_auth_ ，暂不开放创建和删除功能。
 """
 
-def api_auth_sign_in(name, password):
+@p_validated
+def api_auth_sign_in(name: str, password: str):
     """
     以用户名、密码的形式进行认证。
         参数：
@@ -136,48 +265,98 @@ def api_auth_sign_in(name, password):
         返回值：
             通过认证的用户的 User 实例。
     """
-    p_validate_argument('name', name, str, 'password', password, str)
     users = User.objects.filter(name = name, password = password)
     if len(users) != 1:
         raise APIException('用户名或密码错误。')
     return users[0]
 
-def api_auth_get_user(user_id):
+"""
+    进程内的用户缓存：用户 ID -> (过期时间, User 实例)。缓存的 User 实例在多个请求间共享，
+    调用者不应修改。用户登出时由 p_invalidate_cached_user 移除。
+"""
+USER_CACHE_TTL = getattr(settings, 'NIHONNGO_USER_CACHE_TTL', 60)
+USER_CACHE_MAX_ENTRIES = 1000
+USER_CACHE = {}
+USER_CACHE_LOCK = threading.Lock()
+
+def p_invalidate_cached_user(user_id):
     """
-    根据 user_id 来获取对应的 User 实例。
+    从进程内的用户缓存中移除用户。
+    """
+    with USER_CACHE_LOCK:
+        USER_CACHE.pop(user_id, None)
+
+@p_validated
+def api_auth_get_user(user_id: int):
+    """
+    根据 user_id 来获取对应的 User 实例，在 USER_CACHE_TTL 秒内重复获取同一用户时不查询数据库。
         参数：
             user_id  用户的 ID。
         返回值：
             user_id 所对应的用户的 User 实例。
     """
-    p_validate_argument('user_id', user_id, int)
+    now = time.time()
+    with USER_CACHE_LOCK:
+        entry = USER_CACHE.get(user_id)
+    if entry is not None and entry[0] > now:
+        return entry[1]
 
     users = User.objects.filter(id = user_id)
     if len(users) != 1:
         raise APIException('不存在的用户。')
-    else:
-        return users[0]
 
-def api_auth_create_token(user_id, expire_delta = timedelta(weeks = 2)):
+    with USER_CACHE_LOCK:
+        if len(USER_CACHE) >= USER_CACHE_MAX_ENTRIES:
+            for key in [key for key, value in USER_CACHE.items() if value[0] <= now]:
+                del USER_CACHE[key]
+        if USER_CACHE_TTL > 0 and len(USER_CACHE) < USER_CACHE_MAX_ENTRIES:
+            USER_CACHE[user_id] = (now + USER_CACHE_TTL, users[0])
+    return users[0]
+
+"""
+    令牌验证缓存：令牌摘要 -> (缓存过期时间, SignInToken 实例)，按最近使用的顺序淘汰。
+    缓存的有效期不会超过令牌本身的过期时间；令牌在本进程中被标记为失效时立即移除，
+    在其他进程中被标记为失效时，最多在 TOKEN_CACHE_TTL 秒之后生效。
+"""
+TOKEN_CACHE_TTL = getattr(settings, 'NIHONNGO_TOKEN_CACHE_TTL', 60)
+TOKEN_CACHE_SIZE = 1024
+TOKEN_CACHE = collections.OrderedDict()
+TOKEN_CACHE_LOCK = threading.Lock()
+
+def p_hash_token(token):
+    """
+    计算令牌的 SHA-256 摘要。
+    """
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+def p_uncache_token(token_id):
+    """
+    从令牌验证缓存中移除令牌。
+    """
+    with TOKEN_CACHE_LOCK:
+        for key in [key for key, value in TOKEN_CACHE.items() if value[1].id == token_id]:
+            del TOKEN_CACHE[key]
+
+@p_validated
+def api_auth_create_token(user_id: int, expire_delta: timedelta = timedelta(weeks = 2)):
     """
     新建一个自动认证令牌。
         参数：
             user_id  用户的 ID。
         返回值：
-            创建的自动认证令牌的 SignInToken 实例。
+            创建的自动认证令牌的 SignInToken 实例，令牌本身保存在其 token 属性中。
     """
-    p_validate_argument('user_id', user_id, int, 'expire_delta', expire_delta, timedelta)
-
     user = api_auth_get_user(user_id)
-    token_string = "{0}{1}{2}".format(user.name, random.uniform(0, 1), timezone.now())
-    token = hashlib.sha1(token_string.encode('utf-8')).hexdigest()
+    token = binascii.hexlify(os.urandom(20)).decode('ascii')
     expire_date = timezone.now() + expire_delta
 
-    new_token = SignInToken(user_id = user.id, token = token, expire_date = expire_date)
+    new_token = SignInToken(user_id = user.id, token_hash = p_hash_token(token), expire_date = expire_date)
     new_token.save()
+    new_token.token = token
     return new_token
 
-def api_auth_validate_token(token):
+@p_validated
+def api_auth_validate_token(token: str):
     """
     认证令牌。
         参数：
@@ -185,19 +364,33 @@ def api_auth_validate_token(token):
         返回值：
             通过认证的对应的 SignInToken 实例。
     """
-    p_validate_argument('token', token, str)
+    token_hash, now = p_hash_token(token), timezone.now()
+    with TOKEN_CACHE_LOCK:
+        entry = TOKEN_CACHE.get(token_hash)
+        if entry is not None:
+            if entry[0] > now:
+                TOKEN_CACHE.move_to_end(token_hash)
+                return entry[1]
+            del TOKEN_CACHE[token_hash]
 
-    tokens = SignInToken.objects.filter(token = token)
+    tokens = SignInToken.objects.filter(token_hash = token_hash)
     if len(tokens) != 1:
         raise APIException('不存在的令牌。')
-    with tokens[0] as token:
-        if token.expired:
-            raise APIException('令牌已失效。')
-        if token.expire_date <= timezone.now():
-            raise APIException('令牌已过期。')
-        return token
-
-def api_auth_mark_token_expired(token_id):
+    token = tokens[0]
+    if token.expired:
+        raise APIException('令牌已失效。')
+    if token.expire_date <= now:
+        raise APIException('令牌已过期。')
+
+    if TOKEN_CACHE_TTL > 0:
+        with TOKEN_CACHE_LOCK:
+            TOKEN_CACHE[token_hash] = (min(now + timedelta(seconds = TOKEN_CACHE_TTL), token.expire_date), token)
+            while len(TOKEN_CACHE) > TOKEN_CACHE_SIZE:
+                TOKEN_CACHE.popitem(last = False)
+    return token
+
+@p_validated
+def api_auth_mark_token_expired(token_id: int):
     """
     标记令牌为失效。
         参数：
@@ -205,21 +398,38 @@ def api_auth_mark_token_expired(token_id):
         返回值：
             无。
     """
-    p_validate_argument('token_id', token_id, int)
-
-    tokens = SignInToken.objects.filter(id = token_id)
-    if len(tokens) != 1:
-        raise APIException('不存在的令牌。')
-    with tokens[0] as token:
-        if token.expired:
+    p_uncache_token(token_id)
+    updated = SignInToken.objects.filter(id = token_id, expired = False).update(expired = True)
+    if updated == 0:
+        if SignInToken.objects.filter(id = token_id).exists():
             raise APIException('该令牌已经失效。')
-        token.expired = True
-        token.save()
+        raise APIException('不存在的令牌。')
+
+@p_validated
+def api_auth_sweep_tokens(batch_size: int = 1000):
+    """
+    分批删除已失效或已过期的令牌，每批在一个事务中删除。
+        参数：
+            batch_size  每批删除的令牌个数。
+        返回值：
+            删除的令牌总数。
+    """
+    stale_tokens = SignInToken.objects.filter(Q(expired = True) | Q(expire_date__lte = timezone.now()))
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            token_ids = list(stale_tokens.values_list('id', flat = True)[:batch_size])
+            if len(token_ids) == 0:
+                break
+            SignInToken.objects.filter(id__in = token_ids).delete()
+        deleted += len(token_ids)
+    return deleted
 
 
 # MARK - API for Models
 
-def api_create_word(kannji, kana):
+@p_validated
+def api_create_word(kannji: str, kana: str):
     """
     中新建一个生词。
         参数：
@@ -228,28 +438,156 @@ def api_create_word(kannji, kana):
         返回值：
             新建的生词的 Word 实例。
     """
-    p_validate_argument('kannji', kannji, str, 'kana', kana, str)
     
     kannji, kana = p_filter_kannji(kannji), p_filter_kana(kana)
-    if len(Word.objects.filter(kannji = kannji, kana = kana)) > 0:
+    if Word.objects.filter(kannji = kannji, kana = kana).exists():
         raise APIException('生词"{0}（{1}）"已经存在。'.format(kannji, kana))
 
-    new_word = Word(kannji = kannji, kana = kana)
-    new_word.save()
+    with transaction.atomic():
+        new_word = Word(kannji = kannji, kana = kana)
+        new_word.save()
+        p_index_word_text(new_word.id, 0, new_word.kannji)
+        p_index_word_text(new_word.id, 1, new_word.kana)
+        p_update_kana_neighbor_index(new_word.kana)
     return new_word
 
-def api_search_word(search_string):
+def p_split_grams(text):
+    """
+    将文本拆分为单字及双字组合，用于建立搜索索引。
+        参数：
+            text  待拆分的文本。
+        返回值：
+            包含所有单字及双字组合的 set 实例。
+    """
+    return set(text) | set(text[i:i + 2] for i in range(len(text) - 1))
+
+def p_query_grams(search_string):
+    """
+    取得搜索串对应的索引项：单字的搜索串使用单字，否则使用其全部双字组合。
+    """
+    if len(search_string) == 1:
+        return set(search_string)
+    return set(search_string[i:i + 2] for i in range(len(search_string) - 1))
+
+def p_index_word_text(word_id, source, text):
+    """
+    将生词的一段文本加入搜索索引。
+        参数：
+            word_id  生词的 ID；
+            source   文本的来源，取值见 SearchGram.SOURCES；
+            text     文本。
+    """
+    grams = p_split_grams(text)
+    grams -= set(SearchGram.objects.filter(word_id = word_id, source = source, gram__in = grams).values_list('gram', flat = True))
+    SearchGram.objects.bulk_create([SearchGram(word_id = word_id, source = source, gram = gram) for gram in grams])
+
+SEARCH_RESULT_LIMIT = 50
+
+def p_rank_word_text(kannji, kana, search_string):
+    """
+    计算生词的汉字及假名与搜索串的匹配程度（0 到 2），不匹配时返回 None。
+    """
+    if search_string in (kannji, kana):
+        return 0
+    if kannji.startswith(search_string) or kana.startswith(search_string):
+        return 1
+    if search_string in kannji or search_string in kana:
+        return 2
+    return None
+
+def p_rank_search_result(word, search_string):
     """
-    查询符合搜索串的生词，判断条件为：汉字或假名包含搜索串。
+    计算生词与搜索串的匹配程度，数值越小越匹配，不匹配时返回 None。
+    依次为：汉字或假名完全相同、以搜索串开头、包含搜索串，释义包含搜索串，例句包含搜索串。
+    """
+    rank = p_rank_word_text(word.kannji, word.kana, search_string)
+    if rank is not None:
+        return rank
+    meanings = word.meanings.all()
+    if any(search_string in meaning.text for meaning in meanings):
+        return 3
+    if any(search_string in example.text for meaning in meanings for example in meaning.examples.all()):
+        return 4
+    return None
+
+def p_search_indexed_word_ids(search_string):
+    """
+    搜索单字或双字的搜索串。此时搜索串本身就是索引项，命中即为匹配，只需在 SQL 中
+    连接生词表，由命中的最小来源（汉字、假名、释义、例句）及汉字、假名计算匹配程度，
+    不必载入释义及例句逐一确认。
+        返回值：
+            按 (匹配程度, 汉字) 排序的生词 ID 的 list 实例。
+    """
+    matches = Word.objects.filter(search_grams__gram = search_string) \
+                          .annotate(source = Min('search_grams__source')) \
+                          .values_list('id', 'kannji', 'kana', 'source')
+    ranked_ids = []
+    for word_id, kannji, kana, source in matches:
+        rank = p_rank_word_text(kannji, kana, search_string) if source < 2 else source + 1
+        ranked_ids.append((rank, kannji, word_id))
+    return [e[2] for e in sorted(ranked_ids)]
+
+@p_validated
+def api_search_word(search_string: str, limit: int = SEARCH_RESULT_LIMIT):
+    """
+    查询符合搜索串的生词，判断条件为：汉字、假名、释义或例句包含搜索串。先通过搜索索引
+    找出包含搜索串全部双字组合的生词，再逐一确认并按匹配程度排序；单字及双字的搜索串
+    直接由索引确定匹配程度，只载入排在前 limit 个的生词。生词的词类、释义及例句会被
+    一并预先载入。
         参数：
-            search_string  搜索串。
+            search_string  搜索串；
+            limit          返回的生词个数的上限。
         返回值：
-            包含符合条件的生词 list 实例。
+            包含符合条件的生词 list 实例，按匹配程度排序。
+    """
+    if len(search_string) <= 2:
+        word_ids = p_search_indexed_word_ids(search_string)[:limit]
+        words = dict((w.id, w) for w in Word.objects.filter(id__in = word_ids).prefetch_related('word_classes', 'meanings__examples'))
+        return [words[word_id] for word_id in word_ids if word_id in words]
+
+    grams = p_query_grams(search_string)
+    word_ids = SearchGram.objects.filter(gram__in = grams) \
+                                 .values('word_id', 'source') \
+                                 .annotate(matched = Count('gram', distinct = True)) \
+                                 .filter(matched = len(grams)) \
+                                 .values_list('word_id', flat = True)
+    words = Word.objects.filter(id__in = list(set(word_ids))).prefetch_related('word_classes', 'meanings__examples')
+
+    ranked_words = []
+    for word in words:
+        rank = p_rank_search_result(word, search_string)
+        if rank is not None:
+            ranked_words.append((rank, word.kannji, word))
+    return [e[2] for e in sorted(ranked_words, key = lambda e: e[:2])[:limit]]
+
+def api_rebuild_search_index():
     """
-    p_validate_argument('search_string', search_string, str)
-    return Word.objects.filter(Q(kannji__contains = search_string) | Q(kana__contains = search_string)).order_by('kannji')
+    重新建立全部生词的搜索索引。
+        返回值：
+            建立索引的生词个数。
+    """
+    sources = {}
+    for word_id, kannji, kana in Word.objects.values_list('id', 'kannji', 'kana'):
+        sources[word_id] = [p_split_grams(kannji), p_split_grams(kana), set(), set()]
+    for word_id, text in Meaning.objects.values_list('word_id', 'text'):
+        sources[word_id][2] |= p_split_grams(text)
+    for word_id, text in Example.objects.values_list('meaning__word_id', 'text'):
+        sources[word_id][3] |= p_split_grams(text)
 
-def api_create_word_class(word_id, word_class):
+    with transaction.atomic():
+        SearchGram.objects.all().delete()
+        new_grams = []
+        for word_id, grams_list in sources.items():
+            for source, grams in enumerate(grams_list):
+                new_grams += [SearchGram(word_id = word_id, source = source, gram = gram) for gram in grams]
+            if len(new_grams) >= 10000:
+                SearchGram.objects.bulk_create(new_grams)
+                new_grams = []
+        SearchGram.objects.bulk_create(new_grams)
+    return len(sources)
+
+@p_validated
+def api_create_word_class(word_id: int, word_class: str):
     """
     新建一个词类。
         参数：
@@ -258,7 +596,6 @@ def api_create_word_class(word_id, word_class):
         返回值：
             新建的词类的 WordClass 实例。
     """
-    p_validate_argument('word_id', word_id, int, 'word_class', word_class, str)
     if not p_validate_word_class(word_class):
         raise APIException('"{0}" 不是合法的词类。'.format(word_class))
 
@@ -266,7 +603,8 @@ def api_create_word_class(word_id, word_class):
     new_word_class.save()
     return new_word_class
 
-def api_get_class_index(word_class):
+@p_validated
+def api_get_class_index(word_class: str):
     """
     根据词类名反查其对应的 index。
         参数：
@@ -274,14 +612,13 @@ def api_get_class_index(word_class):
         返回值：
             词类名所对应的 index。
     """
-    p_validate_argument('word_class', word_class, str)
-
     if word_class in WordClass.WORD_CLASS_DICTIONARY:
         return WordClass.WORD_CLASS_DICTIONARY[word_class]
     else:
         raise APIException('不存在的词类名。')
 
-def api_create_meaning(word_id, meaning):
+@p_validated
+def api_create_meaning(word_id: int, meaning: str):
     """
     新建一个释义。
         参数：
@@ -290,15 +627,16 @@ def api_create_meaning(word_id, meaning):
         返回值：
             新建的释义的 Meaning 实例。
     """
-    p_validate_argument('word_id', word_id, int, 'meaning', meaning, str)
     
     meaning = p_filter_meaning(meaning)
 
     new_meaning = Meaning(word_id = word_id, text = meaning)
     new_meaning.save()
+    p_index_word_text(word_id, 2, meaning)
     return new_meaning
 
-def api_create_example(meaning_id, example):
+@p_validated
+def api_create_example(meaning_id: int, example: str):
     """
     新建一个例子。
         参数：
@@ -307,39 +645,122 @@ def api_create_example(meaning_id, example):
         返回值：
             新建的例子的 Example 实例。
     """
-    p_validate_argument('meaning_id', meaning_id, int, 'example', example, str)
-
     example = p_filter_example(example)
 
     new_example = Example(meaning_id = meaning_id, text = example)
     new_example.save()
+    p_index_word_text(Meaning.objects.get(id = meaning_id).word_id, 3, example)
     return new_example
 
 
 # MARK - API for Word Lookup and Edition
 
-def api_lookup_word(kannji):
+LOOKUP_CACHE_TTL = timedelta(days = 30)
+LOOKUP_CACHE_MAX_ENTRIES = 10000
+LOOKUP_MEMORY_CACHE_SIZE = 256
+LOOKUP_MEMORY_CACHE = collections.OrderedDict()
+LOOKUP_MEMORY_CACHE_LOCK = threading.Lock()
+
+def p_remember_lookup_result(kannji, fetch_date, result):
+    """
+    将查询结果放入进程内的 LRU 缓存。
+    """
+    with LOOKUP_MEMORY_CACHE_LOCK:
+        LOOKUP_MEMORY_CACHE.pop(kannji, None)
+        LOOKUP_MEMORY_CACHE[kannji] = (fetch_date, result)
+        while len(LOOKUP_MEMORY_CACHE) > LOOKUP_MEMORY_CACHE_SIZE:
+            LOOKUP_MEMORY_CACHE.popitem(last = False)
+
+def p_store_lookup_result(kannji, result):
+    """
+    将查询结果写入持久化缓存，缓存条目超过上限时淘汰最久未被访问的条目。
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if LookupCache.objects.filter(query = kannji).update(result = result, fetch_date = now, access_date = now) == 0:
+            try:
+                with transaction.atomic():
+                    LookupCache.objects.create(query = kannji, result = result, fetch_date = now, access_date = now)
+            except IntegrityError:
+                # 同一生词的并发查询已经写入了该条目。
+                LookupCache.objects.filter(query = kannji).update(result = result, fetch_date = now, access_date = now)
+        overflow = LookupCache.objects.count() - LOOKUP_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            stale_ids = list(LookupCache.objects.order_by('access_date').values_list('id', flat = True)[:overflow])
+            LookupCache.objects.filter(id__in = stale_ids).delete()
+    p_remember_lookup_result(kannji, now, result)
+
+def p_lookup_word_cached(kannji):
+    """
+    查询生词，依次使用进程内缓存、持久化缓存及网络词典。缓存过期后重新查询网络词典，
+    查询失败时仍返回过期的缓存。
+        参数：
+            kannji  生词的汉字。
+        返回值：
+            WordExtractor.extract 返回值的 JSON。
+    """
+    now = timezone.now()
+    with LOOKUP_MEMORY_CACHE_LOCK:
+        entry = LOOKUP_MEMORY_CACHE.get(kannji)
+        if entry is not None and now - entry[0] < LOOKUP_CACHE_TTL:
+            LOOKUP_MEMORY_CACHE.move_to_end(kannji)
+            return entry[1]
+
+    cached = LookupCache.objects.filter(query = kannji).first()
+    if cached is not None and now - cached.fetch_date < LOOKUP_CACHE_TTL:
+        # 访问时间只用于淘汰，精确到小时即可，避免每次命中都写数据库。
+        if now - cached.access_date > timedelta(hours = 1):
+            LookupCache.objects.filter(id = cached.id).update(access_date = now)
+        p_remember_lookup_result(kannji, cached.fetch_date, cached.result)
+        return cached.result
+
+    try:
+        result = json.dumps(WordExtractor().extract(kannji))
+    except Exception as e:
+        if cached is None:
+            raise
+        return cached.result
+    p_store_lookup_result(kannji, result)
+    return result
+
+@p_validated
+def api_lookup_word(kannji: str):
     """
-    从网络词典中查询生词的信息。
+    从网络词典中查询生词的信息，查询结果会被缓存。
         参数：
             kannji  生词的汉字。
         返回值：
             包含查询到的所有生词的 list 实例。
     """
-    p_validate_argument('kannji', kannji, str)
-
     try:
-        extractor = WordExtractor()
-        words = extractor.extract(kannji)
+        words = json.loads(p_lookup_word_cached(kannji))
     except Exception as e:
         raise APIException('查询失败。')
 
+    existing_words = set(Word.objects.filter(kannji__in = [word['kannji'] for word in words]).values_list('kannji', 'kana'))
     for word in words:
-        if len(Word.objects.filter(kannji = word['kannji'], kana = word['kana'])) > 0:
+        if (word['kannji'], word['kana']) in existing_words:
             word['exists'] = True
     return words
 
-def api_insert_new_word(word_info):
+@p_validated
+def api_bulk_lookup_word(kannjis: Blank(list), output_path: str, workers: int = 4, rate = 2.0, retries: int = 3):
+    """
+    从网络词典中并发地批量查询生词，结果逐行以 JSON 格式写入 output_path。
+    output_path 中已经成功查询的生词会被跳过，因此中断后可以再次调用以继续查询。
+        参数：
+            kannjis      待查询的生词的 list 实例；
+            output_path  输出文件的路径；
+            workers      并发查询的线程数；
+            rate         每秒向词典网站发出的最大请求数；
+            retries      每个生词失败后的最大重试次数。
+        返回值：
+            包含跳过、成功及失败个数的 dict 实例。
+    """
+    return BulkLookup(workers = workers, rate = rate, retries = retries).run(kannjis, output_path)
+
+@p_validated
+def api_insert_new_word(word_info: WORD_INFO_SCHEMA):
     """
     插入一个新的生词（从网络词典中查询后，经由用户编辑确认）。
         参数：
@@ -347,27 +768,105 @@ def api_insert_new_word(word_info):
         返回值：
             插入的生词的 Word 实例。
     """
-    p_validate_dictionary('word_info', word_info,
-                              'kannji'      ,  str, False,
-                              'kana'        ,  str, False,
-                              'word_classes', list, False,
-                              'meanings'    , list, False,)
-
+    # word_info 已经整体校验过，内部调用跳过各自的参数校验。
     with transaction.atomic():
-        new_word = api_create_word(word_info['kannji'], word_info['kana'])
+        new_word = api_create_word.trusted(word_info['kannji'], word_info['kana'])
         for word_class in word_info['word_classes']:
-            new_word_class = api_create_word_class(new_word.id, word_class)
+            new_word_class = api_create_word_class.trusted(new_word.id, word_class)
         for meaning in word_info['meanings']:
-            p_validate_dictionary('meaning', meaning,
-                                      'text'    ,  str, False,
-                                      'examples', list,  True,)
-            new_meaning = api_create_meaning(new_word.id, meaning['text'])
+            new_meaning = api_create_meaning.trusted(new_word.id, meaning['text'])
             for example in meaning['examples']:
-                new_example = api_create_example(new_meaning.id, example)
+                new_example = api_create_example.trusted(new_meaning.id, example)
 
     return new_word
 
 
+@p_validated
+def api_insert_new_words(word_infos: Blank(ListOf(WORD_INFO_SCHEMA))):
+    """
+    批量插入多个新的生词。所有生词先全部校验，已存在的生词通过一次查询找出，之后在
+    一个事务中以批量 INSERT 插入，任何一个生词不合法时都不会插入任何生词。
+        参数：
+            word_infos  生词的基本信息的 list 实例，每一项的格式与 api_insert_new_word 的
+                        word_info 相同。
+        返回值：
+            插入的生词的 Word 实例的 list，顺序与 word_infos 相同。
+    """
+    cleaned_infos, keys = [], set()
+    for word_info in word_infos:
+        kannji, kana = p_filter_kannji(word_info['kannji']), p_filter_kana(word_info['kana'])
+        if (kannji, kana) in keys:
+            raise APIException('生词"{0}（{1}）"重复。'.format(kannji, kana))
+        keys.add((kannji, kana))
+
+        for word_class in word_info['word_classes']:
+            if not p_validate_word_class(word_class):
+                raise APIException('"{0}" 不是合法的词类。'.format(word_class))
+        meanings = []
+        for meaning in word_info['meanings']:
+            meanings.append({'text': p_filter_meaning(meaning['text']),
+                             'examples': [p_filter_example(example) for example in meaning['examples']]})
+        cleaned_infos.append({'kannji': kannji, 'kana': kana, 'word_classes': list(word_info['word_classes']), 'meanings': meanings})
+
+    if len(cleaned_infos) == 0:
+        return []
+
+    existing_words = Word.objects.filter(kannji__in = set(k[0] for k in keys)).values_list('kannji', 'kana')
+    for kannji, kana in existing_words:
+        if (kannji, kana) in keys:
+            raise APIException('生词"{0}（{1}）"已经存在。'.format(kannji, kana))
+
+    with transaction.atomic():
+        new_words = p_bulk_create_words(cleaned_infos)
+        p_update_kana_neighbor_index(*[info['kana'] for info in cleaned_infos])
+    return new_words
+
+
+def p_bulk_create_words(word_infos):
+    """
+    以批量 INSERT 插入多个生词及其词类、释义、例句，并建立搜索索引。调用者负责
+    校验 word_infos 并排除已经存在的生词。假名近邻索引不会被更新，新的假名会在
+    首次出题时计算其近邻，其他假名的近邻记录可通过 api_build_kana_neighbor_index 重建。
+        参数：
+            word_infos  生词信息的 list 实例，格式与 api_insert_new_word 的 word_info 相同，
+                        其中的 word_classes 为词类名。
+        返回值：
+            插入的生词的 Word 实例的 list，顺序与 word_infos 相同。
+    """
+    with transaction.atomic():
+        # SQLite 下 bulk_create 不会回填主键，因此根据插入前的最大 ID 取回新插入的行。
+        last_word_id = Word.objects.aggregate(Max('id'))['id__max'] or 0
+        last_meaning_id = Meaning.objects.aggregate(Max('id'))['id__max'] or 0
+
+        Word.objects.bulk_create([Word(kannji = info['kannji'], kana = info['kana']) for info in word_infos])
+        keys = set((info['kannji'], info['kana']) for info in word_infos)
+        new_words = dict(((w.kannji, w.kana), w) for w in Word.objects.filter(id__gt = last_word_id) if (w.kannji, w.kana) in keys)
+        new_words = [new_words[(info['kannji'], info['kana'])] for info in word_infos]
+
+        WordClass.objects.bulk_create([WordClass(word_id = word.id, word_class = WordClass.WORD_CLASS_DICTIONARY[word_class])
+                                       for word, info in zip(new_words, word_infos) for word_class in info['word_classes']])
+        Meaning.objects.bulk_create([Meaning(word_id = word.id, text = meaning['text'])
+                                     for word, info in zip(new_words, word_infos) for meaning in info['meanings']])
+
+        meaning_ids = {}
+        for meaning_id, word_id in Meaning.objects.filter(id__gt = last_meaning_id).order_by('id').values_list('id', 'word_id'):
+            meaning_ids.setdefault(word_id, []).append(meaning_id)
+        new_examples, new_grams = [], []
+        for word, info in zip(new_words, word_infos):
+            for meaning_id, meaning in zip(meaning_ids.get(word.id, []), info['meanings']):
+                new_examples += [Example(meaning_id = meaning_id, text = example) for example in meaning['examples']]
+
+            texts = [[word.kannji], [word.kana], [m['text'] for m in info['meanings']], [e for m in info['meanings'] for e in m['examples']]]
+            for source, source_texts in enumerate(texts):
+                grams = set().union(*(p_split_grams(text) for text in source_texts))
+                new_grams += [SearchGram(word_id = word.id, source = source, gram = gram) for gram in grams]
+        Example.objects.bulk_create(new_examples)
+        SearchGram.objects.bulk_create(new_grams)
+        # bulk_create 不发送 post_save 信号，需要手动递增版本号。
+        p_touch_change_version('vocabulary')
+    return new_words
+
+
 # MARK - API for Exam & Question
 
 def p_lcs_length(sequence1, sequence2):
@@ -378,28 +877,144 @@ def p_lcs_length(sequence1, sequence2):
         返回值：
             最长公共子序列的长度。
     """
-    if len(sequence1) == 0 or len(sequence2) == 0: return 0
-    f = {'max': 0}
-    for i in range(len(sequence1)):
-        for j in range(len(sequence2)):
-            f[(i, j)] = 1 if sequence1[i] == sequence2[j] else 0
-            if i > 0 and j > 0:
-                f[(i, j)] += f[(i - 1, j - 1)]
-            if i > 0 and f[(i - 1, j)] > f[(i, j)]:
-                f[(i, j)] = f[(i - 1, j)]
-            if j > 0 and f[(i, j - 1)] > f[(i, j)]:
-                f[(i, j)] = f[(i, j - 1)]
-            if f[(i, j)] > f['max']:
-                f['max'] = f[(i, j)]
-    return f['max']
-
-def p_create_kana_question(word, user, num_of_options = 6):
-    """
-    生成一个假名测试问题。
-    """
-    lcs_dict = dict((w.kana, p_lcs_length(word.kana, w.kana)) for w in Word.objects.all() if w.kana != word.kana)
-    kana_options = sorted(list(lcs_dict.items()), key = lambda e: (-e[1], e[0]))[:2 * num_of_options]
-    options = [e[0] for e in random.sample(kana_options, num_of_options - 1)] + [word.kana]
+    return lcs_length(sequence1, sequence2)
+
+KANA_NEIGHBOR_INDEX_SIZE = 12
+
+def p_rank_kana_neighbors(kana, candidates, size = KANA_NEIGHBOR_INDEX_SIZE):
+    """
+    计算与 kana 最相似的假名，相似度为 LCS 的长度。
+        参数：
+            kana        待查询的假名；
+            candidates  候选假名的序列，可以包含重复项及 kana 本身；
+            size        返回的假名个数的上限。
+        返回值：
+            按 (-LCS 长度, 假名) 排序的 (假名, LCS 长度) list 实例。
+    """
+    return LCSScorer(kana).rank((c for c in set(candidates) if c != kana), size)
+
+def p_store_kana_neighbors(kana, neighbors):
+    """
+    将 kana 的近邻写入假名近邻索引，覆盖原有的记录。
+        参数：
+            kana       假名；
+            neighbors  p_rank_kana_neighbors 返回的近邻 list 实例。
+    """
+    KanaNeighbor.objects.filter(kana = kana).delete()
+    KanaNeighbor.objects.bulk_create([KanaNeighbor(kana = kana, neighbor = n, lcs_length = l) for n, l in neighbors])
+
+def p_update_kana_neighbor_index(*kanas):
+    """
+    在新增生词之后增量更新假名近邻索引：为新的假名建立近邻记录，并将其插入到
+    其他假名的近邻记录中（若其足够相似）。已有的近邻记录只按假名汇总记录数及最小的
+    LCS 长度，只有可能被新的假名挤出的记录（LCS 长度不超过新的假名的记录）才会被读取。
+        参数：
+            kanas  新增生词的假名。
+    """
+    new_kanas = set(kanas) - set(KanaNeighbor.objects.filter(kana__in = set(kanas)).values_list('kana', flat = True))
+    if len(new_kanas) == 0:
+        return
+
+    all_kanas = set(Word.objects.values_list('kana', flat = True))
+    rankings = dict((kana, p_rank_kana_neighbors(kana, all_kanas, size = len(all_kanas))) for kana in new_kanas)
+    thresholds = {}
+    for kana in new_kanas:
+        for k, lcs_length in rankings[kana]:
+            thresholds[k] = max(thresholds.get(k, 0), lcs_length)
+
+    # 尚未建立近邻记录的假名会在首次读取时由 p_get_kana_neighbors 计算，这里只维护已有的记录。
+    # counts 为受影响的假名的记录数，entries 为其中 LCS 长度不超过阈值的记录。
+    counts = {}
+    summaries = KanaNeighbor.objects.values('kana').annotate(count = Count('id'), worst = Min('lcs_length'))
+    for summary in summaries.values_list('kana', 'count', 'worst'):
+        k, count, worst = summary
+        if k not in new_kanas and k in thresholds and (count < KANA_NEIGHBOR_INDEX_SIZE or thresholds[k] >= worst):
+            counts[k] = count
+
+    entries = dict((k, []) for k in counts)
+    affected_kanas = sorted(counts)
+    for i in range(0, len(affected_kanas), 500):
+        chunk = affected_kanas[i:i + 500]
+        for entry in (KanaNeighbor.objects.filter(kana__in = chunk, lcs_length__lte = max(thresholds[k] for k in chunk))
+                                          .values_list('id', 'kana', 'neighbor', 'lcs_length')):
+            entries[entry[1]].append(entry)
+
+    stale_entry_ids = []
+    for kana in sorted(new_kanas):
+        for k, lcs_length in rankings[kana]:
+            if k not in counts or kana in (e[2] for e in entries[k]):
+                continue
+            if counts[k] >= KANA_NEIGHBOR_INDEX_SIZE:
+                if len(entries[k]) == 0:
+                    continue
+                worst_entry = max(entries[k], key = lambda e: (-e[3], e[2]))
+                if (-lcs_length, kana) >= (-worst_entry[3], worst_entry[2]):
+                    continue
+                entries[k].remove(worst_entry)
+                if worst_entry[0] is not None:
+                    stale_entry_ids.append(worst_entry[0])
+            else:
+                counts[k] += 1
+            entries[k].append((None, k, kana, lcs_length))
+        entries[kana] = [(None, kana, n, l) for n, l in rankings[kana][:KANA_NEIGHBOR_INDEX_SIZE]]
+
+    KanaNeighbor.objects.filter(id__in = stale_entry_ids).delete()
+    KanaNeighbor.objects.bulk_create([KanaNeighbor(kana = e[1], neighbor = e[2], lcs_length = e[3])
+                                      for k_entries in entries.values() for e in k_entries if e[0] is None])
+
+def p_get_kana_neighbors(kana, size = KANA_NEIGHBOR_INDEX_SIZE):
+    """
+    从假名近邻索引中读取与 kana 最相似的假名，索引中缺少该假名时即时计算并写入索引。
+        参数：
+            kana  待查询的假名；
+            size  返回的假名个数的上限。
+        返回值：
+            按相似度降序排列的假名 list 实例。
+    """
+    neighbors = list(KanaNeighbor.objects.filter(kana = kana)
+                                         .order_by('-lcs_length', 'neighbor')
+                                         .values_list('neighbor', flat = True)[:size])
+    if len(neighbors) == 0:
+        ranked = p_rank_kana_neighbors(kana, Word.objects.values_list('kana', flat = True))
+        p_store_kana_neighbors(kana, ranked)
+        neighbors = [e[0] for e in ranked[:size]]
+    return neighbors
+
+def api_build_kana_neighbor_index():
+    """
+    重新建立全部生词的假名近邻索引。
+        返回值：
+            建立索引的假名个数。
+    """
+    kanas = sorted(set(Word.objects.values_list('kana', flat = True)))
+    with transaction.atomic():
+        KanaNeighbor.objects.all().delete()
+        for kana in kanas:
+            neighbors = p_rank_kana_neighbors(kana, kanas)
+            KanaNeighbor.objects.bulk_create([KanaNeighbor(kana = kana, neighbor = n, lcs_length = l) for n, l in neighbors])
+    return len(kanas)
+
+def p_create_question_payload(word):
+    """
+    生成问题中用于展示的生词信息，在创建问题时一并存入 Question.payload，
+    这样返回问题时无需再查询生词、释义和词类。
+        参数：
+            word  问题所针对的生词。
+        返回值：
+            包含汉字、释义及词类的 dict 实例。
+    """
+    return {
+        'kannji'      : word.kannji,
+        'meanings'    : [m.text for m in word.meanings.all()],
+        'word_classes': '，'.join(w.class_name for w in word.word_classes.all()),
+    }
+
+def p_create_kana_question(word, user, num_of_options = 6, pooled = False):
+    """
+    生成一个假名测试问题。干扰项取自假名近邻索引。
+    """
+    kana_options = p_get_kana_neighbors(word.kana, size = 2 * num_of_options)
+    options = random.sample(kana_options, num_of_options - 1) + [word.kana]
     random.shuffle(options)
 
     for i in range(len(options)):
@@ -411,7 +1026,9 @@ def p_create_kana_question(word, user, num_of_options = 6):
                               question_type = 0,
                                    question = json.dumps(options),
                              correct_answer = str(correct_answer),
-                                    user_id = user.id)
+                                    user_id = user.id,
+                                    payload = json.dumps(p_create_question_payload(word)),
+                                     pooled = pooled)
     new_question.save()
     return new_question
 
@@ -458,6 +1075,43 @@ def p_calculate_unfamiliarity(learned_word):
     correct_answered_count = learned_word.correct_answered_count
     return p_calculate_unfamiliarity_with_params(time_delta, unfamiliarity, correct_answered_count)
 
+# 用户 ID 到 (载入时的已学习生词版本, UnfamiliaritySampler 实例)。
+UNFAMILIARITY_SAMPLERS = {}
+
+def p_get_learned_words_version(user_id):
+    """
+    获取用户的已学习生词的版本，即 UserStatistics.modified_date。回答问题、每日重新计算
+    不熟悉度以及批量重新计算已学习生词时都会更新统计数据汇总，因此其他进程对已学习生词
+    的修改可以由此发现。用户还没有统计数据汇总时为 None。
+    """
+    versions = list(UserStatistics.objects.filter(user_id = user_id).values_list('modified_date', flat = True))
+    return versions[0] if len(versions) > 0 else None
+
+def p_get_unfamiliarity_sampler(user_id):
+    """
+    获取用户的已学习生词抽样器。首次使用或已学习生词的版本变化（例如被其他进程修改）
+    时从数据库中载入。抽样器在 api_answer_question 中同步更新，在批量重新计算不熟悉度
+    之后失效。
+        参数：
+            user_id  用户的 ID。
+        返回值：
+            该用户的 UnfamiliaritySampler 实例。
+    """
+    version = p_get_learned_words_version(user_id)
+    cached = UNFAMILIARITY_SAMPLERS.get(user_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    sampler = UnfamiliaritySampler(LearnedWord.objects.filter(user_id = user_id).values_list('word_id', 'unfamiliarity'))
+    UNFAMILIARITY_SAMPLERS[user_id] = (version, sampler)
+    return sampler
+
+def p_invalidate_unfamiliarity_sampler(user_id):
+    """
+    使用户的已学习生词抽样器失效，下次使用时将重新载入。
+    """
+    UNFAMILIARITY_SAMPLERS.pop(user_id, None)
+    p_touch_change_version(p_learned_version_key(user_id))
+
 def p_prune_question(question):
     """
     修剪生成的问题，隐去不必要的信息。
@@ -473,38 +1127,64 @@ def p_prune_question(question):
     }
 
     if question.question_type == 0:
-        pruned_question['question']     = json.loads(pruned_question['question'])
-        pruned_question['kannji']       = question.related_word.kannji
-        pruned_question['meanings']     = [m.text for m in question.related_word.meanings]
-        pruned_question['word_classes'] = '，'.join(w.class_name for w in question.related_word.word_classes)
+        pruned_question['question'] = json.loads(pruned_question['question'])
+        if question.payload != '':
+            pruned_question.update(json.loads(question.payload))
+        else:
+            pruned_question.update(p_create_question_payload(question.related_word))
 
     return pruned_question
 
-def api_create_question(user, new_word_prob = 0.4, unfamiliarity_threshold = 1, return_unanswered = True):
+def p_choose_unlearned_word(user_id):
+    """
+    随机选取一个用户尚未学习的生词。只执行一次计数和一次带随机偏移量的反连接查询。
+        参数：
+            user_id  用户的 ID。
+        返回值：
+            选中的生词的 Word 实例。所有生词均已学习时抛出 APIException。
+    """
+    unlearned_words = Word.objects.exclude(id__in = LearnedWord.objects.filter(user_id = user_id).values('word_id'))
+    count = unlearned_words.count()
+    if count == 0:
+        raise APIException('所有生词均已学习。')
+    return unlearned_words.order_by('id')[random.randrange(count)]
+
+def p_get_unanswered_question(user_id):
+    """
+    取出用户已经取出但尚未回答的问题，问题预生成池中尚未取出的问题除外。
+        返回值：
+            修剪后的问题，与 api_create_question 的返回值相同；没有这样的问题时返回 None。
+    """
+    unanswered_questions = Question.objects.filter(user_id = user_id, answered = False, pooled = False)
+    if len(unanswered_questions) == 0:
+        return None
+    choosed_question = random.choice(unanswered_questions)
+    try:
+        unfamiliarity = p_calculate_unfamiliarity(LearnedWord.objects.get(user_id = user_id, word_id = choosed_question.related_word_id))
+    except:
+        unfamiliarity = 1.0
+    choosed_question = p_prune_question(choosed_question)
+    choosed_question['unfamiliarity'] = unfamiliarity
+    return choosed_question
+
+@p_validated
+def api_create_question(user: User, new_word_prob = 0.4, unfamiliarity_threshold = 1, return_unanswered = True, pooled = False):
     """
     为给定的 user 生成一个新的问题，测试的形式和所测试的问题由该算法决定。
-    目前的选取方法为：计算生词的修正不熟悉程度，降序排列后从前十中随机抽取。
+    目前的选取方法为：以生词的不熟悉度为权重，从已学习的生词中随机抽取。
         参数：
             user                     要生成测试的用户；
             new_word_prob            选择新单词的概率；
             unfamiliarity_threshold  不熟悉度阈值，若有生词的不熟悉度超过此值，则不会选择新词；
-            return_unanswered        若设为 True，当数据库中有未回答的问题时，先返回该问题。
+            return_unanswered        若设为 True，当数据库中有未回答的问题时，先返回该问题；
+            pooled                   若设为 True，生成的问题标记为问题预生成池中尚未取出的问题。
         返回值：
             生成的问题的 Question 实例。
     """
-    p_validate_argument('user', user, User)
-
     if return_unanswered:
-        unanswered_questions = Question.objects.filter(user_id = user.id, answered = False)
-        if len(unanswered_questions) > 0:
-            choosed_question = random.choice(unanswered_questions)
-            try:
-                unfamiliarity = p_calculate_unfamiliarity(LearnedWord.objects.get(word_id = choosed_question.related_word_id))
-            except:
-                unfamiliarity = 1.0
-            choosed_question = p_prune_question(choosed_question)
-            choosed_question['unfamiliarity'] = unfamiliarity
-            return choosed_question
+        unanswered_question = p_get_unanswered_question(user.id)
+        if unanswered_question is not None:
+            return unanswered_question
 
     try:
         latest_history = UpdateHistory.objects.filter(user_id = user.id).latest('update_date')
@@ -515,39 +1195,45 @@ def api_create_question(user, new_word_prob = 0.4, unfamiliarity_threshold = 1,
 
     if needs_update:
         with transaction.atomic():
+            unfamiliarity_sum = 0.0
             for learned_word in LearnedWord.objects.filter(user_id = user.id):
                 learned_word.unfamiliarity = p_calculate_unfamiliarity(learned_word)
                 learned_word.save()
+                unfamiliarity_sum += learned_word.unfamiliarity
+            UserStatistics.objects.filter(user_id = user.id).update(unfamiliarity_sum = unfamiliarity_sum, modified_date = timezone.now())
             new_update_history = UpdateHistory(user_id = user.id)
             new_update_history.save()
+        p_invalidate_unfamiliarity_sampler(user.id)
 
-    learned_words = LearnedWord.objects.filter(user_id = user.id).order_by('-unfamiliarity')
-    if len(learned_words) == 0:
+    sampler = p_get_unfamiliarity_sampler(user.id)
+    choosed_entry = sampler.sample()
+    if choosed_entry is None:
         choose_new = True
     else:
-        average_unfamiliarity = sum(learned_word.unfamiliarity for learned_word in learned_words) / len(learned_words)
-        if average_unfamiliarity >= unfamiliarity_threshold:
+        if sampler.average_unfamiliarity >= unfamiliarity_threshold:
             choose_new = False
         else:
             choose_new = True if random.random() < new_word_prob else False
 
     if choose_new:
-        while True:
-            choosed_word = random.choice(Word.objects.all())
-            if len(LearnedWord.objects.filter(user_id = user.id, word_id = choosed_word.id)) == 0:
-                break
-        unfamiliarity = 1.0
-    else:
-        choosed_entry = random.choice(learned_words.filter(unfamiliarity__gte = 0.1))
-        choosed_word, unfamiliarity = choosed_entry.word, choosed_entry.unfamiliarity
+        try:
+            choosed_word = p_choose_unlearned_word(user.id)
+            unfamiliarity = 1.0
+        except APIException:
+            if choosed_entry is None:
+                raise
+            choose_new = False
+
+    if not choose_new:
+        choosed_word, unfamiliarity = Word.objects.get(id = choosed_entry[0]), choosed_entry[1]
 
-    new_question = random.choice(QUESTION_GENERATOR_FUNCTIONS)(word = choosed_word, user = user)
+    new_question = random.choice(QUESTION_GENERATOR_FUNCTIONS)(word = choosed_word, user = user, pooled = pooled)
     new_question = p_prune_question(new_question)
     new_question['unfamiliarity'] = unfamiliarity
-    print('Unfamiliarity: {0}'.format(unfamiliarity))
     return new_question
 
-def api_answer_question(user_id, question_id, answer):
+@p_validated
+def api_answer_question(user_id: int, question_id: int, answer: str):
     """
     提交对应问题的回答。
         参数：
@@ -555,8 +1241,6 @@ def api_answer_question(user_id, question_id, answer):
             question_id  要回答的问题的 ID；
             answer       用户的回答。
     """
-    p_validate_argument('user_id', user_id, int, 'question_id', question_id, int, 'answer', answer, str)
-
     questions = Question.objects.filter(id = question_id)
     if len(questions) != 1:
         raise APIException('不存在的问题。')
@@ -574,12 +1258,19 @@ def api_answer_question(user_id, question_id, answer):
         question.answer_is_correct = True if question.correct_answer == answer else False
         question.save()
 
+        # 只有抽样器载入之后没有其他修改时，才可以在其上增量更新。在第一次写入之后读取，
+        # 此时事务已持有写锁，读到的即是本次更新之前的版本（SQLite 的事务若先读后写，
+        # 在升级为写锁时会与其他写入者冲突而立即失败）。
+        previous_version = p_get_learned_words_version(user_id) if user_id in UNFAMILIARITY_SAMPLERS else None
+
         learned_words = LearnedWord.objects.filter(word_id = question.related_word_id, user_id = user_id)
         if len(learned_words) == 0:
             learned_word = LearnedWord(word_id = question.related_word_id, user_id = user_id)
             learned_word.save()
+            is_new_word, previous_unfamiliarity = True, 0.0
         else:
             learned_word = learned_words[0]
+            is_new_word, previous_unfamiliarity = False, learned_word.unfamiliarity
 
         learned_word.last_review_date = timezone.now().date()
         learned_word.unfamiliarity = p_calculate_unfamiliarity(learned_word)
@@ -592,69 +1283,199 @@ def api_answer_question(user_id, question_id, answer):
         learned_word.unfamiliarity = p_bound_value(learned_word.unfamiliarity, (0, 1))
         learned_word.save()
 
-        return question.correct_answer
+        version = p_update_statistics(user_id, question, is_new_word, learned_word.unfamiliarity - previous_unfamiliarity)
+
+    cached = UNFAMILIARITY_SAMPLERS.get(user_id)
+    if cached is not None and previous_version is not None and cached[0] == previous_version:
+        cached[1].update(learned_word.word_id, learned_word.unfamiliarity)
+        UNFAMILIARITY_SAMPLERS[user_id] = (version, cached[1])
+    else:
+        UNFAMILIARITY_SAMPLERS.pop(user_id, None)
+    return question.correct_answer
+
+def p_replay_learned_words(user_id, answers):
+    """
+    在内存中按时间顺序重放回答记录，计算每个已学习生词的信息。
+        参数：
+            user_id  用户的 ID；
+            answers  (生词 ID, 回答时间, 是否正确) 的可迭代对象，须按 (生词 ID, 回答时间) 排序。
+        返回值：
+            未保存的 LearnedWord 实例的生成器，每个生词一个。
+    """
+    for word_id, word_answers in itertools.groupby(answers, key = lambda answer: answer[0]):
+        learned_word = None
+        for word_id, answer_date, answer_is_correct in word_answers:
+            if learned_word is None:
+                learned_word = LearnedWord(word_id = word_id, user_id = user_id, unfamiliarity = 1,
+                                           learned_date = answer_date.date(), last_review_date = answer_date.date())
+
+            time_delta = answer_date.date() - learned_word.last_review_date
+            unfamiliarity = p_calculate_unfamiliarity_with_params(time_delta, learned_word.unfamiliarity, learned_word.correct_answered_count)
+
+            learned_word.total_answered_count += 1
+            if answer_is_correct:
+                learned_word.correct_answered_count += 1
+                unfamiliarity -= 1 / UNFAMILIARITY_COEFFICIENT
+            else:
+                unfamiliarity += 1 / UNFAMILIARITY_COEFFICIENT
+
+            learned_word.unfamiliarity = p_bound_value(unfamiliarity, (0, 1))
+            learned_word.last_review_date = answer_date.date()
+        yield learned_word
 
 def p_recheck_leanred_words(user):
     """
-    重新检查并计算给定用户的已学习生词的信息。
+    重新检查并计算给定用户的已学习生词的信息。只读取并覆盖该用户的记录。
         参数：
             待重新检查的用户的 ID。
+        返回值：
+            重新计算的已学习生词的个数。
     """
+    answers = Question.objects.filter(user_id = user.id, answered = True) \
+                              .order_by('related_word', 'answer_date') \
+                              .values_list('related_word_id', 'answer_date', 'answer_is_correct')
+    daily_counts = {}
+    learned_words = list(p_replay_learned_words(user.id, p_count_daily_answers(answers.iterator(), daily_counts)))
+
     with transaction.atomic():
-        LearnedWord.objects.all().delete()
+        LearnedWord.objects.filter(user_id = user.id).delete()
+        LearnedWord.objects.bulk_create(learned_words, batch_size = 500)
+        p_store_statistics(user.id, daily_counts, len(learned_words), sum(lw.unfamiliarity for lw in learned_words))
 
-        question_dict = {}
-        for question in Question.objects.filter(user_id = user.id, answered = True):
-            if question.related_word_id not in question_dict:
-                question_dict[question.related_word_id] = []
-            question_dict[question.related_word_id].append(question)
+    p_invalidate_unfamiliarity_sampler(user.id)
+    return len(learned_words)
 
-        for key, value in question_dict.items():
-            learned_word = LearnedWord(word_id = key, user_id = user.id)
-            learned_word.save()
-            value.sort(key = lambda q: q.answer_date)
-
-            unfamiliarity = 1
-            learned_word.learned_date = current_date = value[0].answer_date.date()
-            total_answered_count = 0
-            correct_answered_count = 0
-
-            for question in value:
-                time_delta = question.answer_date.date() - current_date
-                unfamiliarity = p_calculate_unfamiliarity_with_params(time_delta, unfamiliarity, correct_answered_count)
-                
-                total_answered_count += 1
-                if question.answer_is_correct:
-                    correct_answered_count += 1
-                    unfamiliarity -= 1 / UNFAMILIARITY_COEFFICIENT
-                else:
-                    unfamiliarity += 1 / UNFAMILIARITY_COEFFICIENT
-
-                unfamiliarity = p_bound_value(unfamiliarity, (0, 1))
-                current_date = question.answer_date.date()
-
-            learned_word.last_review_date = current_date
-            learned_word.total_answered_count = total_answered_count
-            learned_word.correct_answered_count = correct_answered_count
-            learned_word.unfamiliarity = unfamiliarity
-            learned_word.save()
+def p_recheck_learned_words_worker(user_id):
+    """
+    在子进程中重新计算一个用户的已学习生词，结束后关闭该进程的数据库连接。
+    """
+    try:
+        return user_id, p_recheck_leanred_words(User.objects.get(id = user_id))
+    finally:
+        connection.close()
+
+@p_validated
+def api_rebuild_learned_words(user_ids: Blank((list, type(None))) = None, processes: int = 1):
+    """
+    根据回答记录重新计算用户的已学习生词，例如在修改了不熟悉度的计算公式之后。
+    每个用户的计算相互独立，processes 大于 1 时由多个进程并行计算。
+        参数：
+            user_ids   待重新计算的用户 ID 的 list 实例，None 表示全部用户；
+            processes  并行计算的进程数。
+        返回值：
+            用户 ID 到重新计算的已学习生词个数的 dict 实例。
+    """
+    if user_ids is None:
+        user_ids = list(User.objects.values_list('id', flat = True))
+    if processes <= 1 or len(user_ids) <= 1:
+        return dict((user_id, p_recheck_leanred_words(User.objects.get(id = user_id))) for user_id in user_ids)
+
+    # 子进程不能共用父进程的数据库连接，每个子进程会建立自己的连接。
+    connection.close()
+    with multiprocessing.Pool(processes) as pool:
+        return dict(pool.imap_unordered(p_recheck_learned_words_worker, user_ids))
 
 # MARK - API for Statistics
 
-def p_stat_correct_answer_probability(user):
+"""
+    统计数据保存在 UserStatistics 及 DailyStatistics 中，由 api_answer_question 在同一个事务中
+    增量更新。缺少汇总记录的用户（例如升级之前已有的用户）会在首次使用时重新计算。
+"""
+
+def p_statistics_date(answer_date):
+    """
+    取得回答时间所在的（本地时间的）日期。
+    """
+    return timezone.localtime(answer_date).date()
+
+def p_count_daily_answers(answers, daily_counts):
     """
-    统计用户回答问题的正确率。
+    统计每天回答的问题个数及回答正确的个数，同时依次返回 answers 中的每一项，以便在
+    读取一次回答记录的同时完成其他计算。
         参数：
-            user  待统计的用户。
+            answers       最后两项为 (回答时间, 是否正确) 的元组的可迭代对象；
+            daily_counts  日期到 [回答个数, 正确个数] 的 dict 实例，统计结果累加到其中。
+    """
+    for answer in answers:
+        counts = daily_counts.setdefault(p_statistics_date(answer[-2]), [0, 0])
+        counts[0] += 1
+        counts[1] += 1 if answer[-1] else 0
+        yield answer
+
+def p_store_statistics(user_id, daily_counts, learned_word_count, unfamiliarity_sum):
+    """
+    写入用户的统计数据汇总，覆盖原有的记录。
         返回值：
-            该用户的正确率。
+            新的 UserStatistics 实例。
     """
-    p_validate_argument('user', user, User)
+    with transaction.atomic():
+        UserStatistics.objects.filter(user_id = user_id).delete()
+        DailyStatistics.objects.filter(user_id = user_id).delete()
+        statistics = UserStatistics.objects.create(user_id = user_id,
+                                                   answered_count = sum(c[0] for c in daily_counts.values()),
+                                                   correct_answered_count = sum(c[1] for c in daily_counts.values()),
+                                                   learned_word_count = learned_word_count,
+                                                   unfamiliarity_sum = unfamiliarity_sum)
+        DailyStatistics.objects.bulk_create([DailyStatistics(user_id = user_id, date = d, answered_count = c[0], correct_answered_count = c[1])
+                                             for d, c in daily_counts.items()])
+    return statistics
+
+def p_rebuild_statistics(user_id):
+    """
+    根据已回答的问题及已学习生词重新计算用户的统计数据汇总，覆盖原有的记录。
+        参数：
+            user_id  用户的 ID。
+        返回值：
+            重新计算的 UserStatistics 实例。
+    """
+    daily_counts = {}
+    answers = Question.objects.filter(user_id = user_id, answered = True).values_list('answer_date', 'answer_is_correct')
+    for answer in p_count_daily_answers(answers.iterator(), daily_counts):
+        pass
+    learned_words = LearnedWord.objects.filter(user_id = user_id).aggregate(count = Count('id'), unfamiliarity_sum = Sum('unfamiliarity'))
+    return p_store_statistics(user_id, daily_counts, learned_words['count'], learned_words['unfamiliarity_sum'] or 0.0)
 
-    return Question.objects.filter(user_id = user.id, answer_is_correct = True).count() / \
-           Question.objects.filter(user_id = user.id, answered = True).count()
+def p_update_statistics(user_id, question, is_new_word, unfamiliarity_delta):
+    """
+    在回答问题之后增量更新用户的统计数据汇总，应与回答问题在同一个事务中调用。
+        参数：
+            user_id              用户的 ID；
+            question             刚刚回答的问题的 Question 实例；
+            is_new_word          问题对应的生词是否为新学习的生词；
+            unfamiliarity_delta  该生词所记录的不熟悉度的变化量。
+        返回值：
+            统计数据汇总新的 modified_date。
+    """
+    correct_delta, modified_date = 1 if question.answer_is_correct else 0, timezone.now()
+    updated = UserStatistics.objects.filter(user_id = user_id).update(
+        answered_count         = F('answered_count') + 1,
+        correct_answered_count = F('correct_answered_count') + correct_delta,
+        learned_word_count     = F('learned_word_count') + (1 if is_new_word else 0),
+        unfamiliarity_sum      = F('unfamiliarity_sum') + unfamiliarity_delta,
+        modified_date          = modified_date)
+    if updated == 0:
+        # 问题及已学习生词已经写入，重新计算的结果包含本次回答。
+        return p_rebuild_statistics(user_id).modified_date
+
+    answer_date = p_statistics_date(question.answer_date)
+    updated = DailyStatistics.objects.filter(user_id = user_id, date = answer_date).update(
+        answered_count         = F('answered_count') + 1,
+        correct_answered_count = F('correct_answered_count') + correct_delta)
+    if updated == 0:
+        DailyStatistics.objects.create(user_id = user_id, date = answer_date, answered_count = 1, correct_answered_count = correct_delta)
+    return modified_date
+
+def p_get_statistics(user_id):
+    """
+    读取用户的统计数据汇总，不存在时重新计算。
+    """
+    try:
+        return UserStatistics.objects.get(user_id = user_id)
+    except UserStatistics.DoesNotExist:
+        return p_rebuild_statistics(user_id)
 
-def p_stat_answered_question_number_today(user, date = None):
+@p_validated
+def p_stat_answered_question_number_today(user: User, date = None):
     """
     统计用户在指定日期的一天内回答的问题总数。
         参数：
@@ -663,51 +1484,97 @@ def p_stat_answered_question_number_today(user, date = None):
         返回值：
             该天内回答的问题总数。
     """
-    p_validate_argument('user', user, User)
-
-    start_time = datetime.combine(date if isinstance(date, datetime) else datetime.now().date(), datetime.min.time())
-    end_time = start_time + timedelta(days = 1, microseconds = -1)
-    start_time = start_time.utcnow().replace(tzinfo = timezone.utc)
-    end_time = end_time.utcnow().replace(tzinfo = timezone.utc)
-    questions = Question.objects.filter(user_id = user.id,
-                                       answered = True,
-                               answer_date__gte = start_time,
-                               answer_date__lte = end_time)
-    return len(questions)
+    date = date if date is not None else p_statistics_date(timezone.now())
+    counts = DailyStatistics.objects.filter(user_id = user.id, date = date).values_list('answered_count', flat = True)
+    return counts[0] if len(counts) > 0 else 0
 
-def p_stat_number_of_answer_required_today(user, goal = 90):
+@p_validated
+def p_stat_number_of_answer_required_today(statistics: UserStatistics, goal: int = 90):
     """
     粗略估算用户一天内需要回答的问题个数。
         参数：
-            user  待估算的用户；
-            goal  预计完成学习的天数，默认为90天。
+            statistics  用户的 UserStatistics 实例；
+            goal        预计完成学习的天数，默认为90天。
         返回值：
-            今天应回答的问题个数（假设每天回答同样个数的问题）。
+            今天应回答的问题个数（假设每天回答同样个数的问题），正确率不足以降低
+            不熟悉度或天数不为正时返回 None。
     """
-    p_validate_argument('user', user, User, 'goal', goal, int)
-
-    speed = (2 * p_stat_correct_answer_probability(user) - 1) / UNFAMILIARITY_COEFFICIENT
-    learned_words = LearnedWord.objects.filter(user_id = user.id)
-    unfamiliarity_to_go = sum(lw.unfamiliarity for lw in learned_words) + \
-                          (Word.objects.count() - learned_words.count())
-    #Word.objects.count() * goal / (3 * UNFAMILIARITY_COEFFICIENT)
+    speed = (2 * statistics.correct_answer_probability - 1) / UNFAMILIARITY_COEFFICIENT
+    if speed <= 0 or goal <= 0:
+        return None
+    unfamiliarity_to_go = statistics.unfamiliarity_sum + (Word.objects.count() - statistics.learned_word_count)
     return unfamiliarity_to_go / speed / goal
 
-def p_stat_average_learned_word_familiarity(user):
-    """
-    """
-    p_validate_argument('user', user, User)
-
-    learned_words = LearnedWord.objects.filter(user_id = user.id)
-    return sum(learned_word.unfamiliarity for learned_word in learned_words) / len(learned_words)
-
-def api_get_statistics(user, finish_date = date(2014, 6, 20)):
+@p_validated
+def api_get_statistics(user: User, finish_date = date(2014, 6, 20)):
     """
     获取用户相关的统计数据
     """
+    statistics = p_get_statistics(user.id)
     return (
-        ('回答正确率', p_stat_correct_answer_probability(user)),
-        ('平均不熟悉度', p_stat_average_learned_word_familiarity(user)),
+        ('回答正确率', statistics.correct_answer_probability),
+        ('平均不熟悉度', statistics.average_unfamiliarity),
         ('今日回答问题数', p_stat_answered_question_number_today(user)),
-        ('今日应回答问题数', p_stat_number_of_answer_required_today(user, (finish_date - timezone.now().date()).days)),
+        ('今日应回答问题数', p_stat_number_of_answer_required_today(statistics, (finish_date - timezone.now().date()).days)),
     )
+
+
+# MARK - API for Conditional Requests
+
+"""
+    页面的条件请求（ETag / Last-Modified）所依据的版本信息。每个函数只执行一次简单的查询，
+    远比渲染页面便宜。生词、词类、释义及例句的增删改通过 post_save / post_delete 信号
+    （包括管理后台中的修改）递增 vocabulary 版本号，批量 INSERT 由 p_bulk_create_words 递增。
+"""
+
+def p_touch_vocabulary_version(sender, **kwargs):
+    p_touch_change_version('vocabulary')
+
+for model in (Word, WordClass, Meaning, Example):
+    post_save.connect(p_touch_vocabulary_version, sender = model, dispatch_uid = 'nihonngo.vocabulary.save.' + model.__name__)
+    post_delete.connect(p_touch_vocabulary_version, sender = model, dispatch_uid = 'nihonngo.vocabulary.delete.' + model.__name__)
+
+@p_validated
+def api_get_change_version(key: str):
+    """
+    获取持久化的变更版本号。
+        参数：
+            key  版本号的键，例如 vocabulary。
+        返回值：
+            (版本号, 最后变更时间) 的元组，从未变更过时为 (0, None)。
+    """
+    versions = list(ChangeVersion.objects.filter(key = key).values_list('version', 'modified_date'))
+    return versions[0] if len(versions) > 0 else (0, None)
+
+@p_validated
+def api_get_lookup_fetch_date(kannji: str):
+    """
+    获取生词的网络词典查询结果的缓存时间，不会查询网络词典。
+        参数：
+            kannji  生词的汉字。
+        返回值：
+            缓存的查询结果的获取时间，没有缓存或缓存已过期时为 None。
+    """
+    now = timezone.now()
+    with LOOKUP_MEMORY_CACHE_LOCK:
+        entry = LOOKUP_MEMORY_CACHE.get(kannji)
+    fetch_date = entry[0] if entry is not None else LookupCache.objects.filter(query = kannji).values_list('fetch_date', flat = True).first()
+    if fetch_date is not None and now - fetch_date < LOOKUP_CACHE_TTL:
+        return fetch_date
+    return None
+
+@p_validated
+def api_get_statistics_modified_date(user: User):
+    """
+    获取用户的统计数据最后一次更新的时间。
+        返回值：
+            datetime 实例，用户还没有统计数据汇总时为 None。
+    """
+    dates = list(UserStatistics.objects.filter(user_id = user.id).values_list('modified_date', flat = True))
+    return dates[0] if len(dates) > 0 else None
+
+
+# MARK - Instrumentation
+
+# 记录每个 API 的调用次数、耗时及 SQL 语句数，须在所有 API 定义之后调用。
+instrument_module(globals())
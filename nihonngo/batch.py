@@ -1,11 +1,149 @@
-from models import *
-from api import *
+from django.db import transaction
 
-def batch_import_from_string(string, word_separator =  '\n', component_separator = '||', meaning_separator = '#', example_separator = '*'):
-    line_count = 0
-    message = ''
+from nihonngo.models import Word, WordClass
+from nihonngo.api import p_filter_kannji, p_filter_kana, p_filter_meaning, p_filter_example, p_bulk_create_words, p_update_kana_neighbor_index
 
-    for word_string in string.split(word_separator):
-        components = word_string.split(component_separator)
-        if len(components) != 4:
-            message += ''
\ No newline at end of file
+import codecs
+
+"""
+    批量导入生词。输入的每一行为一个生词，格式为：
+        汉字||假名||词类1，词类2||释义1*例句1*例句2#释义2
+    导入以流的方式逐行读取，每 chunk_size 个生词在一个事务中以批量 INSERT 写入。写入之前
+    以每个 chunk 一次查询跳过已存在的生词。格式错误的行会被记录在导入报告中，不会中断
+    导入；一个 chunk 写入失败时逐行重新写入，只有出错的行被记录。假名近邻索引在写入每个
+    chunk 的同一个事务中增量更新，与 api_insert_new_words 相同。
+"""
+
+def p_parse_word_line(line, component_separator = '||', meaning_separator = '#', example_separator = '*'):
+    """
+    解析一行生词。
+        返回值：
+            生词信息的 dict 实例，格式与 api_insert_new_word 的 word_info 相同。
+            格式错误时抛出 ValueError。
+    """
+    components = line.split(component_separator)
+    if len(components) != 4:
+        raise ValueError('应有 4 个字段，实际为 {0} 个。'.format(len(components)))
+
+    kannji, kana = p_filter_kannji(components[0]), p_filter_kana(components[1])
+    if kannji == '' or kana == '':
+        raise ValueError('汉字或假名为空。')
+
+    word_classes = []
+    for word_class in components[2].replace(',', '，').split('，'):
+        word_class = word_class.strip()
+        if word_class == '':
+            continue
+        if word_class not in WordClass.WORD_CLASS_DICTIONARY:
+            raise ValueError('"{0}" 不是合法的词类。'.format(word_class))
+        word_classes.append(word_class)
+
+    meanings = []
+    for meaning in components[3].split(meaning_separator):
+        if meaning == '':
+            continue
+        items = meaning.split(example_separator)
+        meanings.append({'text': p_filter_meaning(items[0]), 'examples': [p_filter_example(e) for e in items[1:] if e != '']})
+
+    return {'kannji': kannji, 'kana': kana, 'word_classes': word_classes, 'meanings': meanings}
+
+# 每次查询中 IN 的参数个数，SQLite 限制一条语句最多 999 个参数。
+EXISTENCE_QUERY_SIZE = 500
+
+def p_existing_words(chunk):
+    """
+    查询 chunk 中已存在于生词表的生词。
+        返回值：
+            (汉字, 假名) 的 set 实例。
+    """
+    kannjis, existing_words = sorted(set(info['kannji'] for line_number, info in chunk)), set()
+    for i in range(0, len(kannjis), EXISTENCE_QUERY_SIZE):
+        existing_words |= set(Word.objects.filter(kannji__in = kannjis[i:i + EXISTENCE_QUERY_SIZE]).values_list('kannji', 'kana'))
+    return existing_words
+
+def p_insert_words(word_infos):
+    """
+    插入生词并更新假名近邻索引，两者在同一个事务中。
+    """
+    with transaction.atomic():
+        p_bulk_create_words(word_infos)
+        p_update_kana_neighbor_index(*[info['kana'] for info in word_infos])
+
+def p_flush_chunk(chunk, report):
+    existing_words = p_existing_words(chunk)
+    new_chunk = [(line_number, info) for line_number, info in chunk if (info['kannji'], info['kana']) not in existing_words]
+    report['duplicated'] += len(chunk) - len(new_chunk)
+    if len(new_chunk) == 0:
+        return
+
+    try:
+        p_insert_words([info for line_number, info in new_chunk])
+        report['imported'] += len(new_chunk)
+        return
+    except Exception:
+        pass
+
+    # 整个 chunk 已经回滚，逐行重新写入以找出出错的行。
+    for line_number, info in new_chunk:
+        try:
+            p_insert_words([info])
+            report['imported'] += 1
+        except Exception as e:
+            report['errors'].append((line_number, '写入失败：{0}'.format(e)))
+
+def batch_import(lines, chunk_size = 1000, **separators):
+    """
+    从可迭代的行中导入生词。
+        参数：
+            lines       生词行的可迭代对象，例如打开的文件；
+            chunk_size  每个事务中插入的生词个数；
+            separators  传给 p_parse_word_line 的分隔符。
+        返回值：
+            导入报告，包含导入个数 imported、重复个数 duplicated 及错误列表 errors，
+            errors 中每一项为 (行号, 错误描述)。
+    """
+    report = {'imported': 0, 'duplicated': 0, 'errors': []}
+    # 输入中已经出现过的生词；生词表中已存在的生词在写入每个 chunk 之前查询。
+    seen_words = set()
+    chunk = []
+
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        if line.strip() == '':
+            continue
+        try:
+            info = p_parse_word_line(line, **separators)
+        except ValueError as e:
+            report['errors'].append((line_number, str(e)))
+            continue
+
+        key = (info['kannji'], info['kana'])
+        if key in seen_words:
+            report['duplicated'] += 1
+            continue
+        seen_words.add(key)
+
+        chunk.append((line_number, info))
+        if len(chunk) >= chunk_size:
+            p_flush_chunk(chunk, report)
+            chunk = []
+
+    if len(chunk) > 0:
+        p_flush_chunk(chunk, report)
+    return report
+
+def batch_import_from_file(path, encoding = 'utf-8', **kwargs):
+    """
+    从文件中导入生词，参数及返回值同 batch_import。
+    """
+    with codecs.open(path, 'r', encoding) as fin:
+        return batch_import(fin, **kwargs)
+
+def batch_import_from_string(string, word_separator = '\n', component_separator = '||', meaning_separator = '#', example_separator = '*'):
+    """
+    从字符串中导入生词，返回值同 batch_import。
+    """
+    return batch_import(string.split(word_separator),
+                        component_separator = component_separator,
+                        meaning_separator = meaning_separator,
+                        example_separator = example_separator)
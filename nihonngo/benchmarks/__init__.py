@@ -0,0 +1,20 @@
+import codecs, os.path, re
+
+"""
+    性能基准测试。各模块均可通过 python -m nihonngo.benchmarks.<模块名> 单独运行。
+"""
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def load_kana_corpus(path = os.path.join(BASE_DIR, 'words.txt')):
+    """
+    读取 words.txt 中的全部假名（去重并保持原有顺序）。文件中汉字行的编码有损坏，
+    因此只保留完全由假名组成的行。
+    """
+    kanas = []
+    with codecs.open(path, 'r', 'euc-jp', errors = 'ignore') as fin:
+        for line in fin:
+            line = line.strip()
+            if re.match('^[぀-ヿ]+$', line) and line not in kanas:
+                kanas.append(line)
+    return kanas
@@ -0,0 +1,126 @@
+from django.utils import timezone
+
+from nihonngo.models import User, Word, WordClass, Question
+from nihonngo.api import p_bulk_create_words, p_recheck_leanred_words
+from nihonngo.benchmarks import BASE_DIR, load_kana_corpus
+
+import codecs, json, os.path, random
+from datetime import timedelta
+
+"""
+    生成基准测试用的生词表及用户的回答记录。生成的数据只由 seed 决定，相同的 seed 在
+    不同的提交上生成相同的数据，因此基准测试的结果可以相互比较。
+        生词的假名取自 words.txt 中的假名，部分加上 hiragana.txt 中的假名作为后缀，使假名
+        的长度分布与近邻分布接近真实的生词表；汉字、释义及例句由常用汉字随机组成。
+        回答记录按时间顺序生成，每个用户反复测试一部分生词，每个生词有各自的正确率。
+        已学习生词及统计数据由 p_recheck_leanred_words 根据回答记录计算。
+"""
+
+# 汉字、释义及例句使用的字符：CJK 统一汉字的前 2000 个字符。
+HANNZI = [chr(c) for c in range(0x4e00, 0x4e00 + 2000)]
+
+def load_hiragana(path = os.path.join(BASE_DIR, 'hiragana.txt')):
+    """
+    读取 hiragana.txt 中的假名。
+    """
+    with codecs.open(path, 'r', 'euc-jp', errors = 'ignore') as fin:
+        return [line.strip() for line in fin if line.strip() != '']
+
+def p_random_text(rng, min_length, max_length):
+    return ''.join(rng.choice(HANNZI) for i in range(rng.randint(min_length, max_length)))
+
+def generate_word_infos(count, seed = 0):
+    """
+    生成 count 个互不相同的生词。
+        返回值：
+            生词信息的 list 实例，格式与 api_insert_new_word 的 word_info 相同。
+    """
+    rng = random.Random(seed)
+    kanas, hiragana = load_kana_corpus(), load_hiragana()
+    word_classes = [name for index, name in WordClass.WORD_CLASSES]
+    word_infos, keys = [], set()
+
+    while len(word_infos) < count:
+        kana = rng.choice(kanas)
+        if rng.random() < 0.5:
+            kana += ''.join(rng.choice(hiragana) for i in range(rng.randint(1, 2)))
+        kannji = p_random_text(rng, 1, 4)
+        if (kannji, kana) in keys:
+            continue
+        keys.add((kannji, kana))
+
+        meanings = []
+        for i in range(rng.randint(1, 3)):
+            examples = [kannji + kana + p_random_text(rng, 4, 12) + '。' for j in range(rng.choice((0, 0, 1, 2)))]
+            meanings.append({'text': p_random_text(rng, 2, 10), 'examples': examples})
+        word_infos.append({
+            'kannji'      : kannji,
+            'kana'        : kana,
+            'word_classes': rng.sample(word_classes, rng.choice((1, 1, 1, 2))),
+            'meanings'    : meanings,
+        })
+    return word_infos
+
+def format_word_line(word_info):
+    """
+    将生词信息转换为批量导入的格式：汉字||假名||词类1，词类2||释义1*例句1#释义2。
+    """
+    meanings = '#'.join('*'.join([meaning['text']] + meaning['examples']) for meaning in word_info['meanings'])
+    return '||'.join((word_info['kannji'], word_info['kana'], '，'.join(word_info['word_classes']), meanings))
+
+def populate_vocabulary(count, seed = 0, chunk_size = 1000):
+    """
+    生成 count 个生词并写入数据库，每 chunk_size 个生词一个事务。
+        返回值：
+            写入的生词个数。
+    """
+    word_infos = generate_word_infos(count, seed)
+    for i in range(0, len(word_infos), chunk_size):
+        p_bulk_create_words(word_infos[i:i + chunk_size])
+    return len(word_infos)
+
+def populate_history(user, number_of_answers, days = 90, working_set = None, seed = 0):
+    """
+    为用户生成过去 days 天里的 number_of_answers 条回答记录，并据此重新计算已学习生词。
+        参数：
+            user               用户的 User 实例；
+            number_of_answers  回答记录的条数；
+            days               回答记录所跨的天数；
+            working_set        用户测试过的生词个数，默认为回答条数的五分之一；
+            seed               随机数种子。
+        返回值：
+            已学习生词的个数。
+    """
+    rng = random.Random(seed)
+    word_ids = list(Word.objects.order_by('id').values_list('id', 'kana'))
+    working_set = min(working_set or max(number_of_answers // 5, 1), len(word_ids))
+    words = [(word_id, kana, rng.uniform(0.3, 0.95)) for word_id, kana in rng.sample(word_ids, working_set)]
+
+    now = timezone.now()
+    answer_dates = sorted(now - timedelta(seconds = rng.uniform(0, days * 86400)) for i in range(number_of_answers))
+    questions = []
+    for answer_date in answer_dates:
+        word_id, kana, correct_rate = rng.choice(words)
+        questions.append(Question(related_word_id = word_id,
+                                    question_type = 0,
+                                         question = json.dumps([kana]),
+                                   correct_answer = '0',
+                                          user_id = user.id,
+                                         answered = True,
+                                      answer_date = answer_date,
+                                answer_is_correct = rng.random() < correct_rate))
+    Question.objects.bulk_create(questions, batch_size = 500)
+    return p_recheck_leanred_words(user)
+
+def create_users(number_of_users, number_of_answers, days = 90, seed = 0):
+    """
+    创建 number_of_users 个用户，并为每个用户生成回答记录。
+        返回值：
+            User 实例的 list。
+    """
+    users = []
+    for i in range(number_of_users):
+        user = User.objects.create(name = 'bench{0}'.format(i), password = 'bench')
+        populate_history(user, number_of_answers, days = days, seed = seed + i)
+        users.append(user)
+    return users
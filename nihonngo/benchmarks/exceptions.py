@@ -0,0 +1,62 @@
+import inspect, os, timeit
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zhaoyuhan.settings')
+
+from nihonngo.api import APIException, api_auth_get_user
+
+"""
+    比较原有的以 inspect.stack() 记录调用者的 APIException 与现有实现在抛出、捕获时的开销。
+        python -m nihonngo.benchmarks.exceptions
+"""
+
+class ReferenceAPIException(Exception):
+    """
+    原 APIException 的实现，作为性能的参照。
+    """
+    def __init__(self, value):
+        self.caller_api = inspect.stack()[2][3]
+        self.value = value
+
+def p_raise(exception_class):
+    raise exception_class('生词已经存在。')
+
+def api_raise(exception_class):
+    p_raise(exception_class)
+
+def raise_and_catch(exception_class, depth):
+    """
+    在 depth 层的调用栈中抛出并捕获一个异常，模拟在视图中调用 API 的情形。
+    """
+    if depth > 0:
+        return raise_and_catch(exception_class, depth - 1)
+    try:
+        api_raise(exception_class)
+    except exception_class as e:
+        return e.caller_api
+
+def validate_and_catch():
+    try:
+        api_auth_get_user('1')
+    except APIException as e:
+        return e.caller_api
+
+def run(number = 2000, depth = 30):
+    assert raise_and_catch(APIException, depth) == 'api_raise'
+    assert validate_and_catch() == 'api_auth_get_user'
+
+    results = {'number': number, 'depth': depth}
+    for name, exception_class in (('reference', ReferenceAPIException), ('lazy', APIException)):
+        seconds = timeit.timeit(lambda: raise_and_catch(exception_class, depth), number = number)
+        results[name] = seconds / number
+    results['validation'] = timeit.timeit(validate_and_catch, number = number) / number
+    results['speedup'] = results['reference'] / results['lazy']
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    print('调用栈深度：{0}，次数：{1}'.format(results['depth'], results['number']))
+    print('原实现：    {0:.1f} µs / 次'.format(results['reference'] * 1e6))
+    print('现有实现：  {0:.1f} µs / 次'.format(results['lazy'] * 1e6))
+    print('参数校验失败：{0:.1f} µs / 次'.format(results['validation'] * 1e6))
+    print('加速比：    {0:.0f}x'.format(results['speedup']))
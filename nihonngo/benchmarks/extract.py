@@ -0,0 +1,35 @@
+import codecs, glob, os.path, timeit
+
+from nihonngo.extract import WordExtractor
+
+"""
+    使用保存的词典页面测试 WordExtractor 的解析性能。
+        python -m nihonngo.benchmarks.extract
+"""
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pages')
+
+def load_pages(pages_dir = PAGES_DIR):
+    """
+    读取保存的词典页面。
+        返回值：
+            (页面名, HTML) 的 list 实例，按页面名排序。
+    """
+    pages = []
+    for path in sorted(glob.glob(os.path.join(pages_dir, '*.html'))):
+        with codecs.open(path, 'r', 'utf-8') as fin:
+            pages.append((os.path.basename(path)[:-5], fin.read()))
+    return pages
+
+def run(number = 50):
+    extractor = WordExtractor()
+    results = {}
+    for name, html in load_pages():
+        seconds = timeit.timeit(lambda: extractor.analyze(extractor.parse(html)), number = number)
+        results[name] = seconds / number
+    return results
+
+
+if __name__ == '__main__':
+    for name, seconds in sorted(run().items()):
+        print('{0:<10} {1:.2f} ms / 次'.format(name, seconds * 1000))
@@ -0,0 +1,57 @@
+import random, timeit
+
+from nihonngo.benchmarks import load_kana_corpus
+from nihonngo.similarity import LCSScorer
+
+"""
+    比较原有的基于 dict 的 LCS 实现与位并行实现的性能。
+        python -m nihonngo.benchmarks.lcs
+"""
+
+def reference_lcs_length(sequence1, sequence2):
+    """
+    原 p_lcs_length 的实现，作为正确性与性能的参照。
+    """
+    if len(sequence1) == 0 or len(sequence2) == 0: return 0
+    f = {'max': 0}
+    for i in range(len(sequence1)):
+        for j in range(len(sequence2)):
+            f[(i, j)] = 1 if sequence1[i] == sequence2[j] else 0
+            if i > 0 and j > 0:
+                f[(i, j)] += f[(i - 1, j - 1)]
+            if i > 0 and f[(i - 1, j)] > f[(i, j)]:
+                f[(i, j)] = f[(i - 1, j)]
+            if j > 0 and f[(i, j - 1)] > f[(i, j)]:
+                f[(i, j)] = f[(i, j - 1)]
+            if f[(i, j)] > f['max']:
+                f['max'] = f[(i, j)]
+    return f['max']
+
+def reference_rank(query, candidates, size):
+    lcs_dict = dict((c, reference_lcs_length(query, c)) for c in candidates if c != query)
+    return sorted(lcs_dict.items(), key = lambda e: (-e[1], e[0]))[:size]
+
+def bit_parallel_rank(query, candidates, size):
+    return LCSScorer(query).rank((c for c in candidates if c != query), size)
+
+def run(number_of_queries = 20, size = 12, seed = 0):
+    corpus = load_kana_corpus()
+    queries = random.Random(seed).sample(corpus, number_of_queries)
+
+    for query in queries:
+        assert reference_rank(query, corpus, size) == bit_parallel_rank(query, corpus, size), query
+
+    results = {'corpus_size': len(corpus), 'number_of_queries': number_of_queries}
+    for name, function in (('reference', reference_rank), ('bit_parallel', bit_parallel_rank)):
+        seconds = timeit.timeit(lambda: [function(q, corpus, size) for q in queries], number = 1)
+        results[name] = seconds / number_of_queries
+    results['speedup'] = results['reference'] / results['bit_parallel']
+    return results
+
+
+if __name__ == '__main__':
+    results = run()
+    print('语料库大小：{0}，查询次数：{1}'.format(results['corpus_size'], results['number_of_queries']))
+    print('原实现：   {0:.2f} ms / 次'.format(results['reference'] * 1000))
+    print('位并行实现：{0:.2f} ms / 次'.format(results['bit_parallel'] * 1000))
+    print('加速比：   {0:.1f}x'.format(results['speedup']))
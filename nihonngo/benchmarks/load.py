@@ -0,0 +1,338 @@
+"""
+    考试接口的负载测试。N 个并发的 worker 各自以一个用户的身份登录，然后反复获取问题、
+    回答问题；也可以回放记录的请求序列。按接口统计吞吐量、耗时分位数、失败次数及 SQLite
+    的 database is locked 错误次数，依次以不同的并发数运行，以找出一个实例能支撑的并发
+    学习者个数。
+        python -m nihonngo.benchmarks.load --workers 1,2,4,8 --rounds 50
+        python -m nihonngo.benchmarks.load --url http://127.0.0.1:8000 --workers 4 --think 1
+        python -m nihonngo.benchmarks.load --record trace.jsonl
+        python -m nihonngo.benchmarks.load --trace trace.jsonl --workers 4
+
+    默认在进程内以 Django 测试客户端发出请求，使用一个临时的 SQLite 数据库文件（多个线程
+    需要共用同一个数据库，因此不能使用内存数据库），数据库错误可以精确地归到每个请求；
+    指定 --url 时通过 HTTP 请求一个运行中的服务器，用户在当前配置的数据库中创建，此时只有
+    返回 500 且页面中含有 database is locked 的请求被计为锁错误。
+
+    请求序列为 JSON Lines 文件，每行一个请求：
+        {"session": "s0", "name": "answer_question", "method": "POST",
+         "path": "/nihonngo/exam/question/answer/",
+         "data": {"question_id": "{question_id}", "answer": "{answer}"}, "think": 0.5}
+    同一 session 的请求由同一个 worker 按顺序发出。data 中的 {question_id} 和 {answer}
+    在发出请求时替换为该 session 最近获取的问题的 ID 及一个随机选项；think 为发出请求
+    之前的等待时间（秒），缺省时使用 --think。
+"""
+
+import argparse, collections, http.client, http.cookies, json, os, random, sys, tempfile, threading, time, urllib.parse
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zhaoyuhan.settings')
+
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+
+from nihonngo.models import User
+from nihonngo.pool import QUESTION_POOL
+from nihonngo.metrics import QUERY_COUNTER, install_query_counter
+from nihonngo.benchmarks.data import populate_vocabulary
+from nihonngo.benchmarks.suite import summarize, environment
+
+USER_PASSWORD = 'load'
+
+def p_user_name(index):
+    return 'load{0}'.format(index)
+
+def ensure_users(number):
+    """
+    确保数据库中存在 load0 到 load<number - 1> 这些负载测试用户。
+    """
+    for i in range(number):
+        User.objects.get_or_create(name = p_user_name(i), defaults = {'password': USER_PASSWORD})
+
+def synthesize_session(session, user_index, rounds):
+    """
+    生成一个考试 session 的请求序列：打开登录页面、登录，然后获取、回答问题 rounds 次。
+    """
+    requests = [
+        {'name': 'signin_page', 'method': 'GET', 'path': reverse('nihonngo:signin')},
+        {'name': 'signin', 'method': 'POST', 'path': reverse('nihonngo:signin'),
+         'data': {'name': p_user_name(user_index), 'password': USER_PASSWORD}},
+    ]
+    for i in range(rounds):
+        requests.append({'name': 'get_question', 'method': 'GET', 'path': reverse('nihonngo:get_question')})
+        requests.append({'name': 'answer_question', 'method': 'POST', 'path': reverse('nihonngo:answer_question'),
+                         'data': {'question_id': '{question_id}', 'answer': '{answer}'}})
+    for request in requests:
+        request['session'] = session
+    return requests
+
+def load_trace(path):
+    """
+    读取请求序列。
+        返回值：
+            session 到其请求的 list 的 dict 实例，session 按首次出现的顺序排列。
+    """
+    sessions = {}
+    with open(path, encoding = 'utf-8') as fin:
+        for line in fin:
+            if line.strip() != '':
+                request = json.loads(line)
+                request.setdefault('name', '{0} {1}'.format(request['method'], request['path']))
+                sessions.setdefault(request['session'], []).append(request)
+    return sessions
+
+
+# MARK - Transports
+
+class ClientTransport(object):
+    """
+    在进程内以 Django 测试客户端发出请求。
+    """
+    def __init__(self):
+        super(ClientTransport, self).__init__()
+        self.client = Client()
+
+    def request(self, method, path, data):
+        """
+        返回值：
+            (状态码, 响应内容, 请求期间的锁错误次数)。
+        """
+        lock_errors = QUERY_COUNTER.lock_errors
+        if method == 'POST':
+            response = self.client.post(path, data)
+        else:
+            response = self.client.get(path, data)
+        return response.status_code, response.content, QUERY_COUNTER.lock_errors - lock_errors
+
+    def close(self):
+        pass
+
+
+class HTTPTransport(object):
+    """
+    通过 HTTP 请求运行中的服务器，复用一个长连接并保存 cookies。POST 请求带上 CSRF 令牌。
+    """
+    def __init__(self, url, timeout = 30):
+        super(HTTPTransport, self).__init__()
+        url = urllib.parse.urlsplit(url)
+        connection_class = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(url.netloc, timeout = timeout)
+        self.cookies = http.cookies.SimpleCookie()
+
+    def request(self, method, path, data):
+        headers = {'Connection': 'keep-alive'}
+        if len(self.cookies) > 0:
+            headers['Cookie'] = '; '.join('{0}={1}'.format(k, m.value) for k, m in self.cookies.items())
+        body = None
+        if method == 'POST':
+            body = urllib.parse.urlencode(data or {})
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            if 'csrftoken' in self.cookies:
+                headers['X-CSRFToken'] = self.cookies['csrftoken'].value
+        elif data:
+            path += '?' + urllib.parse.urlencode(data)
+
+        try:
+            self.connection.request(method, path, body = body, headers = headers)
+            response = self.connection.getresponse()
+            content = response.read()
+        except (http.client.HTTPException, OSError):
+            self.connection.close()
+            raise
+        for header in response.headers.get_all('Set-Cookie') or []:
+            self.cookies.load(header)
+        is_lock_error = response.status >= 500 and b'database is locked' in content
+        return response.status, content, 1 if is_lock_error else 0
+
+    def close(self):
+        self.connection.close()
+
+
+# MARK - Runner
+
+class EndpointStats(object):
+    def __init__(self):
+        super(EndpointStats, self).__init__()
+        self.durations = []
+        self.failures = 0
+        self.lock_errors = 0
+        self.messages = collections.Counter()
+
+    def summary(self, seconds):
+        summary = summarize(self.durations) if len(self.durations) > 0 else {'n': 0}
+        summary.update({'failures': self.failures, 'lock_errors': self.lock_errors,
+                        'throughput': len(self.durations) / seconds if seconds > 0 else None,
+                        'messages': dict(self.messages.most_common(5))})
+        return summary
+
+
+class Session(object):
+    def __init__(self, transport, rng, think):
+        super(Session, self).__init__()
+        self.transport = transport
+        self.rng = rng
+        self.think = think
+        self.variables = {'question_id': '', 'answer': '0'}
+
+    def render(self, data):
+        return dict((key, value.format(**self.variables) if isinstance(value, str) else value)
+                    for key, value in (data or {}).items())
+
+    def update(self, content):
+        """
+        从 JSON 响应中取出问题的 ID，并随机选择一个选项作为回答。
+            返回值：
+                失败时为响应中的错误描述，成功时（包括非 JSON 的响应）为 None。
+        """
+        try:
+            response = json.loads(content.decode('utf-8'))
+        except ValueError:
+            return None
+        if not isinstance(response, dict):
+            return None
+        question = response.get('question')
+        if isinstance(question, dict) and 'question_id' in question:
+            self.variables['question_id'] = question['question_id']
+            self.variables['answer'] = str(self.rng.randrange(max(len(question.get('question') or []), 1)))
+        return None if response.get('success', True) else response.get('message', '')
+
+    def run(self, requests, stats, stats_lock):
+        for request in requests:
+            think = request.get('think', self.think)
+            if think > 0:
+                time.sleep(think)
+            start = time.perf_counter()
+            try:
+                status, content, lock_errors = self.transport.request(request['method'], request['path'], self.render(request.get('data')))
+                message = 'HTTP {0}'.format(status) if status >= 400 else self.update(content)
+            except Exception as e:
+                lock_errors, message = (1 if 'database is locked' in str(e) else 0), repr(e)
+            duration = time.perf_counter() - start
+            with stats_lock:
+                endpoint = stats.setdefault(request['name'], EndpointStats())
+                endpoint.durations.append(duration)
+                endpoint.lock_errors += lock_errors
+                if message is not None:
+                    endpoint.failures += 1
+                    endpoint.messages[message] += 1
+
+
+def run_level(sessions, workers, make_transport, think = 0, seed = 0):
+    """
+    以 workers 个线程运行 sessions，每个 worker 依次运行分给它的 session。
+        参数：
+            sessions        session 的请求的 list 的 list；
+            workers         并发的 worker 个数；
+            make_transport  创建 transport 的函数，每个 session 一个 transport；
+            think           请求之间的默认等待时间（秒）。
+        返回值：
+            包含 worker 个数、总耗时及每个接口的统计的 dict 实例。
+    """
+    stats, stats_lock = {}, threading.Lock()
+    assignments = [sessions[i::workers] for i in range(workers)]
+
+    def work(index):
+        connection.use_debug_cursor = False
+        rng = random.Random(seed * 1000 + index)
+        try:
+            for requests in assignments[index]:
+                transport = make_transport()
+                try:
+                    Session(transport, rng, think).run(requests, stats, stats_lock)
+                finally:
+                    transport.close()
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target = work, args = (i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+
+    total = EndpointStats()
+    for endpoint in stats.values():
+        total.durations += endpoint.durations
+        total.failures += endpoint.failures
+        total.lock_errors += endpoint.lock_errors
+        total.messages.update(endpoint.messages)
+    return {'workers': workers, 'seconds': seconds, 'total': total.summary(seconds),
+            'endpoints': dict((name, endpoint.summary(seconds)) for name, endpoint in stats.items())}
+
+def run(worker_levels, rounds = 20, think = 0, url = None, trace = None, seed = 0):
+    """
+    依次以 worker_levels 中的每个并发数运行负载测试。没有指定 trace 时，每个 worker 以
+    各自的用户运行一个合成的考试 session。
+        返回值：
+            每个并发数的 run_level 的结果的 list。
+    """
+    install_query_counter()
+    make_transport = (lambda: HTTPTransport(url)) if url else ClientTransport
+    levels = []
+    for workers in worker_levels:
+        if trace:
+            sessions = list(load_trace(trace).values())
+        else:
+            sessions = [synthesize_session('s{0}'.format(i), i, rounds) for i in range(workers)]
+        levels.append(run_level(sessions, workers, make_transport, think = think, seed = seed))
+    return levels
+
+def p_print_level(level, out = sys.stderr):
+    out.write('并发数 {0}，耗时 {1:.1f} 秒\n'.format(level['workers'], level['seconds']))
+    rows = sorted(level['endpoints'].items()) + [('合计', level['total'])]
+    for name, s in rows:
+        if s['n'] == 0:
+            continue
+        out.write('  {0:<20} {1:>6} 次 {2:>8.1f} 次/秒  p50 {3:>7.1f} ms  p95 {4:>7.1f} ms  p99 {5:>7.1f} ms  失败 {6}  锁错误 {7}\n'.format(
+                  name, s['n'], s['throughput'], s['p50'] * 1000, s['p95'] * 1000, s['p99'] * 1000, s['failures'], s['lock_errors']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = '考试接口的负载测试，结果以 JSON 格式输出。')
+    parser.add_argument('--workers', default = '1,2,4,8', help = '以逗号分隔的并发数。')
+    parser.add_argument('--rounds', type = int, default = 20, help = '合成的 session 中获取、回答问题的次数。')
+    parser.add_argument('--think', type = float, default = 0, help = '请求之间的等待时间（秒）。')
+    parser.add_argument('--url', help = '运行中的服务器的地址，默认在进程内使用测试客户端。')
+    parser.add_argument('--trace', help = '回放的请求序列文件。')
+    parser.add_argument('--record', help = '将合成的请求序列写入此文件后退出。')
+    parser.add_argument('--size', type = int, default = 1000, help = '进程内运行时生成的生词个数。')
+    parser.add_argument('--database', help = '进程内运行时使用的 SQLite 文件，默认为临时文件。')
+    parser.add_argument('--pool-size', type = int, help = '进程内运行时问题预生成池的大小，0 为关闭。')
+    parser.add_argument('--seed', type = int, default = 0, help = '随机数种子。')
+    parser.add_argument('--output', help = '结果的输出文件，默认输出到标准输出。')
+    options = parser.parse_args()
+    worker_levels = [int(w) for w in options.workers.split(',')]
+
+    if options.record:
+        with open(options.record, 'w', encoding = 'utf-8') as fout:
+            for i in range(max(worker_levels)):
+                for request in synthesize_session('s{0}'.format(i), i, options.rounds):
+                    fout.write(json.dumps(request, ensure_ascii = False) + '\n')
+        sys.exit(0)
+
+    old_name = connection.settings_dict['NAME']
+    if not options.url:
+        connection.settings_dict['TEST_NAME'] = options.database or os.path.join(tempfile.mkdtemp(), 'load.sqlite3')
+        connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+        populate_vocabulary(options.size, seed = options.seed)
+        if options.pool_size is not None:
+            QUESTION_POOL.size = options.pool_size
+    try:
+        ensure_users(max(worker_levels))
+        connection.close()
+        levels = run(worker_levels, rounds = options.rounds, think = options.think,
+                     url = options.url, trace = options.trace, seed = options.seed)
+    finally:
+        if not options.url:
+            connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+    for level in levels:
+        p_print_level(level)
+    document = json.dumps({'environment': environment(), 'target': options.url or 'client', 'levels': levels},
+                          indent = 2, ensure_ascii = False)
+    if options.output:
+        with open(options.output, 'w', encoding = 'utf-8') as fout:
+            fout.write(document + '\n')
+    else:
+        print(document)
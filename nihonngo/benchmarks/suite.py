@@ -0,0 +1,196 @@
+"""
+    端到端的基准测试。在一个临时的测试数据库中生成指定规模的生词表及用户的回答记录，
+    然后测量出题、回答、搜索、统计、词典页面解析及批量导入的耗时，结果以 JSON 格式输出。
+        python -m nihonngo.benchmarks.suite --sizes 1000,10000 --output bench.json
+        python -m nihonngo.benchmarks.suite --compare bench.json
+    每个规模使用一个新的数据库。API 的耗时包含 metrics 的包装开销，与线上的配置一致；
+    SQL 语句不记录到 connection.queries 中，即使 DEBUG 为 True。
+"""
+
+import argparse, json, os, platform, random, subprocess, sys, time
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'zhaoyuhan.settings')
+
+import django
+from django.db import connection
+from django.utils import timezone
+
+from nihonngo import metrics
+from nihonngo.models import Word
+from nihonngo.api import api_create_question, api_answer_question, api_search_word, api_get_statistics
+from nihonngo.batch import batch_import
+from nihonngo.extract import WordExtractor
+from nihonngo.benchmarks import BASE_DIR
+from nihonngo.benchmarks.data import populate_vocabulary, create_users, generate_word_infos, format_word_line
+from nihonngo.benchmarks.extract import load_pages
+
+from datetime import timedelta
+
+def summarize(durations):
+    """
+    汇总每次调用的耗时（秒）。
+        返回值：
+            包含次数、平均值、最小值、中位数、95 及 99 分位数、最大值的 dict 实例。
+    """
+    durations = sorted(durations)
+    n = len(durations)
+    return {
+        'n'   : n,
+        'mean': sum(durations) / n,
+        'min' : durations[0],
+        'p50' : durations[n // 2],
+        'p95' : durations[min(int(n * 0.95), n - 1)],
+        'p99' : durations[min(int(n * 0.99), n - 1)],
+        'max' : durations[-1],
+    }
+
+def p_time_calls(function, arguments):
+    """
+    依次以 arguments 中的每一项调用 function。
+        返回值：
+            (每次调用的耗时的 list, 每次调用的返回值的 list)。
+    """
+    durations, results = [], []
+    for args in arguments:
+        start = time.perf_counter()
+        results.append(function(*args))
+        durations.append(time.perf_counter() - start)
+    return durations, results
+
+def p_search_strings(rng, number):
+    """
+    从生词表中随机选取搜索字符串，一半为汉字的前缀，一半为假名的前两个字符。
+    """
+    words = list(Word.objects.values_list('kannji', 'kana'))
+    words = [rng.choice(words) for i in range(number)]
+    return [(kannji[:rng.randint(1, len(kannji))] if i % 2 == 0 else kana[:2],) for i, (kannji, kana) in enumerate(words)]
+
+def run(size = 1000, users = 3, answers = 2000, days = 90, repeat = 100, import_size = 1000, seed = 0):
+    """
+    在当前数据库中生成数据并运行所有基准测试。
+        返回值：
+            包含配置、数据生成耗时及各项基准测试结果的 dict 实例。
+    """
+    rng = random.Random(seed)
+    results = {'config': {'size': size, 'users': users, 'answers': answers, 'days': days,
+                          'repeat': repeat, 'import_size': import_size, 'seed': seed},
+               'setup': {}, 'benchmarks': {}}
+    benchmarks = results['benchmarks']
+
+    start = time.perf_counter()
+    populate_vocabulary(size, seed = seed)
+    results['setup']['vocabulary'] = time.perf_counter() - start
+    start = time.perf_counter()
+    user = create_users(users, answers, days = days, seed = seed)[0]
+    results['setup']['history'] = time.perf_counter() - start
+
+    metrics.reset()
+    # 出题时会返回尚未回答的问题，因此出题与回答交替进行。
+    create_durations, answer_durations = [], []
+    for i in range(repeat):
+        durations, questions = p_time_calls(api_create_question, [(user,)])
+        create_durations += durations
+        question = questions[0]
+        durations, answers = p_time_calls(api_answer_question, [(user.id, question['question_id'], str(rng.randrange(len(question['question']))))])
+        answer_durations += durations
+    benchmarks['api_create_question'] = summarize(create_durations)
+    benchmarks['api_answer_question'] = summarize(answer_durations)
+
+    durations, words = p_time_calls(api_search_word, p_search_strings(rng, repeat))
+    benchmarks['api_search_word'] = summarize(durations)
+
+    finish_date = timezone.now().date() + timedelta(days = 180)
+    durations, statistics = p_time_calls(api_get_statistics, [(user, finish_date)] * repeat)
+    benchmarks['api_get_statistics'] = summarize(durations)
+
+    # 各项 API 每次调用的平均 SQL 语句数。
+    calls = metrics.snapshot()
+    for name in list(benchmarks):
+        if name in calls:
+            benchmarks[name]['queries'] = calls[name]['queries']['mean']
+
+    extractor, pages = WordExtractor(), [html for name, html in load_pages()]
+    durations, soups = p_time_calls(extractor.parse, [(html,) for html in pages] * max(repeat // len(pages), 1))
+    benchmarks['WordExtractor.parse'] = summarize(durations)
+    durations, words = p_time_calls(extractor.analyze, [(soup,) for soup in soups])
+    benchmarks['WordExtractor.analyze'] = summarize(durations)
+
+    lines = [format_word_line(info) for info in generate_word_infos(import_size, seed = seed + 1)]
+    start = time.perf_counter()
+    report = batch_import(lines)
+    seconds = time.perf_counter() - start
+    benchmarks['batch_import'] = {'n': len(lines), 'seconds': seconds, 'per_word': seconds / len(lines),
+                                  'imported': report['imported'], 'duplicated': report['duplicated']}
+    return results
+
+def run_in_test_database(**kwargs):
+    """
+    在一个新建的测试数据库中运行 run，结束后删除该数据库。
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity = 0, autoclobber = True)
+    use_debug_cursor, connection.use_debug_cursor = connection.use_debug_cursor, False
+    try:
+        return run(**kwargs)
+    finally:
+        connection.use_debug_cursor = use_debug_cursor
+        connection.creation.destroy_test_db(old_name, verbosity = 0)
+
+def environment():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd = BASE_DIR, stderr = subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'python': platform.python_version(), 'django': django.get_version(),
+            'database': connection.vendor, 'date': timezone.now().isoformat()}
+
+def compare(baseline, current):
+    """
+    比较两次运行中相同规模的各项基准测试的中位数耗时。
+        返回值：
+            (规模, 名称, 原耗时, 现耗时, 变化比例) 的 list 实例，变化比例为正表示变慢。
+    """
+    baseline_runs = dict((r['config']['size'], r['benchmarks']) for r in baseline['runs'])
+    rows = []
+    for r in current['runs']:
+        size = r['config']['size']
+        for name, result in sorted(r['benchmarks'].items()):
+            old = baseline_runs.get(size, {}).get(name)
+            if old is None:
+                continue
+            key = 'p50' if 'p50' in result else 'per_word'
+            rows.append((size, name, old[key], result[key], result[key] / old[key] - 1))
+    return rows
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = '端到端的基准测试，结果以 JSON 格式输出。')
+    parser.add_argument('--sizes', default = '1000', help = '以逗号分隔的生词表规模，例如 1000,10000,100000。')
+    parser.add_argument('--users', type = int, default = 3, help = '用户个数。')
+    parser.add_argument('--answers', type = int, default = 2000, help = '每个用户的回答记录条数。')
+    parser.add_argument('--days', type = int, default = 90, help = '回答记录所跨的天数。')
+    parser.add_argument('--repeat', type = int, default = 100, help = '每项 API 的调用次数。')
+    parser.add_argument('--import-size', type = int, default = 1000, help = '批量导入的生词个数。')
+    parser.add_argument('--seed', type = int, default = 0, help = '随机数种子。')
+    parser.add_argument('--output', help = '结果的输出文件，默认输出到标准输出。')
+    parser.add_argument('--compare', help = '与之比较的原结果文件。')
+    options = parser.parse_args()
+
+    current = {'environment': environment(), 'runs': []}
+    for size in (int(s) for s in options.sizes.split(',')):
+        current['runs'].append(run_in_test_database(size = size, users = options.users, answers = options.answers,
+                                                    days = options.days, repeat = options.repeat,
+                                                    import_size = options.import_size, seed = options.seed))
+
+    document = json.dumps(current, indent = 2, ensure_ascii = False)
+    if options.output:
+        with open(options.output, 'w', encoding = 'utf-8') as fout:
+            fout.write(document + '\n')
+    else:
+        print(document)
+
+    if options.compare:
+        with open(options.compare, encoding = 'utf-8') as fin:
+            baseline = json.load(fin)
+        for size, name, old, new, change in compare(baseline, current):
+            sys.stderr.write('{0:>7} {1:<24} {2:>9.3f} ms -> {3:>9.3f} ms  {4:+.1%}\n'.format(size, name, old * 1000, new * 1000, change))
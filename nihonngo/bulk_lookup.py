@@ -0,0 +1,164 @@
+import http.client, urllib.parse
+import codecs, itertools, json, os.path, threading, time
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from nihonngo.extract import WordExtractor
+
+"""
+    批量查询网络词典。多个线程并发查询，同一主机的请求受速率限制，每个线程复用自己的
+    HTTP 连接，失败的请求按指数退避重试。结果逐行以 JSON 格式写入输出文件，再次运行时
+    跳过输出文件中已经成功查询的生词，因此中断后可以继续。同时提交的查询不超过线程数的
+    两倍，中断（例如 Ctrl-C）时取消尚未开始的查询，只等待正在进行的查询结束。
+"""
+
+class RateLimiter(object):
+    """
+    限制每个主机的请求速率，rate 为每秒的最大请求数。
+    """
+    def __init__(self, rate):
+        super(RateLimiter, self).__init__()
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_times = {}
+
+    def acquire(self, host):
+        with self.lock:
+            now = time.time()
+            next_time = max(self.next_times.get(host, now), now)
+            self.next_times[host] = next_time + self.interval
+        if next_time > now:
+            time.sleep(next_time - now)
+
+
+class LookupFailed(Exception):
+    def __init__(self, message, retryable = True):
+        super(LookupFailed, self).__init__(message)
+        self.retryable = retryable
+
+
+class BulkLookup(object):
+    def __init__(self, extractor = None, dictionary_url = WordExtractor.DictionaryURL,
+                 workers = 4, rate = 2.0, retries = 3, backoff = 1.0, timeout = 10):
+        super(BulkLookup, self).__init__()
+        self.extractor = extractor if extractor is not None else WordExtractor()
+        self.dictionary_url = dictionary_url
+        self.workers = workers
+        self.rate_limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.local = threading.local()
+        self.connections_lock = threading.Lock()
+        self.all_connections = []
+
+    def connection(self, scheme, host):
+        """
+        返回当前线程到 host 的 HTTP 连接，连接在同一线程的多次请求间复用。
+        """
+        connections = self.local.__dict__.setdefault('connections', {})
+        if (scheme, host) not in connections:
+            connection_class = http.client.HTTPSConnection if scheme == 'https' else http.client.HTTPConnection
+            connections[(scheme, host)] = connection_class(host, timeout = self.timeout)
+            with self.connections_lock:
+                self.all_connections.append(connections[(scheme, host)])
+        return connections[(scheme, host)]
+
+    def close_connections(self):
+        with self.connections_lock:
+            for connection in self.all_connections:
+                connection.close()
+
+    def fetch(self, word):
+        """
+        下载 word 对应的词典页面，失败时按指数退避重试。
+        """
+        url = urllib.parse.urlsplit(self.dictionary_url.format(urllib.parse.quote(word)))
+        path = url.path + ('?' + url.query if url.query else '')
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.acquire(url.netloc)
+            connection = self.connection(url.scheme, url.netloc)
+            try:
+                connection.request('GET', path, headers = {'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read()
+                if response.status == 200:
+                    return body
+                failure = LookupFailed('HTTP {0}'.format(response.status),
+                                       retryable = response.status == 429 or response.status >= 500)
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                failure = LookupFailed(repr(e))
+            if not failure.retryable or attempt == self.retries:
+                raise failure
+            time.sleep(self.backoff * (2 ** attempt))
+
+    def lookup(self, word):
+        return self.extractor.analyze(self.extractor.parse(self.fetch(word)))
+
+    def lookup_entry(self, word):
+        try:
+            return {'query': word, 'words': self.lookup(word)}
+        except Exception as e:
+            return {'query': word, 'error': str(e)}
+
+    @staticmethod
+    def finished_words(output_path):
+        """
+        读取输出文件中已经成功查询的生词。
+        """
+        finished = set()
+        if os.path.exists(output_path):
+            with codecs.open(output_path, 'r', 'utf-8') as fin:
+                for line in fin:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if 'words' in entry:
+                        finished.add(entry['query'])
+        return finished
+
+    @staticmethod
+    def ends_with_newline(path):
+        with open(path, 'rb') as fin:
+            fin.seek(-1, os.SEEK_END)
+            return fin.read(1) == b'\n'
+
+    def run(self, words, output_path):
+        """
+        批量查询 words 中的生词，并将结果追加写入 output_path。
+            返回值：
+                包含跳过、成功及失败个数的 dict 实例，跳过的个数为 words 中已经成功查询的生词个数。
+        """
+        finished = self.finished_words(output_path)
+        pending, seen = [], set(finished)
+        for word in words:
+            if word not in seen:
+                pending.append(word)
+                seen.add(word)
+
+        summary = {'skipped': len(set(words) & finished), 'succeeded': 0, 'failed': 0}
+        pending = iter(pending)
+        try:
+            with codecs.open(output_path, 'a', 'utf-8') as fout, ThreadPoolExecutor(max_workers = self.workers) as executor:
+                # 上次运行中断时最后一行可能不完整，先补上换行，避免与新的结果连在一起。
+                if fout.tell() > 0 and not self.ends_with_newline(output_path):
+                    fout.write('\n')
+                running = set(executor.submit(self.lookup_entry, word) for word in itertools.islice(pending, 2 * self.workers))
+                try:
+                    while len(running) > 0:
+                        done, running = wait(running, return_when = FIRST_COMPLETED)
+                        for future in done:
+                            entry = future.result()
+                            fout.write(json.dumps(entry, ensure_ascii = False) + '\n')
+                            fout.flush()
+                            summary['succeeded' if 'words' in entry else 'failed'] += 1
+                            running |= set(executor.submit(self.lookup_entry, word) for word in itertools.islice(pending, 1))
+                except BaseException:
+                    for future in running:
+                        future.cancel()
+                    raise
+        finally:
+            self.close_connections()
+        return summary
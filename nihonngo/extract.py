@@ -1,11 +1,12 @@
 import urllib.request, urllib.parse
-import re, codecs, os.path
+import re, codecs, os.path, threading
 
-from bs4 import BeautifulSoup, NavigableString
+from bs4 import BeautifulSoup, NavigableString, SoupStrainer
 
 class WordExtractor(object):
     DictionaryURL = 'http://dict.hjenglish.com/jp/jc/{0}'
-    UselessChars = ['\n', '\r', '   ', ' ', '【', '】', '\u3000']
+    DefaultMappingFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class_mapping.txt')
+    UselessCharsTable = str.maketrans('', '', '\n\r 【】\u3000')
     PunctuationDict = {
         ';' : '；',
         '.' : '。',
@@ -13,82 +14,128 @@ class WordExtractor(object):
         '(' : '（',
         ')' : '）',
     }
-    ClassSeparators = '[•・·･▪，.【】]'
+    PunctuationTable = str.maketrans(PunctuationDict)
+    ClassSeparators = re.compile('[•・·･▪，.【】]')
+    MeaningNumberPatterns = (re.compile('（[0-9]+）'), re.compile('[0-9]+、'))
+    EntryIdPattern = re.compile('^(kana|comment)_([0-9]+)$')
+
+    # 所有实例共享的词类映射表：文件路径 -> (修改时间, 映射表)
+    ClassMappings = {}
+    ClassMappingsLock = threading.Lock()
 
     @staticmethod
     def remove_useless_chars(string):
-        for char in WordExtractor.UselessChars:
-            string = string.replace(char, '')
-        return string
+        return string.translate(WordExtractor.UselessCharsTable)
 
     @staticmethod
     def convert_punctuation(string):
-        for key, value in WordExtractor.PunctuationDict.items():
-            string = string.replace(key, value)
-        return string
-                
+        return string.translate(WordExtractor.PunctuationTable)
+
+    @staticmethod
+    def load_mapping(mapping_file, force = False):
+        """
+        读取词类映射表。映射表在所有实例间共享，仅在文件的修改时间变化时重新读取。
+        """
+        mtime = os.path.getmtime(mapping_file)
+        with WordExtractor.ClassMappingsLock:
+            cached = WordExtractor.ClassMappings.get(mapping_file)
+            if cached is not None and cached[0] == mtime and not force:
+                return cached[1]
+
+            class_mapping = {}
+            with codecs.open(mapping_file, 'r', 'utf-8') as fin:
+                for line in fin.read().split('\n')[:-1]:
+                    components = line.split(' ')
+                    key, value = components[0], components[1:]
+                    class_mapping[key] = value
+            WordExtractor.ClassMappings[mapping_file] = (mtime, class_mapping)
+            return class_mapping
 
-    def __init__(self, mapping_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'class_mapping.txt')):
+    @staticmethod
+    def is_entry_tag(name, attrs):
+        """
+        判断标签是否属于词条，用于在解析时只保留词条所在的子树。
+        """
+        if WordExtractor.EntryIdPattern.match(attrs.get('id', '')):
+            return True
+        classes = attrs.get('class', [])
+        if isinstance(classes, str):
+            classes = classes.split()
+        return 'jp_title_td' in classes
+
+    def __init__(self, mapping_file = DefaultMappingFile):
         super(WordExtractor, self).__init__()
-        self.reload_mapping(mapping_file)
+        self.mapping_file = mapping_file
+        self.load_mapping(mapping_file)
+
+    @property
+    def class_mapping(self):
+        return self.load_mapping(self.mapping_file)
 
     def reload_mapping(self, mapping_file):
-        fin = codecs.open(mapping_file, 'r', 'utf-8')
-        self.class_mapping = {}
-        for line in fin.read().split('\n')[:-1]:
-            components = line.split(' ')
-            key, value = components[0], components[1:]
-            self.class_mapping[key] = value
-        fin.close()
+        self.mapping_file = mapping_file
+        self.load_mapping(mapping_file, force = True)
+
+    def parse(self, html):
+        """
+        解析词典页面，只保留词条标题、假名及释义所在的子树。
+        """
+        return BeautifulSoup(html, 'html.parser', parse_only = SoupStrainer(WordExtractor.is_entry_tag))
 
     def extract(self, word):
         url = WordExtractor.DictionaryURL.format(urllib.parse.quote(word))
-        soup = BeautifulSoup(urllib.request.urlopen(url).read())
-        return self.analyze(soup)
+        return self.analyze(self.parse(urllib.request.urlopen(url).read()))
 
     def analyze(self, soup):
-        number_of_words = len(soup.select('.jp_title_td'))
+        kannjis, entries = [], {}
+        for tag in soup.find_all(lambda tag: 'jpword' in tag.get('class', []) or WordExtractor.EntryIdPattern.match(tag.get('id', ''))):
+            if tag.get('id', '').startswith(('kana_', 'comment_')):
+                entries[tag['id']] = tag
+            elif tag.find_parent(class_ = 'jp_title_td') is not None:
+                kannjis.append(tag.text)
+
+        class_mapping = self.class_mapping
         words = []
 
-        for i in range(number_of_words):
+        for i, kannji in enumerate(kannjis):
             word = {}
 
-            word['kannji'] = soup.select('.jp_title_td .jpword')[i].text
-            word['kana'] = WordExtractor.remove_useless_chars(soup.select('#kana_{0}'.format(i))[0].text)
+            word['kannji'] = kannji
+            word['kana'] = WordExtractor.remove_useless_chars(entries['kana_{0}'.format(i)].text)
             word['meanings'] = []
 
-            meaning_span = soup.select('#comment_{0}'.format(i))[0]
-            word_classes_string = ''
-            meaning_string = ''
+            meaning_span = entries['comment_{0}'.format(i)]
+            word_classes_strings = []
+            meaning_strings = []
 
             for child in meaning_span.children:
                 if child.name == 'p' and 'wordtype' in child['class']:
                     if isinstance(child.string, str):
-                        word_classes_string += WordExtractor.convert_punctuation(child.string)
+                        word_classes_strings.append(WordExtractor.convert_punctuation(child.string))
                 elif child.name == 'img':
-                    meaning_string += '*'
+                    meaning_strings.append('*')
                 elif isinstance(child, NavigableString):
                     string = WordExtractor.remove_useless_chars(child.string)
                     string = string.replace('（1）', '').replace('1、', '')
-                    string = re.sub('（[0-9]+）', '#', string)
-                    string = re.sub('[0-9]+、', '#', string)
-                    meaning_string += WordExtractor.convert_punctuation(string)
+                    for pattern in WordExtractor.MeaningNumberPatterns:
+                        string = pattern.sub('#', string)
+                    meaning_strings.append(WordExtractor.convert_punctuation(string))
 
-            word['word_classes'] = []
-            for component in re.sub(WordExtractor.ClassSeparators, '#', word_classes_string).split('#'):
-                word_class = self.remove_useless_chars(component)
+            word['word_classes'] = set()
+            for component in WordExtractor.ClassSeparators.split(''.join(word_classes_strings)):
+                word_class = WordExtractor.remove_useless_chars(component)
                 if word_class == '':
                     continue
-                elif word_class in self.class_mapping:
-                    word['word_classes'] += self.class_mapping[word_class]
+                elif word_class in class_mapping:
+                    word['word_classes'].update(class_mapping[word_class])
                 else:
                     try:
                         print('Unrecognized word class(es): "{0}".'.format(word_class))
                     except:
                         pass
-            word['word_classes'] = list(set(word['word_classes']))
+            word['word_classes'] = list(word['word_classes'])
 
-            for entry in meaning_string.split('#'):
+            for entry in ''.join(meaning_strings).split('#'):
                 if entry == '': continue
                 components = entry.split('*')
                 word['meanings'].append({'text': components[0], 'examples': components[1:]})
@@ -100,7 +147,7 @@ class WordExtractor(object):
 
 if __name__ == '__main__':
     extractor = WordExtractor()
-    #words = extractor.analyze(BeautifulSoup(open('test.html').read()))
+    #words = extractor.analyze(extractor.parse(open('test.html').read()))
     #words = extractor.extract('錆びる')
     #words = extractor.extract('背景')
     #words = extractor.extract('容貌')
@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from nihonngo.api import api_build_kana_neighbor_index
+
+
+class Command(NoArgsCommand):
+    help = '重新建立全部生词的假名近邻索引。'
+
+    def handle_noargs(self, **options):
+        count = api_build_kana_neighbor_index()
+        self.stdout.write('已为 {0} 个假名建立近邻索引。'.format(count))
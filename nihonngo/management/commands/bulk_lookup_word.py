@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from nihonngo.api import api_bulk_lookup_word
+
+from optparse import make_option
+import codecs
+
+
+class Command(BaseCommand):
+    args = '<input_file> <output_file>'
+    help = '从网络词典中批量查询 input_file 中的生词（每行一个），结果以 JSONL 格式追加写入 output_file。'
+    option_list = BaseCommand.option_list + (
+        make_option('--encoding', default = 'utf-8', help = '输入文件的编码。'),
+        make_option('--workers', type = 'int', default = 4, help = '并发查询的线程数。'),
+        make_option('--rate', type = 'float', default = 2.0, help = '每秒的最大请求数。'),
+        make_option('--retries', type = 'int', default = 3, help = '每个生词失败后的最大重试次数。'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('需要指定输入文件和输出文件。')
+        input_file, output_file = args
+
+        with codecs.open(input_file, 'r', options['encoding'], errors = 'ignore') as fin:
+            kannjis = [line.strip() for line in fin if line.strip() != '']
+
+        summary = api_bulk_lookup_word(kannjis, output_file,
+                                       workers = options['workers'], rate = options['rate'], retries = options['retries'])
+        self.stdout.write('跳过 {skipped} 个，成功 {succeeded} 个，失败 {failed} 个。'.format(**summary))
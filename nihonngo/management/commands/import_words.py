@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from nihonngo.batch import batch_import_from_file
+
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    args = '<input_file>'
+    help = '从文件中批量导入生词，每行的格式为：汉字||假名||词类||释义*例句#释义。'
+    option_list = BaseCommand.option_list + (
+        make_option('--encoding', default = 'utf-8', help = '输入文件的编码。'),
+        make_option('--chunk-size', dest = 'chunk_size', type = 'int', default = 1000, help = '每个事务中插入的生词个数。'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('需要指定输入文件。')
+
+        report = batch_import_from_file(args[0], encoding = options['encoding'], chunk_size = options['chunk_size'])
+        for line_number, message in report['errors']:
+            self.stderr.write('第 {0} 行：{1}'.format(line_number, message))
+        self.stdout.write('导入 {0} 个生词，跳过 {1} 个已存在的生词，{2} 行出错。'.format(
+                          report['imported'], report['duplicated'], len(report['errors'])))
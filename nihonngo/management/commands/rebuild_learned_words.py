@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from nihonngo.api import api_rebuild_learned_words
+
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    args = '[<user_id> ...]'
+    help = '根据回答记录重新计算用户的已学习生词，未指定用户时重新计算全部用户。'
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type = 'int', default = 4, help = '并行计算的进程数。'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            user_ids = [int(arg) for arg in args] if len(args) > 0 else None
+        except ValueError:
+            raise CommandError('用户 ID 必须为整数。')
+
+        results = api_rebuild_learned_words(user_ids, processes = options['processes'])
+        for user_id, count in sorted(results.items()):
+            self.stdout.write('用户 {0}：{1} 个已学习生词。'.format(user_id, count))
@@ -0,0 +1,11 @@
+from django.core.management.base import NoArgsCommand
+
+from nihonngo.api import api_rebuild_search_index
+
+
+class Command(NoArgsCommand):
+    help = '重新建立全部生词的搜索索引。'
+
+    def handle_noargs(self, **options):
+        count = api_rebuild_search_index()
+        self.stdout.write('已为 {0} 个生词建立搜索索引。'.format(count))
@@ -0,0 +1,16 @@
+from django.core.management.base import NoArgsCommand
+
+from nihonngo.api import api_auth_sweep_tokens
+
+from optparse import make_option
+
+
+class Command(NoArgsCommand):
+    help = '删除已失效或已过期的自动认证令牌，应定期执行（例如每天一次的 cron 任务）。'
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest = 'batch_size', type = 'int', default = 1000, help = '每批删除的令牌个数。'),
+    )
+
+    def handle_noargs(self, **options):
+        count = api_auth_sweep_tokens(batch_size = options['batch_size'])
+        self.stdout.write('已删除 {0} 个失效或过期的令牌。'.format(count))
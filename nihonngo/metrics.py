@@ -0,0 +1,233 @@
+from django.conf import settings
+from django.db import OperationalError
+from django.db.backends import util
+from django.views.generic import View
+
+import bisect, functools, inspect, threading, time
+
+"""
+    进程内的调用指标。记录每个 API 函数及视图的调用次数、异常次数、耗时分布及每次调用
+    执行的 SQL 语句数。耗时和语句数以固定分桶的直方图累计，记录一次调用只需常数时间和
+    常数内存，分位数由直方图估算。
+        耗时的分桶从 0.1 毫秒到约 26 秒，相邻分桶的上界之比为 √2，估算的误差在 ±20% 以内；
+        SQL 语句数的计数挂在 Django 的 CursorWrapper 上，每个线程分别计数，嵌套调用时外层
+        的语句数包含内层的语句数。同时记录 SQLite 的 database is locked 错误的次数。
+    NIHONNGO_METRICS_ENABLED 设为 False 时 instrument_* 不做任何包装。
+"""
+
+METRICS_ENABLED = getattr(settings, 'NIHONNGO_METRICS_ENABLED', True)
+
+LATENCY_BOUNDS = tuple(0.0001 * 2 ** (i / 2) for i in range(37))
+QUERY_BOUNDS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20, 30, 50, 100, 200, 500, 1000)
+PERCENTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram(object):
+    """
+    固定分桶的直方图。counts[i] 为落在 (bounds[i - 1], bounds[i]] 中的个数，最后一个
+    分桶记录大于 bounds[-1] 的值。
+    """
+    def __init__(self, bounds):
+        super(Histogram, self).__init__()
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        """
+        估算 p 分位数，在分桶内按线性插值。没有任何记录时返回 None。
+        """
+        if self.count == 0:
+            return None
+        rank, cumulative = p * self.count, 0
+        for i, count in enumerate(self.counts):
+            if count > 0 and cumulative + count >= rank:
+                lower = self.bounds[i - 1] if i > 0 else 0
+                upper = min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+                return lower + (upper - lower) * max(rank - cumulative, 0) / count
+            cumulative += count
+        return self.max
+
+    def summary(self):
+        summary = {'count': self.count, 'sum': self.sum, 'max': self.max,
+                   'mean': self.sum / self.count if self.count > 0 else None}
+        for p in PERCENTILES:
+            summary['p{0:g}'.format(p * 100)] = self.percentile(p)
+        return summary
+
+
+class CallMetric(object):
+    def __init__(self):
+        super(CallMetric, self).__init__()
+        self.errors = 0
+        self.latency = Histogram(LATENCY_BOUNDS)
+        self.queries = Histogram(QUERY_BOUNDS)
+
+    def observe(self, seconds, queries, failed):
+        self.latency.observe(seconds)
+        self.queries.observe(queries)
+        if failed:
+            self.errors += 1
+
+    def summary(self):
+        return {
+            'calls'  : self.latency.count,
+            'errors' : self.errors,
+            'latency': self.latency.summary(),
+            'queries': self.queries.summary(),
+        }
+
+
+METRICS = {}
+METRICS_LOCK = threading.Lock()
+
+def record(name, seconds, queries, failed = False):
+    """
+    记录一次调用。
+        参数：
+            name     API 函数或视图的名称；
+            seconds  调用的耗时（秒）；
+            queries  调用期间执行的 SQL 语句数；
+            failed   调用是否抛出了异常。
+    """
+    with METRICS_LOCK:
+        metric = METRICS.get(name)
+        if metric is None:
+            metric = METRICS[name] = CallMetric()
+        metric.observe(seconds, queries, failed)
+
+def snapshot():
+    """
+    返回所有调用指标的摘要，名称到摘要的 dict 实例。
+    """
+    with METRICS_LOCK:
+        return dict((name, metric.summary()) for name, metric in METRICS.items())
+
+def reset():
+    with METRICS_LOCK:
+        METRICS.clear()
+
+
+# MARK - Query Counter
+
+class QueryCounter(threading.local):
+    count = 0
+    lock_errors = 0
+
+QUERY_COUNTER = QueryCounter()
+
+def p_count_queries(method):
+    @functools.wraps(method)
+    def counting(self, *args, **kwargs):
+        QUERY_COUNTER.count += 1
+        try:
+            return method(self, *args, **kwargs)
+        except OperationalError as e:
+            if 'database is locked' in str(e):
+                QUERY_COUNTER.lock_errors += 1
+            raise
+    counting.counts_queries = True
+    return counting
+
+def install_query_counter():
+    """
+    在 CursorWrapper 的 execute 和 executemany 上计数。CursorDebugWrapper 经由 super 调用
+    这两个方法，因此 DEBUG 模式下同样有效。重复调用不会重复计数。
+    """
+    for name in ('execute', 'executemany'):
+        method = getattr(util.CursorWrapper, name)
+        if not getattr(method, 'counts_queries', False):
+            setattr(util.CursorWrapper, name, p_count_queries(method))
+
+
+# MARK - Instrumentation
+
+def instrument(function, name = None):
+    """
+    包装 function，记录其每次调用的耗时、SQL 语句数及是否抛出异常。
+        参数：
+            function  被包装的函数；
+            name      指标的名称，默认为函数名。
+        返回值：
+            包装后的函数，原函数的属性（如 trusted）被保留。
+    """
+    if not METRICS_ENABLED or getattr(function, 'instrumented', False):
+        return function
+    name = name if name is not None else function.__name__
+    counter, clock = QUERY_COUNTER, time.perf_counter
+
+    @functools.wraps(function)
+    def instrumented_call(*args, **kwargs):
+        queries, start, failed = counter.count, clock(), True
+        try:
+            result = function(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            record(name, clock() - start, counter.count - queries, failed)
+    instrumented_call.instrumented = True
+    return instrumented_call
+
+def instrument_module(namespace, prefix = 'api_'):
+    """
+    包装 namespace（模块的 globals()）中所有名称以 prefix 开头的函数。应在模块的末尾
+    调用，这样模块内部的调用以及其他模块随后导入的名称都指向包装后的函数。
+    """
+    install_query_counter()
+    for name, value in list(namespace.items()):
+        if name.startswith(prefix) and inspect.isfunction(value):
+            namespace[name] = instrument(value)
+
+def instrument_views(namespace):
+    """
+    包装 namespace 中定义的所有基于类的视图的 dispatch 方法，指标名称为 view.类名。
+    """
+    install_query_counter()
+    module_name = namespace['__name__']
+    for name, value in list(namespace.items()):
+        if inspect.isclass(value) and issubclass(value, View) and value.__module__ == module_name:
+            value.dispatch = instrument(value.dispatch, 'view.{0}'.format(name))
+
+
+# MARK - Exposition
+
+def p_escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def p_prometheus_histogram(lines, metric_name, label, histogram):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append('{0}_bucket{{name="{1}",le="{2:g}"}} {3}'.format(metric_name, label, bound, cumulative))
+    lines.append('{0}_bucket{{name="{1}",le="+Inf"}} {2}'.format(metric_name, label, histogram.count))
+    lines.append('{0}_sum{{name="{1}"}} {2:g}'.format(metric_name, label, histogram.sum))
+    lines.append('{0}_count{{name="{1}"}} {2}'.format(metric_name, label, histogram.count))
+
+def prometheus_text():
+    """
+    以 Prometheus 文本格式（0.0.4）输出所有调用指标。
+    """
+    with METRICS_LOCK:
+        metrics = sorted((name, metric.errors, metric.latency, metric.queries) for name, metric in METRICS.items())
+        lines = ['# HELP nihonngo_call_errors_total 抛出异常的调用次数。',
+                 '# TYPE nihonngo_call_errors_total counter']
+        for name, errors, latency, queries in metrics:
+            lines.append('nihonngo_call_errors_total{{name="{0}"}} {1}'.format(p_escape_label(name), errors))
+        lines += ['# HELP nihonngo_call_duration_seconds 调用的耗时（秒）。',
+                  '# TYPE nihonngo_call_duration_seconds histogram']
+        for name, errors, latency, queries in metrics:
+            p_prometheus_histogram(lines, 'nihonngo_call_duration_seconds', p_escape_label(name), latency)
+        lines += ['# HELP nihonngo_call_queries 每次调用执行的 SQL 语句数。',
+                  '# TYPE nihonngo_call_queries histogram']
+        for name, errors, latency, queries in metrics:
+            p_prometheus_histogram(lines, 'nihonngo_call_queries', p_escape_label(name), queries)
+    return '\n'.join(lines) + '\n'
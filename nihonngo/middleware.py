@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+
+from nihonngo.api import APIException, api_auth_get_user
+from nihonngo.profiler import RequestProfile
+
+import os, random
+
+"""
+    为每个请求附加 request.nihonngo_user 属性：已登录用户的 User 实例，未登录或用户不存在时
+    为 None。该属性在首次使用时才读取，同一请求中的多次使用只读取一次，跨请求的读取由
+    api_auth_get_user 的进程内缓存负责。须放在 SessionMiddleware 之后。
+"""
+
+def get_user(request):
+    if 'user_id' not in request.session:
+        return None
+    try:
+        return api_auth_get_user(request.session['user_id'])
+    except APIException:
+        return None
+
+
+class NihonngoUserMiddleware(object):
+    def process_request(self, request):
+        request.nihonngo_user = SimpleLazyObject(lambda: get_user(request))
+
+
+class ProfilerMiddleware(object):
+    """
+    按比例抽样，或对带有 X-Nihonngo-Profile 头的管理员请求，用 cProfile 剖析视图及模板渲染，
+    并将报告写入 NIHONNGO_PROFILER_DIR。头的值为 memory 时同时用 tracemalloc 记录内存分配，
+    抽样的请求是否记录内存分配由 NIHONNGO_PROFILER_TRACE_MEMORY 决定。管理员请求的响应
+    带有 X-Nihonngo-Profile 头，其值为报告的文件名。须放在 AuthenticationMiddleware 之后。
+    """
+    def __init__(self):
+        self.sample_rate = getattr(settings, 'NIHONNGO_PROFILER_SAMPLE_RATE', 0)
+        self.trace_memory = getattr(settings, 'NIHONNGO_PROFILER_TRACE_MEMORY', False)
+        self.directory = getattr(settings, 'NIHONNGO_PROFILER_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+        self.max_reports = getattr(settings, 'NIHONNGO_PROFILER_MAX_REPORTS', 100)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        header = request.META.get('HTTP_X_NIHONNGO_PROFILE')
+        if header is not None and getattr(request, 'user', None) is not None and request.user.is_staff:
+            profile = RequestProfile(request, trace_memory = header == 'memory')
+            profile.requested = True
+        elif self.sample_rate > 0 and random.random() < self.sample_rate:
+            profile = RequestProfile(request, trace_memory = self.trace_memory)
+            profile.requested = False
+        else:
+            return None
+        request.nihonngo_profile = profile
+        profile.start()
+
+    def process_response(self, request, response):
+        profile = getattr(request, 'nihonngo_profile', None)
+        if profile is None:
+            return response
+        del(request.nihonngo_profile)
+        profile.stop()
+        name = profile.dump(self.directory, response.status_code, self.max_reports)
+        if profile.requested:
+            response['X-Nihonngo-Profile'] = name
+        return response
@@ -1,4 +1,7 @@
 from django.db import models
+from django.utils import timezone
+
+from datetime import date
 
 class User(models.Model):
     name     = models.CharField(max_length = 10)
@@ -8,32 +11,30 @@ class User(models.Model):
         return self.name
 
 class SignInToken(models.Model):
+    """
+    自动认证令牌。数据库中只保存令牌的 SHA-256 摘要，令牌本身仅在创建时返回给用户。
+    """
     user        = models.ForeignKey(User)
-    token       = models.CharField(max_length = 40)
+    token_hash  = models.CharField(max_length = 64, unique = True)
     expired     = models.BooleanField(default = False)
-    expire_date = models.DateTimeField()
+    expire_date = models.DateTimeField(db_index = True)
 
     def __str__(self):
-        return '{0}({1}), expire date: {2}'.format(self.user.name, self.token, self.expire_date)
+        return '{0}({1}), expire date: {2}'.format(self.user.name, self.token_hash[:8], self.expire_date)
 
 class Word(models.Model):
     """"""
     kannji = models.CharField(max_length = 100)
     kana   = models.CharField(max_length = 100)
 
+    class Meta:
+        unique_together = (('kannji', 'kana'),)
+
     def __str__(self):
         return '{0}({1})'.format(self.kannji, self.kana)
 
-    @property
-    def word_classes(self):
-        return WordClass.objects.filter(word = self)
-
     def get_word_classes_display(self, separator = '，'):
-        return separator.join(sorted(word_class.get_word_class_display() for word_class in self.word_classes))
-
-    @property
-    def meanings(self):
-        return Meaning.objects.filter(word = self)
+        return separator.join(sorted(word_class.get_word_class_display() for word_class in self.word_classes.all()))
 
 
 class WordClass(models.Model):
@@ -62,7 +63,7 @@ class WordClass(models.Model):
     WORD_CLASS_DICTIONARY = dict([(v, k) for k, v in WORD_CLASSES])
 
 
-    word       = models.ForeignKey(Word)
+    word       = models.ForeignKey(Word, related_name = 'word_classes')
     word_class = models.IntegerField(default = 0, choices = WORD_CLASSES)
 
     def __str__(self):
@@ -74,26 +75,66 @@ class WordClass(models.Model):
 
 class Meaning(models.Model):
     """"""
-    word = models.ForeignKey(Word)
+    word = models.ForeignKey(Word, related_name = 'meanings')
     text = models.CharField(max_length = 200)
 
     def __str__(self):
         return '{0}-{1}'.format(self.word, self.text)
 
-    @property
-    def examples(self):
-        return Example.objects.filter(meaning = self)
-
 
 class Example(models.Model):
     """"""
-    meaning = models.ForeignKey(Meaning)
+    meaning = models.ForeignKey(Meaning, related_name = 'examples')
     text    = models.CharField(max_length = 200)
 
     def __str__(self):
         return '{0}-{1}'.format(self.meaning.word, self.text)
 
 
+class LookupCache(models.Model):
+    """
+    网络词典查询结果的缓存，result 为 WordExtractor.extract 返回值的 JSON。
+    """
+    query       = models.CharField(max_length = 100, unique = True)
+    result      = models.TextField()
+    fetch_date  = models.DateTimeField()
+    access_date = models.DateTimeField(db_index = True)
+
+    def __str__(self):
+        return '{0}, fetch date: {1}'.format(self.query, self.fetch_date)
+
+
+class SearchGram(models.Model):
+    """
+    生词搜索的倒排索引，记录生词的汉字、假名、释义及例句中出现的单字和双字组合。
+    """
+    SOURCES = (
+        (0, '汉字'),
+        (1, '假名'),
+        (2, '释义'),
+        (3, '例句'),
+    )
+
+    gram   = models.CharField(max_length = 2, db_index = True)
+    word   = models.ForeignKey(Word, related_name = 'search_grams')
+    source = models.IntegerField(choices = SOURCES)
+
+    def __str__(self):
+        return '{0}-{1}({2})'.format(self.gram, self.word, self.get_source_display())
+
+
+class KanaNeighbor(models.Model):
+    """
+    假名近邻索引，记录与 kana 最相似的若干个假名，供假名测试生成干扰项使用。
+    """
+    kana       = models.CharField(max_length = 100, db_index = True)
+    neighbor   = models.CharField(max_length = 100)
+    lcs_length = models.IntegerField()
+
+    def __str__(self):
+        return '{0}-{1}({2})'.format(self.kana, self.neighbor, self.lcs_length)
+
+
 class Question(models.Model):
     """"""
     QUESTION_TYPES = (
@@ -108,6 +149,12 @@ class Question(models.Model):
     answered          = models.BooleanField(default = False)
     answer_date       = models.DateTimeField(null = True, blank = True)
     answer_is_correct = models.BooleanField(default = False)
+    payload           = models.TextField(blank = True, default = '')
+    # 问题预生成池中尚未取出的问题，取出之后置为 False。
+    pooled            = models.BooleanField(default = False)
+
+    class Meta:
+        index_together = (('user', 'answered'),)
 
     def __str__(self):
         return '{0}({1})-{2}'.format(self.get_question_type_display(), self.user.name, self.question)
@@ -117,20 +164,81 @@ class LearnedWord(models.Model):
     """"""
     word                   = models.ForeignKey(Word)
     user                   = models.ForeignKey(User)
-    learned_date           = models.DateField(auto_now_add = True)
-    last_review_date       = models.DateField(auto_now_add = True)
+    learned_date           = models.DateField(default = date.today)
+    last_review_date       = models.DateField(default = date.today)
     total_answered_count   = models.IntegerField(default = 0)
     correct_answered_count = models.IntegerField(default = 0)
     unfamiliarity          = models.FloatField(default = 1)
 
+    class Meta:
+        unique_together = (('user', 'word'),)
+        index_together = (('user', 'unfamiliarity'),)
+
 
 class UpdateHistory(models.Model):
     """"""
     user        = models.ForeignKey(User)
     update_date = models.DateTimeField(auto_now_add = True)
 
+    class Meta:
+        index_together = (('user', 'update_date'),)
+
+
+class UserStatistics(models.Model):
+    """
+    用户测试数据的汇总，在回答问题时增量更新，统计页面只需读取这一行。
+    unfamiliarity_sum 为已学习生词所记录的不熟悉度之和。modified_date 为最后一次更新的时间，
+    用于统计页面的条件请求。
+    """
+    user                   = models.OneToOneField(User, related_name = 'statistics')
+    answered_count         = models.IntegerField(default = 0)
+    correct_answered_count = models.IntegerField(default = 0)
+    learned_word_count     = models.IntegerField(default = 0)
+    unfamiliarity_sum      = models.FloatField(default = 0)
+    modified_date          = models.DateTimeField(default = timezone.now)
+
+    def __str__(self):
+        return '{0}: {1}/{2}'.format(self.user.name, self.correct_answered_count, self.answered_count)
+
+    @property
+    def correct_answer_probability(self):
+        return self.correct_answered_count / self.answered_count if self.answered_count > 0 else 0.0
+
+    @property
+    def average_unfamiliarity(self):
+        return self.unfamiliarity_sum / self.learned_word_count if self.learned_word_count > 0 else 0.0
+
+
+class DailyStatistics(models.Model):
+    """
+    用户每天回答问题的汇总，与 UserStatistics 同时更新。
+    """
+    user                   = models.ForeignKey(User, related_name = 'daily_statistics')
+    date                   = models.DateField()
+    answered_count         = models.IntegerField(default = 0)
+    correct_answered_count = models.IntegerField(default = 0)
+
+    class Meta:
+        unique_together = (('user', 'date'),)
+
+    def __str__(self):
+        return '{0}({1}): {2}/{3}'.format(self.user.name, self.date, self.correct_answered_count, self.answered_count)
+
 
 class Grammar(models.Model):
     """"""
     pattern     = models.CharField(max_length = 200)
     explanation = models.CharField(max_length = 500)
+
+
+class ChangeVersion(models.Model):
+    """
+    数据的变更版本号，每次变更时递增，供页面的条件请求生成 ETag 及 Last-Modified。
+    键 vocabulary 在生词、词类、释义或例句发生变化时递增。
+    """
+    key           = models.CharField(max_length = 100, unique = True)
+    version       = models.IntegerField(default = 0)
+    modified_date = models.DateTimeField(default = timezone.now)
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.key, self.version)
@@ -0,0 +1,206 @@
+from django.conf import settings
+from django.db import connection, DatabaseError
+
+from nihonngo.models import User, Question
+from nihonngo.api import APIException, api_create_question, p_get_unanswered_question, p_get_versions, p_learned_version_key
+
+from concurrent.futures import ThreadPoolExecutor
+import collections, json, logging, threading
+
+"""
+    问题预生成池。每个用户保有若干个预先生成好的问题，GET 请求直接从池中取出，
+    回答问题之后由后台线程补充。池中的问题在以下情况下失效：
+        1. 生词表发生变化（词汇表版本号变化）；
+        2. 用户的已学习生词被批量重新计算（已学习版本号变化）；
+        3. 用户回答了针对同一生词的问题。
+    失效的问题尚未被回答，会从数据库中一并删除。版本号存于数据库中（ChangeVersion），
+    因此多个进程各自的问题池都能看到其他进程中的修改。
+        池中的问题在数据库中标记为 pooled，取出时以一条 UPDATE 清除该标记，只有清除成功的
+    进程返回该问题，因此同一个问题不会被返回两次，也不会返回已被删除的问题。取出之后尚未
+    回答的问题即数据库中未回答且未标记 pooled 的问题，用户再次请求问题（例如刷新页面，即使
+    请求由其他进程处理）时返回该问题，而不是生成新的问题。
+        进程重启之后，之前生成的池中问题不再属于任何问题池。每个进程中用户第一次取出问题时，
+    删除该用户不属于本进程问题池的池中问题；其他进程池中的问题因此被删除时，这些进程取出
+    失败，视为失效。
+"""
+
+logger = logging.getLogger(__name__)
+
+PooledQuestion = collections.namedtuple('PooledQuestion', ['question_id', 'word_id', 'versions', 'question'])
+
+
+class QuestionPool(object):
+    def __init__(self, size = 5, max_workers = 2):
+        super(QuestionPool, self).__init__()
+        self.size = size
+        self.lock = threading.Lock()
+        self.questions = {}
+        self.refilling = set()
+        self.reclaimed = set()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.executor = ThreadPoolExecutor(max_workers = max_workers)
+
+    @staticmethod
+    def versions(user_id):
+        return p_get_versions('vocabulary', p_learned_version_key(user_id))
+
+    def stats(self):
+        """
+        返回命中、未命中及失效的问题个数，以及当前池中的问题总数。
+        """
+        with self.lock:
+            return {
+                'size'         : self.size,
+                'hits'         : self.hits,
+                'misses'       : self.misses,
+                'invalidations': self.invalidations,
+                'pooled'       : sum(len(q) for q in self.questions.values()),
+            }
+
+    def pop(self, user):
+        """
+        为用户取出一个问题。上一次取出的问题尚未回答时再次返回该问题；池中没有可用的问题时
+        同步生成一个，并在后台补充问题池。
+            参数：
+                user  用户的 User 实例。
+            返回值：
+                修剪后的问题，与 api_create_question 的返回值相同。
+        """
+        question = p_get_unanswered_question(user.id)
+        if question is not None:
+            return question
+
+        self.reclaim(user.id)
+        versions = self.versions(user.id)
+        stale_ids, lost_count = [], 0
+        while question is None:
+            with self.lock:
+                pooled_questions = self.questions.get(user.id)
+                if not pooled_questions:
+                    break
+                entry = pooled_questions.popleft()
+            if entry.versions != versions:
+                stale_ids.append(entry.question_id)
+            elif self.claim(entry):
+                question = entry.question
+            else:
+                lost_count += 1
+
+        with self.lock:
+            self.invalidations += len(stale_ids) + lost_count
+            if question is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        self.discard_questions(stale_ids)
+        if question is None:
+            question = api_create_question(user, return_unanswered = False)
+        self.refill(user.id)
+        return question
+
+    @staticmethod
+    def claim(entry):
+        """
+        清除池中问题的 pooled 标记，问题已被其他进程取出或删除时返回 False。问题被删除之后
+        SQLite 可能复用其 ID，因此同时比对生词及选项。
+        """
+        return Question.objects.filter(id = entry.question_id, related_word_id = entry.word_id, question = json.dumps(entry.question['question']),
+                                       answered = False, pooled = True).update(pooled = False) == 1
+
+    def reclaim(self, user_id):
+        """
+        每个进程中用户第一次取出问题时，删除该用户不属于本进程问题池的池中问题，
+        例如重启之前的进程生成的问题。
+        """
+        with self.lock:
+            if user_id in self.reclaimed:
+                return
+            self.reclaimed.add(user_id)
+            owned_ids = [entry.question_id for entry in self.questions.get(user_id, ())]
+        orphans = Question.objects.filter(user_id = user_id, answered = False, pooled = True).exclude(id__in = owned_ids)
+        orphan_count = orphans.count()
+        if orphan_count > 0:
+            orphans.delete()
+            logger.info('删除了用户 %s 的 %s 个不属于任何问题池的问题。', user_id, orphan_count)
+
+    def notify_answered(self, user_id, question_id):
+        """
+        用户回答问题之后调用：移除池中针对同一生词的问题，并在后台补充问题池。
+        """
+        word_ids = list(Question.objects.filter(id = question_id).values_list('related_word_id', flat = True))
+        stale_ids = []
+        with self.lock:
+            pooled_questions = self.questions.get(user_id, collections.deque())
+            for entry in list(pooled_questions):
+                if entry.question_id == question_id or entry.word_id in word_ids:
+                    pooled_questions.remove(entry)
+                    stale_ids.append(entry.question_id)
+            self.invalidations += len(stale_ids)
+        self.discard_questions(stale_ids)
+        self.refill(user_id)
+
+    def submit(self, function, *args):
+        """
+        在后台执行 function，未预料到的异常连同调用栈一起写入日志。
+        """
+        self.executor.submit(function, *args).add_done_callback(p_log_failure)
+
+    def discard_questions(self, question_ids):
+        if len(question_ids) > 0:
+            self.submit(self.delete_unanswered_questions, question_ids)
+
+    def refill(self, user_id):
+        """
+        在后台为用户补充问题池，同一用户同时只有一个补充任务。
+        """
+        if self.size <= 0:
+            return
+        with self.lock:
+            if user_id in self.refilling:
+                return
+            self.refilling.add(user_id)
+        self.submit(self.fill, user_id)
+
+    def fill(self, user_id):
+        try:
+            user = User.objects.get(id = user_id)
+            while True:
+                versions = self.versions(user_id)
+                with self.lock:
+                    pooled_questions = self.questions.setdefault(user_id, collections.deque())
+                    if len(pooled_questions) >= self.size:
+                        break
+                question = api_create_question(user, return_unanswered = False, pooled = True)
+                word_id = Question.objects.filter(id = question['question_id']).values_list('related_word_id', flat = True)[0]
+                with self.lock:
+                    pooled_questions.append(PooledQuestion(question['question_id'], word_id, versions, question))
+        except APIException as e:
+            # 例如生词表为空，此时无法预先生成问题。
+            logger.warning('无法补充用户 %s 的问题池：%s', user_id, e.debug_message)
+        except DatabaseError:
+            logger.exception('补充用户 %s 的问题池失败。', user_id)
+        finally:
+            with self.lock:
+                self.refilling.discard(user_id)
+            connection.close()
+
+    def delete_unanswered_questions(self, question_ids):
+        try:
+            Question.objects.filter(id__in = question_ids, answered = False, pooled = True).delete()
+        except DatabaseError:
+            logger.exception('删除失效的问题 %s 失败。', question_ids)
+        finally:
+            connection.close()
+
+
+def p_log_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        error = future.exception()
+        logger.error('问题池的后台任务失败：%r', error, exc_info = (type(error), error, error.__traceback__))
+
+
+QUESTION_POOL = QuestionPool(size = getattr(settings, 'NIHONNGO_QUESTION_POOL_SIZE', 5),
+                             max_workers = getattr(settings, 'NIHONNGO_QUESTION_POOL_WORKERS', 2))
@@ -0,0 +1,126 @@
+from django.db import connection
+
+import cProfile, glob, io, itertools, os, pstats, re, threading, time, tracemalloc
+
+from nihonngo.metrics import QUERY_COUNTER
+
+"""
+    单个请求的性能剖析。在视图开始前启动 cProfile（可选地同时启动 tracemalloc），在
+    响应返回前停止，并将剖析结果写入报告目录：
+        <时间>-<进程号>-<序号>-<路径>.prof  cProfile 的原始数据，可由 pstats 或 snakeviz 读取；
+        <时间>-<进程号>-<序号>-<路径>.txt   请求路径、耗时、SQL 语句汇总、耗时最多的函数以及
+                                   新增内存最多的代码行。
+    报告目录中只保留最新的若干份报告，更早的报告在写入新报告时被删除。
+"""
+
+SLUG_PATTERN = re.compile('[^0-9A-Za-z]+')
+SQL_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+# SQLite 后端的 last_executed_query 返回 "QUERY = '<SQL>' - PARAMS = (...)"。
+SQLITE_QUERY_PATTERN = re.compile(r"^QUERY = '(.*)' - PARAMS = .*$", re.DOTALL)
+REPORT_SEQUENCE = itertools.count()
+
+# tracemalloc 是进程全局的，同时剖析多个请求时只在最后一个请求结束时停止。
+TRACEMALLOC_LOCK = threading.Lock()
+TRACEMALLOC_USERS = 0
+
+def p_start_tracemalloc():
+    global TRACEMALLOC_USERS
+    with TRACEMALLOC_LOCK:
+        if TRACEMALLOC_USERS == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        TRACEMALLOC_USERS += 1
+    return tracemalloc.take_snapshot()
+
+def p_stop_tracemalloc():
+    global TRACEMALLOC_USERS
+    snapshot = tracemalloc.take_snapshot()
+    with TRACEMALLOC_LOCK:
+        TRACEMALLOC_USERS -= 1
+        if TRACEMALLOC_USERS == 0:
+            tracemalloc.stop()
+    return snapshot
+
+def summarize_queries(queries, limit = 10):
+    """
+    按语句模式（去掉字面量之后的 SQL）汇总 SQL 语句。
+        参数：
+            queries  connection.queries 格式的 list 实例；
+            limit    返回的语句模式的最大个数。
+        返回值：
+            (次数, 总耗时, 语句模式) 的 list 实例，按总耗时及次数降序排列。
+    """
+    patterns = {}
+    for query in queries:
+        match = SQLITE_QUERY_PATTERN.match(query['sql'])
+        pattern = SQL_LITERAL_PATTERN.sub('?', match.group(1) if match else query['sql'])
+        count, seconds = patterns.get(pattern, (0, 0.0))
+        patterns[pattern] = (count + 1, seconds + float(query['time']))
+    summary = sorted(((count, seconds, pattern) for pattern, (count, seconds) in patterns.items()), key = lambda s: (-s[1], -s[0]))
+    return summary[:limit]
+
+
+class RequestProfile(object):
+    def __init__(self, request, trace_memory = False):
+        super(RequestProfile, self).__init__()
+        self.request = request
+        self.trace_memory = trace_memory
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.use_debug_cursor = connection.use_debug_cursor
+        connection.use_debug_cursor = True
+        self.query_index = len(connection.queries)
+        self.query_count = QUERY_COUNTER.count
+        self.memory_snapshot = p_start_tracemalloc() if self.trace_memory else None
+        self.start_time = time.perf_counter()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        self.seconds = time.perf_counter() - self.start_time
+        self.queries = connection.queries[self.query_index:]
+        self.query_count = QUERY_COUNTER.count - self.query_count
+        connection.use_debug_cursor = self.use_debug_cursor
+        self.allocations = p_stop_tracemalloc().compare_to(self.memory_snapshot, 'lineno') if self.trace_memory else None
+
+    def report(self, status_code):
+        out = io.StringIO()
+        out.write('{0} {1} -> {2}\n'.format(self.request.method, self.request.get_full_path(), status_code))
+        out.write('耗时：{0:.1f} ms\n'.format(self.seconds * 1000))
+        out.write('SQL 语句：{0} 条，共 {1:.1f} ms\n'.format(self.query_count, sum(float(q['time']) for q in self.queries) * 1000))
+        for count, seconds, pattern in summarize_queries(self.queries):
+            out.write('  {0:>4} 次 {1:>8.1f} ms  {2}\n'.format(count, seconds * 1000, pattern))
+
+        out.write('\n耗时最多的函数：\n')
+        stats = pstats.Stats(self.profile, stream = out)
+        stats.sort_stats('cumulative').print_stats(30)
+
+        if self.allocations is not None:
+            out.write('新增内存最多的代码行：\n')
+            for statistic in self.allocations[:20]:
+                out.write('  {0}\n'.format(statistic))
+        return out.getvalue()
+
+    def dump(self, directory, status_code, max_reports = 100):
+        """
+        将剖析结果写入 directory，并删除超出 max_reports 份的旧报告。
+            返回值：
+                报告的文件名（不含扩展名）。
+        """
+        os.makedirs(directory, exist_ok = True)
+        slug = SLUG_PATTERN.sub('-', self.request.path).strip('-')[:80] or 'root'
+        name = '{0}-{1}-{2}-{3}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(REPORT_SEQUENCE), slug)
+        self.profile.dump_stats(os.path.join(directory, name + '.prof'))
+        with open(os.path.join(directory, name + '.txt'), 'w', encoding = 'utf-8') as fout:
+            fout.write(self.report(status_code))
+        rotate_reports(directory, max_reports)
+        return name
+
+def rotate_reports(directory, max_reports):
+    reports = sorted(glob.glob(os.path.join(directory, '*.txt')), key = os.path.getmtime)
+    for path in reports[:max(len(reports) - max_reports, 0)]:
+        for stale_path in (path, path[:-4] + '.prof'):
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
@@ -0,0 +1,146 @@
+import random, threading
+
+"""
+    按权重随机抽取元素的数据结构。抽取、修改权重均为 O(log n)。
+"""
+
+class FenwickTree(object):
+    """
+    树状数组，维护一个浮点数序列的前缀和。下标从 0 开始。
+    """
+    def __init__(self, values = ()):
+        super(FenwickTree, self).__init__()
+        self.values = []
+        self.tree = [0.0]
+        self.extend(values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def extend(self, values):
+        """
+        在序列末尾追加若干个值，O(n) 地重建整棵树。
+        """
+        self.values.extend(values)
+        self.tree = [0.0] + list(self.values)
+        for i in range(1, len(self.tree)):
+            parent = i + (i & -i)
+            if parent < len(self.tree):
+                self.tree[parent] += self.tree[i]
+
+    def append(self, value):
+        """
+        在序列末尾追加一个值，O(log n)。
+        """
+        i = len(self.tree)
+        self.tree.append(value + self.prefix_sum(i - 1) - self.prefix_sum(i - (i & -i)))
+        self.values.append(value)
+
+    def add(self, index, delta):
+        self.values[index] += delta
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def set(self, index, value):
+        self.add(index, value - self.values[index])
+
+    def prefix_sum(self, index):
+        """
+        返回前 index 个值的和。
+        """
+        total, i = 0.0, index
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+
+    @property
+    def total(self):
+        return self.prefix_sum(len(self.values))
+
+    def find(self, value):
+        """
+        返回满足 prefix_sum(index + 1) > value 的最小的 index。
+        """
+        index, step = 0, 1
+        while step * 2 < len(self.tree):
+            step *= 2
+        while step > 0:
+            if index + step < len(self.tree) and self.tree[index + step] <= value:
+                index += step
+                value -= self.tree[index]
+            step //= 2
+        return min(index, len(self.values) - 1)
+
+
+class UnfamiliaritySampler(object):
+    """
+    单个用户的已学习生词的抽样器，按不熟悉度加权随机抽取生词，同时维护不熟悉度之和。
+    不熟悉度低于 threshold 的生词不会被抽到，但仍计入平均不熟悉度。
+    """
+    def __init__(self, entries = (), threshold = 0.1):
+        super(UnfamiliaritySampler, self).__init__()
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.word_ids = []
+        self.positions = {}
+        self.unfamiliarities = []
+        self.unfamiliarity_sum = 0.0
+        self.weights = FenwickTree()
+
+        weights = []
+        for word_id, unfamiliarity in entries:
+            self.positions[word_id] = len(self.word_ids)
+            self.word_ids.append(word_id)
+            self.unfamiliarities.append(unfamiliarity)
+            self.unfamiliarity_sum += unfamiliarity
+            weights.append(self.weight(unfamiliarity))
+        self.weights.extend(weights)
+
+    def __len__(self):
+        return len(self.word_ids)
+
+    def __contains__(self, word_id):
+        return word_id in self.positions
+
+    def weight(self, unfamiliarity):
+        return unfamiliarity if unfamiliarity >= self.threshold else 0.0
+
+    @property
+    def average_unfamiliarity(self):
+        return self.unfamiliarity_sum / len(self.word_ids) if len(self.word_ids) > 0 else 0.0
+
+    def get(self, word_id):
+        return self.unfamiliarities[self.positions[word_id]]
+
+    def update(self, word_id, unfamiliarity):
+        """
+        修改生词的不熟悉度，若生词不在抽样器中则将其加入。
+        """
+        with self.lock:
+            if word_id not in self.positions:
+                self.positions[word_id] = len(self.word_ids)
+                self.word_ids.append(word_id)
+                self.unfamiliarities.append(unfamiliarity)
+                self.unfamiliarity_sum += unfamiliarity
+                self.weights.append(self.weight(unfamiliarity))
+            else:
+                index = self.positions[word_id]
+                self.unfamiliarity_sum += unfamiliarity - self.unfamiliarities[index]
+                self.unfamiliarities[index] = unfamiliarity
+                self.weights.set(index, self.weight(unfamiliarity))
+
+    def sample(self, rng = random):
+        """
+        按不熟悉度加权随机抽取一个生词。
+            返回值：
+                (word_id, unfamiliarity) 元组，所有生词的权重均为 0 时返回 None。
+        """
+        with self.lock:
+            total = self.weights.total
+            if total <= 0:
+                return None
+            index = self.weights.find(rng.random() * total)
+            return self.word_ids[index], self.unfamiliarities[index]
@@ -0,0 +1,50 @@
+import heapq
+
+"""
+    基于位并行（bit-parallel）算法的 LCS 相似度计算。
+    对查询串预先计算每个字符在串中出现位置的位掩码，之后与任意候选串比较时只需对
+    候选串的每个字符做常数次整数运算（Hyyrö 2004），无需为每个 DP 单元分配对象。
+"""
+
+class LCSScorer(object):
+    """
+    以固定的查询串为基准，计算其与候选串之间的最长公共子序列（LCS）的长度。
+    """
+    def __init__(self, query):
+        super(LCSScorer, self).__init__()
+        self.query = query
+        self.match_masks = {}
+        for i, char in enumerate(query):
+            self.match_masks[char] = self.match_masks.get(char, 0) | (1 << i)
+        self.full_mask = (1 << len(query)) - 1
+
+    def score(self, sequence):
+        """
+        计算查询串与 sequence 的 LCS 长度。
+        """
+        match_masks, full_mask = self.match_masks, self.full_mask
+        v = full_mask
+        for char in sequence:
+            u = v & match_masks.get(char, 0)
+            if u:
+                v = ((v + u) | (v - u)) & full_mask
+        return len(self.query) - bin(v).count('1')
+
+    def rank(self, candidates, size = None):
+        """
+        对全部候选串打分，返回按 (-LCS 长度, 候选串) 排序的前 size 个 (候选串, LCS 长度)。
+        size 为 None 时返回全部结果。
+        """
+        scored = ((candidate, self.score(candidate)) for candidate in candidates)
+        if size is None:
+            return sorted(scored, key = lambda e: (-e[1], e[0]))
+        return heapq.nsmallest(size, scored, key = lambda e: (-e[1], e[0]))
+
+
+def lcs_length(sequence1, sequence2):
+    """
+    计算两个 sequence 的最长公共子序列（LCS）的长度。
+    """
+    if len(sequence1) < len(sequence2):
+        sequence1, sequence2 = sequence2, sequence1
+    return LCSScorer(sequence2).score(sequence1)
@@ -1,6 +1,7 @@
 $(document).ready(function() {
     $('textarea.meaning-text').on('change keyup paste', resizeTextarea).each(resizeTextarea);
     $('ul.edit-entry a.submit').click(submitWord);
+    $('a.submit-all').click(submitAllWords);
     $('ul.edit-entry a.exists').click(function() {
         return false;
     });
@@ -10,8 +11,7 @@ function resizeTextarea() {
     $(this).css('height', 'auto').height(this.scrollHeight);
 };
 
-function submitWord() {
-    var $ul = $(this).parents('ul');
+function collectWordInfo($ul) {
     var data = {};
 
     data.kannji = $ul.find('input[name="kannji"]').val();
@@ -28,7 +28,13 @@ function submitWord() {
 
         data.meanings.push(meaning);
     });
-    
+
+    return data;
+}
+
+function submitWord() {
+    var data = collectWordInfo($(this).parents('ul.edit-entry'));
+
     //console.log($.toJSON(data));
 
     $.ajax({
@@ -49,3 +55,31 @@ function submitWord() {
 
     return false;
 }
+
+function submitAllWords() {
+    var wordInfos = [];
+
+    $('ul.edit-entry').has('a.submit').each(function() {
+        wordInfos.push(collectWordInfo($(this)));
+    });
+    if (wordInfos.length == 0)
+        return false;
+
+    $.ajax({
+        url      : $('#insertWordsURL').attr('value'),
+        type     : 'POST',
+        dataType : 'JSON',
+        data     : {'word_infos': $.toJSON(wordInfos)},
+        success  : function(data) {
+            console.log(data);
+            alert(data.message);
+            if (data.success)
+                $('ul.edit-entry a.submit').removeClass('submit').addClass('exists').text('生词已存在').off('click');
+        },
+        error    : function(jqXHR) {
+            $('html').html(jqXHR.responseText);
+        }
+    });
+
+    return false;
+}
@@ -1,3 +1,954 @@
-from django.test import TestCase
+from django.test import TestCase, RequestFactory
+from django.db import connection
+from django.core.urlresolvers import reverse
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.contrib.auth.models import User as StaffUser
+from django.db.models.query import QuerySet
+from django.utils.unittest import skipUnless
+from django.views import generic
+from django.http import HttpResponse
 
-# Create your tests here.
+from nihonngo.models import User, SignInToken, Word, Question, LearnedWord, UpdateHistory, UserStatistics, DailyStatistics, ChangeVersion, LookupCache
+from nihonngo.models import KanaNeighbor
+from nihonngo.api import APIException, api_insert_new_word, api_insert_new_words, api_create_word, api_search_word, api_rebuild_search_index
+from nihonngo.api import USER_CACHE, TOKEN_CACHE, api_answer_question, api_get_statistics, api_rebuild_learned_words
+from nihonngo.api import InvalidArgumentException, api_get_error_counts, api_auth_create_token, api_auth_validate_token, api_auth_mark_token_expired, api_auth_sweep_tokens
+from nihonngo.api import p_create_kana_question, p_prune_question, p_lcs_length, p_rebuild_statistics, api_get_change_version, p_rank_search_result
+from nihonngo.api import api_build_kana_neighbor_index, UNFAMILIARITY_SAMPLERS, p_get_unfamiliarity_sampler, api_create_question
+from nihonngo.api import LOOKUP_MEMORY_CACHE, LOOKUP_CACHE_TTL, api_lookup_word, p_lookup_word_cached, p_store_lookup_result
+from nihonngo.extract import WordExtractor
+from nihonngo.sampler import FenwickTree, UnfamiliaritySampler
+from nihonngo import metrics
+from nihonngo.bulk_lookup import BulkLookup
+from nihonngo.benchmarks import load_kana_corpus
+from nihonngo.benchmarks.extract import PAGES_DIR, load_pages
+from nihonngo.benchmarks.lcs import reference_lcs_length, reference_rank, bit_parallel_rank
+from nihonngo.benchmarks.exceptions import ReferenceAPIException, raise_and_catch
+from nihonngo.benchmarks.data import generate_word_infos, format_word_line
+from nihonngo.benchmarks import suite, load
+from nihonngo.pool import QUESTION_POOL, QuestionPool
+from nihonngo.batch import p_parse_word_line, batch_import
+from nihonngo.views import ConditionalPageMixin
+from nihonngo import batch
+
+from bs4 import BeautifulSoup
+
+from concurrent.futures import Future
+from unittest import mock
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import codecs, collections, json, os.path, random, shutil, tempfile, threading, urllib.parse
+from datetime import timedelta
+
+
+class LCSTest(TestCase):
+    def test_lcs_length_matches_reference(self):
+        corpus = load_kana_corpus()[:200]
+        pairs = [('', ''), ('', 'あ'), ('あいう', 'あいう'), ('abcbdab', 'bdcaba')] + \
+                [(a, b) for a in corpus[:20] for b in corpus]
+        for a, b in pairs:
+            self.assertEqual(p_lcs_length(a, b), reference_lcs_length(a, b), (a, b))
+
+    def test_rank_matches_reference(self):
+        corpus = load_kana_corpus()
+        for query in random.Random(0).sample(corpus, 5):
+            self.assertEqual(bit_parallel_rank(query, corpus, 12), reference_rank(query, corpus, 12))
+
+
+class LookupCacheTest(TestCase):
+    def setUp(self):
+        LOOKUP_MEMORY_CACHE.clear()
+        self.addCleanup(LOOKUP_MEMORY_CACHE.clear)
+        patcher = mock.patch.object(WordExtractor, 'extract', autospec = True,
+                                    side_effect = lambda extractor, kannji: [{'kannji': kannji, 'kana': 'かな'}])
+        self.extract = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_are_cached_in_memory_and_database(self):
+        self.assertEqual(api_lookup_word('背景'), [{'kannji': '背景', 'kana': 'かな'}])
+        self.assertEqual(self.extract.call_count, 1)
+        with self.assertNumQueries(0):
+            p_lookup_word_cached('背景')
+
+        LOOKUP_MEMORY_CACHE.clear()
+        with self.assertNumQueries(1):
+            p_lookup_word_cached('背景')
+        self.assertEqual(self.extract.call_count, 1)
+
+    def test_memory_cache_evicts_least_recently_used(self):
+        with mock.patch('nihonngo.api.LOOKUP_MEMORY_CACHE_SIZE', 2):
+            p_lookup_word_cached('背景')
+            p_lookup_word_cached('主人')
+            p_lookup_word_cached('背景')
+            p_lookup_word_cached('容貌')
+        self.assertEqual(list(LOOKUP_MEMORY_CACHE), ['背景', '容貌'])
+
+    def test_expired_entry_is_refreshed(self):
+        p_lookup_word_cached('背景')
+        LOOKUP_MEMORY_CACHE.clear()
+        expired_date = timezone.now() - LOOKUP_CACHE_TTL - timedelta(days = 1)
+        LookupCache.objects.filter(query = '背景').update(result = '[]', fetch_date = expired_date)
+
+        self.assertEqual(json.loads(p_lookup_word_cached('背景')), [{'kannji': '背景', 'kana': 'かな'}])
+        self.assertEqual(self.extract.call_count, 2)
+        self.assertGreater(LookupCache.objects.get(query = '背景').fetch_date, expired_date)
+
+    def test_expired_entry_is_used_when_refresh_fails(self):
+        LookupCache.objects.create(query = '背景', result = '[]', fetch_date = timezone.now() - 2 * LOOKUP_CACHE_TTL, access_date = timezone.now())
+        self.extract.side_effect = IOError('offline')
+        self.assertEqual(p_lookup_word_cached('背景'), '[]')
+        self.assertEqual(self.extract.call_count, 1)
+
+    def test_concurrent_insert_updates_existing_entry(self):
+        p_store_lookup_result('背景', '[1]')
+        original_update, calls = QuerySet.update, []
+        def racing_update(queryset, **kwargs):
+            # 第一次 UPDATE 发生在另一个请求写入该条目之前。
+            calls.append(kwargs)
+            return 0 if len(calls) == 1 else original_update(queryset, **kwargs)
+        with mock.patch.object(QuerySet, 'update', autospec = True, side_effect = racing_update):
+            p_store_lookup_result('背景', '[2]')
+        self.assertEqual(list(LookupCache.objects.values_list('query', 'result')), [('背景', '[2]')])
+
+
+class SamplerTest(TestCase):
+    def test_prefix_sums_follow_updates(self):
+        rng = random.Random(0)
+        values = [rng.random() for i in range(37)]
+        tree = FenwickTree(values[:20])
+        for value in values[20:]:
+            tree.append(value)
+        for i in range(200):
+            index = rng.randrange(len(values))
+            if i % 2 == 0:
+                values[index] = rng.random()
+                tree.set(index, values[index])
+            else:
+                delta = rng.random()
+                values[index] += delta
+                tree.add(index, delta)
+        for i in range(len(values) + 1):
+            self.assertAlmostEqual(tree.prefix_sum(i), sum(values[:i]))
+        for i in range(len(values)):
+            self.assertEqual(tree.find(sum(values[:i]) + values[i] / 2), i)
+
+    def test_sample_follows_weights(self):
+        sampler = UnfamiliaritySampler([(1, 0.2), (2, 0.6), (3, 0.05)])
+        sampler.update(4, 0.2)
+        sampler.update(1, 0.0)
+        self.assertAlmostEqual(sampler.unfamiliarity_sum, 0.85)
+        rng = random.Random(0)
+        counts = collections.Counter(sampler.sample(rng)[0] for i in range(4000))
+        self.assertEqual(set(counts), {2, 4})
+        self.assertAlmostEqual(counts[2] / 4000, 0.75, delta = 0.03)
+        self.assertIsNone(UnfamiliaritySampler([(1, 0.05)]).sample(rng))
+
+    def test_sampler_reloads_after_external_change(self):
+        user = User.objects.create(name = 'test', password = 'test')
+        words = [api_create_word(chr(0x4e00 + i), chr(0x3042 + i) * 2) for i in range(8)]
+        question = p_create_kana_question(words[0], user)
+        api_answer_question(user.id, question.id, '?')
+        UNFAMILIARITY_SAMPLERS.clear()
+
+        sampler = p_get_unfamiliarity_sampler(user.id)
+        question = p_create_kana_question(words[1], user)
+        api_answer_question(user.id, question.id, '?')
+        self.assertIs(p_get_unfamiliarity_sampler(user.id), sampler)
+        self.assertIn(words[1].id, sampler)
+
+        # 模拟其他进程修改了已学习生词。
+        LearnedWord.objects.filter(user_id = user.id, word_id = words[0].id).update(unfamiliarity = 0.5)
+        UserStatistics.objects.filter(user_id = user.id).update(modified_date = timezone.now())
+        reloaded = p_get_unfamiliarity_sampler(user.id)
+        self.assertIsNot(reloaded, sampler)
+        self.assertEqual(reloaded.get(words[0].id), 0.5)
+
+
+class ChooseWordTest(TestCase):
+    def test_falls_back_to_learned_word_when_all_learned(self):
+        user = User.objects.create(name = 'test', password = 'test')
+        words = [api_create_word(chr(0x4e00 + i), chr(0x3042 + i) * 2) for i in range(8)]
+        for word in words:
+            question = p_create_kana_question(word, user)
+            api_answer_question(user.id, question.id, question.correct_answer)
+        self.assertEqual(LearnedWord.objects.filter(user_id = user.id).count(), len(words))
+
+        word_ids = set(w.id for w in words)
+        for i in range(10):
+            question = api_create_question(user, new_word_prob = 1.0, return_unanswered = False)
+            self.assertIn(Question.objects.get(id = question['question_id']).related_word_id, word_ids)
+            self.assertLess(question['unfamiliarity'], 1.0)
+
+
+class SynchronousExecutor(object):
+    """
+    在调用线程中立即执行任务，测试数据库（内存中的 SQLite）无法在其他线程中访问。
+    """
+    def submit(self, function, *args):
+        future = Future()
+        try:
+            future.set_result(function(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+class QuestionPoolTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        for i in range(10):
+            api_create_word(chr(0x4e00 + i), chr(0x3042 + i) * 2)
+        self.pool = QuestionPool(size = 3, max_workers = 1)
+        self.pool.executor.shutdown()
+        self.pool.executor = SynchronousExecutor()
+
+    def pooled_ids(self):
+        return [entry.question_id for entry in self.pool.questions.get(self.user.id, [])]
+
+    def answer(self, question):
+        api_answer_question(self.user.id, question['question_id'], '0')
+        self.pool.notify_answered(self.user.id, question['question_id'])
+
+    def test_miss_then_hit(self):
+        question = self.pool.pop(self.user)
+        self.assertEqual((self.pool.misses, self.pool.hits), (1, 0))
+        self.assertEqual(len(self.pooled_ids()), 3)
+        self.assertNotIn(question['question_id'], self.pooled_ids())
+
+        self.answer(question)
+        pooled_ids = self.pooled_ids()
+        question = self.pool.pop(self.user)
+        self.assertEqual(self.pool.hits, 1)
+        self.assertIn(question['question_id'], pooled_ids)
+        self.assertNotIn(question['question_id'], self.pooled_ids())
+
+    def test_unanswered_question_is_served_again(self):
+        question = self.pool.pop(self.user)
+        self.assertEqual(self.pool.pop(self.user)['question_id'], question['question_id'])
+        self.assertEqual(Question.objects.filter(user_id = self.user.id, answered = False).count(), 4)
+
+    def test_miss_ignores_pooled_questions(self):
+        self.answer(self.pool.pop(self.user))
+        pooled_ids = self.pooled_ids()
+        self.pool.questions[self.user.id].clear()
+        # 池中的问题被移出后仍未回答，未命中时也不应返回这些问题。
+        self.assertNotIn(self.pool.pop(self.user)['question_id'], pooled_ids)
+
+    def test_new_pool_reclaims_pooled_questions(self):
+        question = self.pool.pop(self.user)
+        self.assertEqual(Question.objects.filter(user_id = self.user.id, answered = False, pooled = True).count(), 3)
+
+        # 进程重启，或请求由另一个进程处理。
+        pool = QuestionPool(size = 3, max_workers = 1)
+        pool.executor.shutdown()
+        pool.executor = SynchronousExecutor()
+        self.assertEqual(pool.pop(self.user)['question_id'], question['question_id'])
+
+        api_answer_question(self.user.id, question['question_id'], '0')
+        pool.notify_answered(self.user.id, question['question_id'])
+        pool.pop(self.user)
+        owned_ids = [entry.question_id for entry in pool.questions[self.user.id]]
+        self.assertEqual(sorted(Question.objects.filter(user_id = self.user.id, answered = False, pooled = True).values_list('id', flat = True)),
+                         sorted(owned_ids))
+        self.assertEqual(Question.objects.filter(user_id = self.user.id, answered = False).count(), len(owned_ids) + 1)
+
+        # 原来的进程池中的问题已被删除，取出失败之后生成新的问题。
+        api_answer_question(self.user.id, pool.pop(self.user)['question_id'], '0')
+        invalidations, misses = self.pool.invalidations, self.pool.misses
+        self.pool.pop(self.user)
+        self.assertEqual((self.pool.invalidations - invalidations, self.pool.misses - misses), (3, 1))
+
+    def test_version_bump_discards_pooled_questions(self):
+        self.answer(self.pool.pop(self.user))
+        stale_count, invalidations, misses = len(self.pooled_ids()), self.pool.invalidations, self.pool.misses
+        api_create_word('背景', 'はいけい')
+
+        # 失效的问题在生成新问题之前被删除（SQLite 可能复用其 ID）。
+        question = self.pool.pop(self.user)
+        self.assertEqual(self.pool.invalidations - invalidations, stale_count)
+        self.assertEqual(self.pool.misses - misses, 1)
+        self.assertEqual(Question.objects.filter(user_id = self.user.id, answered = False).count(), len(self.pooled_ids()) + 1)
+        self.answer(question)
+
+    def test_answer_after_refill(self):
+        for i in range(8):
+            question = self.pool.pop(self.user)
+            self.assertNotIn(question['question_id'], self.pooled_ids())
+            self.answer(question)
+            self.assertTrue(Question.objects.get(id = question['question_id']).answered)
+        self.assertGreater(self.pool.hits, 0)
+        self.assertEqual(Question.objects.filter(user_id = self.user.id, answered = False).count(), len(self.pooled_ids()))
+
+    def test_refill_failure_is_logged(self):
+        Word.objects.all().delete()
+        with self.assertLogs('nihonngo.pool', 'WARNING'):
+            self.pool.fill(self.user.id)
+        self.assertNotIn(self.user.id, self.pool.refilling)
+
+
+class KanaNeighborIndexTest(TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        kanas = sorted(set(''.join(rng.choice('あいうかきく') for i in range(rng.randint(2, 4))) for j in range(40)))
+        for i, kana in enumerate(kanas):
+            api_create_word(chr(0x4e00 + i), kana)
+        api_build_kana_neighbor_index()
+
+    def index(self):
+        return sorted(KanaNeighbor.objects.values_list('kana', 'neighbor', 'lcs_length'))
+
+    def assertMatchesRebuild(self):
+        incremental = self.index()
+        api_build_kana_neighbor_index()
+        self.assertEqual(incremental, self.index())
+
+    def test_insert_matches_rebuild(self):
+        api_insert_new_word({'kannji': '背景', 'kana': 'あいうかき', 'word_classes': ['名词'], 'meanings': [{'text': '背景', 'examples': []}]})
+        self.assertMatchesRebuild()
+
+    def test_bulk_insert_matches_rebuild(self):
+        api_insert_new_words([{'kannji': kannji, 'kana': kana, 'word_classes': ['名词'], 'meanings': [{'text': kannji, 'examples': []}]}
+                              for kannji, kana in (('背景', 'かきくあ'), ('主人', 'くうい'), ('容貌', 'かきくあい'))])
+        self.assertMatchesRebuild()
+
+    def test_batch_import_updates_index(self):
+        kana = KanaNeighbor.objects.order_by('kana')[0].kana
+        report = batch_import(['背景||{0}く||名词||背景'.format(kana), '主人||くうい||名词||主人', '容貌||かきくあい||名词||容貌'], chunk_size = 2)
+        self.assertEqual(report['imported'], 3)
+        self.assertIn(kana + 'く', KanaNeighbor.objects.filter(kana = kana).values_list('neighbor', flat = True))
+        self.assertMatchesRebuild()
+
+
+class QuestionPayloadTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        self.word = api_insert_new_word({
+            'kannji'      : '背景',
+            'kana'        : 'はいけい',
+            'word_classes': ['名词'],
+            'meanings'    : [{'text': '背景', 'examples': ['舞台の背景']}, {'text': '后台', 'examples': []}],
+        })
+        for kannji, kana in (('拝啓', 'はいけい'), ('配慮', 'はいりょ'), ('敬意', 'けいい'), ('景気', 'けいき'), ('入口', 'いりぐち'), ('会計', 'かいけい')):
+            api_create_word(kannji, kana)
+
+    def test_prune_question_reads_single_row(self):
+        question_id = p_create_kana_question(self.word, self.user).id
+        with self.assertNumQueries(1):
+            pruned_question = p_prune_question(Question.objects.get(id = question_id))
+        self.assertEqual(pruned_question['kannji'], '背景')
+        self.assertEqual(pruned_question['meanings'], ['背景', '后台'])
+        self.assertEqual(pruned_question['word_classes'], '名词')
+
+    def test_prune_question_without_payload(self):
+        question = p_create_kana_question(self.word, self.user)
+        expected = p_prune_question(question)
+        Question.objects.filter(id = question.id).update(payload = '')
+        self.assertEqual(p_prune_question(Question.objects.get(id = question.id)), expected)
+
+
+class SearchWordTest(TestCase):
+    def test_search_word_prefetches_relations(self):
+        for i, kannji in enumerate(('背景', '背中', '背広', '背丈')):
+            api_insert_new_word({
+                'kannji'      : kannji,
+                'kana'        : 'せ' * (i + 1),
+                'word_classes': ['名词', '常用语'],
+                'meanings'    : [{'text': '释义{0}'.format(j), 'examples': ['例句一', '例句二']} for j in range(3)],
+            })
+        with self.assertNumQueries(5):
+            words = api_search_word('背')
+            displays = [(w.get_word_classes_display(), [(m.text, [e.text for e in m.examples.all()]) for m in w.meanings.all()]) for w in words]
+        self.assertEqual(len(displays), 4)
+        self.assertEqual(displays[0], ('名词，常用语', [('释义{0}'.format(j), ['例句一', '例句二']) for j in range(3)]))
+
+    def test_search_word_ranks_matches(self):
+        api_insert_new_word({'kannji': '景色', 'kana': 'けしき', 'word_classes': ['名词'],
+                             'meanings': [{'text': '风景', 'examples': ['窓からの景色']}]})
+        api_insert_new_word({'kannji': '背景', 'kana': 'はいけい', 'word_classes': ['名词'],
+                             'meanings': [{'text': '背景；布景', 'examples': []}]})
+        api_insert_new_word({'kannji': '風景', 'kana': 'ふうけい', 'word_classes': ['名词'],
+                             'meanings': [{'text': '景致', 'examples': ['美しい景色だ']}]})
+        for _ in range(2):
+            self.assertEqual([w.kannji for w in api_search_word('景色')], ['景色', '風景'])
+            self.assertEqual([w.kannji for w in api_search_word('布景')], ['背景'])
+            self.assertEqual([w.kannji for w in api_search_word('景')], ['景色', '背景', '風景'])
+            self.assertEqual(api_search_word('色景'), [])
+            api_rebuild_search_index()
+
+    def test_short_search_is_ranked_in_sql_and_capped(self):
+        api_insert_new_words([{'kannji': chr(0x4e00 + i), 'kana': 'あ' * (i % 5 + 1), 'word_classes': ['名词'],
+                               'meanings': [{'text': '背{0}'.format(i) if i % 2 == 0 else '前', 'examples': ['背中'] if i % 3 == 0 else []}]}
+                              for i in range(80)] +
+                             [{'kannji': kannji, 'kana': 'せ', 'word_classes': ['名词'], 'meanings': [{'text': kannji, 'examples': []}]}
+                              for kannji in ('背', '背景', '猫背')])
+        for search_string in ('背', '背中', 'ああ'):
+            words = Word.objects.prefetch_related('meanings__examples')
+            expected = sorted((p_rank_search_result(w, search_string), w.kannji) for w in words if p_rank_search_result(w, search_string) is not None)
+            with self.assertNumQueries(5):
+                result = api_search_word(search_string, limit = 10)
+            self.assertEqual([w.kannji for w in result], [e[1] for e in expected[:10]])
+        self.assertEqual(len(api_search_word('背')), 50)
+
+
+class StatisticsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        self.words = api_insert_new_words([
+            {'kannji': '背景', 'kana': 'はいけい', 'word_classes': ['名词'], 'meanings': [{'text': '背景', 'examples': []}]},
+            {'kannji': '主人', 'kana': 'しゅじん', 'word_classes': ['名词'], 'meanings': [{'text': '主人', 'examples': []}]},
+        ] + [{'kannji': chr(0x4e00 + i), 'kana': chr(0x3042 + i) * 2, 'word_classes': ['名词'], 'meanings': [{'text': chr(0x4e00 + i), 'examples': []}]}
+             for i in range(6)])
+
+    def answer(self, word, correct):
+        question = p_create_kana_question(word, self.user)
+        api_answer_question(self.user.id, question.id, question.correct_answer if correct else '?')
+
+    def rollup(self, user_id):
+        statistics = UserStatistics.objects.get(user_id = user_id)
+        daily = sorted(DailyStatistics.objects.filter(user_id = user_id).values_list('date', 'answered_count', 'correct_answered_count'))
+        return (statistics.answered_count, statistics.correct_answered_count,
+                statistics.learned_word_count, round(statistics.unfamiliarity_sum, 6), daily)
+
+    def learned_words(self, user_id):
+        return sorted(LearnedWord.objects.filter(user_id = user_id).values_list(
+            'word_id', 'learned_date', 'last_review_date', 'total_answered_count', 'correct_answered_count', 'unfamiliarity'))
+
+    def test_rebuild_learned_words_is_isolated_per_user(self):
+        other_user = User.objects.create(name = 'other', password = 'test')
+        for word, correct in [(self.words[0], True), (self.words[1], False), (self.words[0], False), (self.words[0], True)]:
+            self.answer(word, correct)
+        LearnedWord.objects.create(user_id = other_user.id, word_id = self.words[2].id, unfamiliarity = 0.5)
+        expected, other_expected = self.learned_words(self.user.id), self.learned_words(other_user.id)
+
+        LearnedWord.objects.filter(user_id = self.user.id).update(unfamiliarity = 1, total_answered_count = 0)
+        self.assertEqual(api_rebuild_learned_words([self.user.id]), {self.user.id: 2})
+        self.assertEqual(self.learned_words(self.user.id), expected)
+        self.assertEqual(self.learned_words(other_user.id), other_expected)
+
+    def test_statistics_for_new_user(self):
+        statistics = dict(api_get_statistics(self.user))
+        self.assertEqual(statistics['回答正确率'], 0.0)
+        self.assertEqual(statistics['今日回答问题数'], 0)
+        self.assertIsNone(statistics['今日应回答问题数'])
+
+    def test_incremental_rollup_matches_rebuild(self):
+        for word, correct in [(self.words[0], True), (self.words[0], True), (self.words[1], False), (self.words[1], True)]:
+            self.answer(word, correct)
+        incremental = self.rollup(self.user.id)
+        p_rebuild_statistics(self.user.id)
+        self.assertEqual(incremental, self.rollup(self.user.id))
+        self.assertEqual(incremental[:3], (4, 3, 2))
+
+        with self.assertNumQueries(3):
+            statistics = dict(api_get_statistics(self.user, finish_date = timezone.now().date() + timedelta(days = 30)))
+        self.assertEqual(statistics['回答正确率'], 0.75)
+        self.assertEqual(statistics['今日回答问题数'], 4)
+        self.assertGreater(statistics['今日应回答问题数'], 0)
+
+
+class UserCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        self.client.post(reverse('nihonngo:signin'), {'name': 'test', 'password': 'test'})
+        USER_CACHE.clear()
+
+    def get_counting_user_queries(self, path):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(path)
+        return response, len([q for q in context.captured_queries if 'FROM "nihonngo_user" ' in q['sql']])
+
+    def test_requests_share_cached_user(self):
+        response, user_queries = self.get_counting_user_queries(reverse('nihonngo:statistics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['current_user'], self.user)
+        self.assertEqual(user_queries, 1)
+
+        response, user_queries = self.get_counting_user_queries(reverse('nihonngo:exam'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_queries, 0)
+
+    def test_sign_out_invalidates_cached_user(self):
+        self.client.get(reverse('nihonngo:exam'))
+        self.assertIn(self.user.id, USER_CACHE)
+        self.client.get(reverse('nihonngo:signout'))
+        self.assertNotIn(self.user.id, USER_CACHE)
+        self.assertEqual(self.client.get(reverse('nihonngo:exam')).status_code, 302)
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        self.client.post(reverse('nihonngo:signin'), {'name': 'test', 'password': 'test'})
+        self.word_info = {'kannji': '背景', 'kana': 'はいけい', 'word_classes': ['名词'],
+                          'meanings': [{'text': '背景' * 100, 'examples': ['舞台の背景']}]}
+        api_insert_new_words([self.word_info])
+
+    def assertNotModified(self, path, queries = 2, **headers):
+        response = self.client.get(path, **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response)
+        # Session 及页面的版本，不查询数据也不渲染模板。
+        with self.assertNumQueries(queries):
+            revisited = self.client.get(path, HTTP_IF_NONE_MATCH = response['ETag'], **headers)
+        self.assertEqual(revisited.status_code, 304)
+        return response
+
+    def test_word_page_changes_with_vocabulary(self):
+        path = reverse('nihonngo:words', kwargs = {'word': '背景'})
+        response = self.assertNotModified(path)
+        self.assertIn('Last-Modified', response)
+
+        version = api_get_change_version('vocabulary')[0]
+        api_insert_new_word(dict(self.word_info, kannji = '背景画', kana = 'はいけいが'))
+        self.assertGreater(api_get_change_version('vocabulary')[0], version)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH = response['ETag']).status_code, 200)
+
+    def test_word_page_is_compressed(self):
+        path = reverse('nihonngo:words', kwargs = {'word': '背景'})
+        response = self.assertNotModified(path, HTTP_ACCEPT_ENCODING = 'gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertNotEqual(response['ETag'], self.client.get(path)['ETag'])
+
+    def test_lookup_page_uses_cached_result(self):
+        path = reverse('nihonngo:lookup_word', kwargs = {'word': '背景'})
+        now = timezone.now()
+        LookupCache.objects.create(query = '背景', result = json.dumps([{'kannji': '背景', 'kana': 'はいけい'}]), fetch_date = now, access_date = now)
+        self.assertEqual(self.assertNotModified(path).context['words'][0]['exists'], True)
+
+    def test_statistics_page_changes_after_answer(self):
+        path = reverse('nihonngo:statistics')
+        api_insert_new_words([dict(self.word_info, kannji = chr(0x4e00 + i), kana = chr(0x3042 + i) * 2) for i in range(6)])
+        self.client.get(path)
+        response = self.assertNotModified(path, queries = 3)
+        question = p_create_kana_question(Word.objects.get(kannji = '背景'), self.user)
+        api_answer_question(self.user.id, question.id, question.correct_answer)
+        self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH = response['ETag']).status_code, 200)
+
+    def test_page_without_version_is_not_conditional(self):
+        class UnversionedView(ConditionalPageMixin, generic.View):
+            def get(self, request):
+                return HttpResponse('背景' * 100)
+
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING = 'gzip', HTTP_IF_NONE_MATCH = '*')
+        request.nihonngo_user = self.user
+        response = UnversionedView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('ETag', response)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_signed_out_request_has_no_etag(self):
+        self.client.get(reverse('nihonngo:signout'))
+        response = self.client.get(reverse('nihonngo:statistics'))
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('ETag', response)
+
+
+class APIExceptionTest(TestCase):
+    def test_caller_api_and_error_counts(self):
+        api_create_word('背景', 'はいけい')
+        counts = api_get_error_counts()
+        with self.assertRaises(APIException) as context:
+            api_create_word('背景', 'はいけい')
+        self.assertEqual(context.exception.caller_api, 'api_create_word')
+        self.assertEqual(context.exception.debug_message, '在 api_create_word 中：生词"背景（はいけい）"已经存在。')
+
+        with self.assertRaises(APIException) as context:
+            api_create_word('背景', 1)
+        self.assertEqual(context.exception.caller_api, 'api_create_word')
+        self.assertEqual(api_get_error_counts()['api_create_word'], counts.get('api_create_word', 0) + 2)
+
+    def test_benchmark_reference_matches(self):
+        self.assertEqual(raise_and_catch(ReferenceAPIException, 3), raise_and_catch(APIException, 3))
+
+    def test_error_counts_from_threads(self):
+        def api_fail_repeatedly():
+            for i in range(2000):
+                try:
+                    raise APIException('失败。')
+                except APIException:
+                    pass
+
+        count = api_get_error_counts().get('api_fail_repeatedly', 0)
+        threads = [threading.Thread(target = api_fail_repeatedly) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(api_get_error_counts()['api_fail_repeatedly'], count + 16000)
+
+
+class ValidationTest(TestCase):
+    def test_nested_word_info_is_validated_before_insert(self):
+        word_info = {'kannji': '背景', 'kana': 'はいけい', 'word_classes': ['名词'],
+                     'meanings': [{'text': '背景', 'examples': ['舞台の背景。', '']}]}
+        with self.assertRaises(InvalidArgumentException) as context:
+            api_insert_new_word(word_info)
+        self.assertEqual(context.exception.caller_api, 'api_insert_new_word')
+        self.assertEqual(context.exception.value, '键 examples 的值 不能为空。')
+
+        del(word_info['meanings'][0]['examples'])
+        with self.assertRaises(InvalidArgumentException) as context:
+            api_insert_new_words([word_info])
+        self.assertEqual(context.exception.value, 'examples 不在字典 meaning 中。')
+        self.assertFalse(Word.objects.exists())
+
+        word_info['meanings'][0]['examples'] = []
+        self.assertEqual(api_insert_new_word(word_info).kannji, '背景')
+
+    def test_defaults_and_keywords(self):
+        with self.assertRaises(InvalidArgumentException):
+            api_search_word(search_string = '')
+        self.assertEqual(api_insert_new_words([]), [])
+        self.assertEqual(api_create_word.trusted('背景', 'はいけい').kana, 'はいけい')
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        metrics.reset()
+
+    def test_histogram_percentiles(self):
+        histogram = metrics.Histogram(metrics.LATENCY_BOUNDS)
+        self.assertIsNone(histogram.percentile(0.5))
+        for i in range(1, 101):
+            histogram.observe(i / 1000)
+        for p in metrics.PERCENTILES:
+            self.assertAlmostEqual(histogram.percentile(p), p / 10, delta = p / 10 * 0.2)
+        self.assertEqual(histogram.percentile(1.0), 0.1)
+
+    def test_api_and_view_calls_are_recorded(self):
+        api_create_word('背景', 'はいけい')
+        with self.assertRaises(APIException):
+            api_create_word('背景', 'はいけい')
+        calls = metrics.snapshot()['api_create_word']
+        self.assertEqual((calls['calls'], calls['errors']), (2, 1))
+        self.assertGreater(calls['queries']['max'], 1)
+        self.assertEqual(api_create_word.__name__, 'api_create_word')
+
+        self.client.get(reverse('nihonngo:signin'))
+        self.assertEqual(metrics.snapshot()['view.SignInView']['calls'], 1)
+
+    def test_endpoint_is_staff_only(self):
+        api_search_word('背景')
+        self.assertTemplateUsed(self.client.get(reverse('nihonngo:metrics')), 'admin/login.html')
+
+        StaffUser.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username = 'admin', password = 'admin')
+        response = self.client.get(reverse('nihonngo:metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('api_search_word', json.loads(response.content.decode('utf-8'))['calls'])
+
+        response = self.client.get(reverse('nihonngo:metrics'), {'format': 'prometheus'})
+        self.assertIn('nihonngo_call_duration_seconds_count{name="api_search_word"} 1', response.content.decode('utf-8'))
+
+
+class ProfilerMiddlewareTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        User.objects.create(name = 'test', password = 'test')
+
+    def reports(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_staff_header_profiles_request(self):
+        with self.settings(NIHONNGO_PROFILER_DIR = self.directory):
+            response = self.client.get(reverse('nihonngo:signin'), HTTP_X_NIHONNGO_PROFILE = 'memory')
+            self.assertNotIn('X-Nihonngo-Profile', response)
+            self.assertEqual(self.reports(), [])
+
+            StaffUser.objects.create_superuser('admin', 'admin@example.com', 'admin')
+            self.client.login(username = 'admin', password = 'admin')
+            self.client.post(reverse('nihonngo:signin'), {'name': 'test', 'password': 'test'})
+            response = self.client.get(reverse('nihonngo:statistics'), HTTP_X_NIHONNGO_PROFILE = 'memory')
+
+        name = response['X-Nihonngo-Profile']
+        self.assertEqual(self.reports(), [name + '.prof', name + '.txt'])
+        with codecs.open(os.path.join(self.directory, name + '.txt'), 'r', 'utf-8') as fin:
+            report = fin.read()
+        self.assertTrue(report.startswith('GET /nihonngo/exam/stats/ -> 200'))
+        self.assertIn('"nihonngo_userstatistics"', report)
+        self.assertIn('新增内存最多的代码行', report)
+
+    def test_sampled_reports_are_rotated(self):
+        with self.settings(NIHONNGO_PROFILER_DIR = self.directory, NIHONNGO_PROFILER_SAMPLE_RATE = 1, NIHONNGO_PROFILER_MAX_REPORTS = 2):
+            for i in range(4):
+                response = self.client.get(reverse('nihonngo:signin'))
+                self.assertNotIn('X-Nihonngo-Profile', response)
+        self.assertEqual(len(self.reports()), 4)
+
+
+class BenchmarkSuiteTest(TestCase):
+    def test_generated_words_are_deterministic_and_importable(self):
+        word_infos = generate_word_infos(200, seed = 1)
+        self.assertEqual(word_infos, generate_word_infos(200, seed = 1))
+        self.assertEqual(len(set((w['kannji'], w['kana']) for w in word_infos)), 200)
+        for word_info in word_infos:
+            self.assertEqual(p_parse_word_line(format_word_line(word_info)), word_info)
+
+    def test_run_and_compare(self):
+        results = suite.run(size = 60, users = 2, answers = 100, repeat = 3, import_size = 10)
+        self.assertEqual(results['benchmarks']['api_create_question']['n'], 3)
+        self.assertEqual(results['benchmarks']['batch_import']['imported'], 10)
+        self.assertEqual(LearnedWord.objects.filter(user__name = 'bench1').count(), 20)
+        json.dumps(results)
+
+        rows = suite.compare({'runs': [results]}, {'runs': [results]})
+        self.assertEqual(len(rows), len(results['benchmarks']))
+        self.assertTrue(all(change == 0 for size, name, old, new, change in rows))
+
+
+class LoadHarnessTest(TestCase):
+    def setUp(self):
+        for word_info in generate_word_infos(30):
+            api_insert_new_word(word_info)
+        load.ensure_users(1)
+        # 问题预生成池的后台线程使用各自的连接，看不到测试数据库中的数据。
+        pool_size, QUESTION_POOL.size = QUESTION_POOL.size, 0
+        self.addCleanup(setattr, QUESTION_POOL, 'size', pool_size)
+
+    def test_synthesized_session_replays_from_trace(self):
+        path = os.path.join(tempfile.mkdtemp(), 'trace.jsonl')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding = 'utf-8') as fout:
+            for request in load.synthesize_session('s0', 0, 3):
+                fout.write(json.dumps(request) + '\n')
+        sessions = load.load_trace(path)
+        self.assertEqual(list(sessions), ['s0'])
+
+        stats = {}
+        load.Session(load.ClientTransport(), random.Random(0), 0).run(sessions['s0'], stats, threading.Lock())
+        self.assertEqual(sorted(stats), ['answer_question', 'get_question', 'signin', 'signin_page'])
+        summary = stats['answer_question'].summary(1.0)
+        self.assertEqual((summary['n'], summary['failures'], summary['lock_errors']), (3, 0, 0))
+        self.assertEqual(Question.objects.filter(user__name = 'load0', answered = True).count(), 3)
+
+
+class SignInTokenTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(name = 'test', password = 'test')
+        TOKEN_CACHE.clear()
+
+    def test_token_is_stored_hashed_and_cached(self):
+        token = api_auth_create_token(self.user.id)
+        self.assertFalse(SignInToken.objects.filter(token_hash = token.token).exists())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(api_auth_validate_token(token.token).id, token.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(api_auth_validate_token(token.token).id, token.id)
+
+        api_auth_mark_token_expired(token.id)
+        with self.assertRaises(APIException):
+            api_auth_validate_token(token.token)
+
+    def test_sweep_deletes_expired_and_revoked_tokens(self):
+        valid_token = api_auth_create_token(self.user.id)
+        revoked_token = api_auth_create_token(self.user.id)
+        api_auth_mark_token_expired(revoked_token.id)
+        for i in range(5):
+            api_auth_create_token(self.user.id, expire_delta = timedelta(seconds = -1))
+
+        self.assertEqual(api_auth_sweep_tokens(batch_size = 2), 6)
+        self.assertEqual(list(SignInToken.objects.values_list('id', flat = True)), [valid_token.id])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN 仅适用于 SQLite。')
+class QueryPlanTest(TestCase):
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+    def assertSearchesIndex(self, queryset, constraint):
+        """
+        断言查询只通过索引按 constraint 查找，没有全表扫描，也没有额外的排序。
+        """
+        plan = self.query_plan(queryset)
+        self.assertEqual(len(plan), 1, plan)
+        self.assertTrue(plan[0].startswith('SEARCH'), plan)
+        self.assertIn('INDEX', plan[0])
+        self.assertIn(constraint, plan[0])
+
+    def test_word_lookup(self):
+        self.assertSearchesIndex(Word.objects.filter(kannji = '背景', kana = 'はいけい'), '(kannji=? AND kana=?)')
+        self.assertSearchesIndex(Word.objects.filter(kannji__in = ['背景', '主人']), '(kannji=?)')
+
+    def test_token_lookup(self):
+        self.assertSearchesIndex(SignInToken.objects.filter(token_hash = 'token'), '(token_hash=?)')
+
+    def test_unanswered_questions(self):
+        self.assertSearchesIndex(Question.objects.filter(user_id = 1, answered = False), '(user_id=? AND answered=?)')
+
+    def test_learned_word_lookup(self):
+        self.assertSearchesIndex(LearnedWord.objects.filter(user_id = 1, word_id = 1), '(user_id=? AND word_id=?)')
+
+    def test_learned_words_ordered_by_unfamiliarity(self):
+        self.assertSearchesIndex(LearnedWord.objects.filter(user_id = 1).order_by('-unfamiliarity'), '(user_id=?)')
+
+    def test_latest_update_history(self):
+        self.assertSearchesIndex(UpdateHistory.objects.filter(user_id = 1).order_by('-update_date')[:1], '(user_id=?)')
+
+
+class InsertNewWordsTest(TestCase):
+    def word_info(self, kannji, kana, examples = ()):
+        return {'kannji': kannji, 'kana': kana, 'word_classes': ['名词'],
+                'meanings': [{'text': kannji + 'の意味', 'examples': list(examples)}, {'text': kannji, 'examples': []}]}
+
+    def test_insert_new_words_in_bulk(self):
+        word_infos = [self.word_info('背景', 'はいけい', ['舞台の背景']), self.word_info('主人', 'しゅじん'), self.word_info('容貌', 'ようぼう')]
+        ChangeVersion.objects.create(key = 'vocabulary')
+        with self.assertNumQueries(19):
+            new_words = api_insert_new_words(word_infos)
+
+        self.assertEqual([w.kannji for w in new_words], ['背景', '主人', '容貌'])
+        word = Word.objects.get(kannji = '背景')
+        self.assertEqual([m.text for m in word.meanings.all()], ['背景の意味', '背景'])
+        self.assertEqual([e.text for e in word.meanings.all()[0].examples.all()], ['舞台の背景'])
+        self.assertEqual(word.get_word_classes_display(), '名词')
+        self.assertEqual([w.kannji for w in api_search_word('舞台')], ['背景'])
+
+    def test_insert_new_words_rejects_duplicates(self):
+        api_insert_new_words([self.word_info('背景', 'はいけい')])
+        with self.assertRaises(APIException):
+            api_insert_new_words([self.word_info('主人', 'しゅじん'), self.word_info('背景', 'はいけい')])
+        with self.assertRaises(APIException):
+            api_insert_new_words([self.word_info('主人', 'しゅじん'), self.word_info('主人', 'しゅじん')])
+        self.assertEqual(Word.objects.count(), 1)
+
+
+class BatchImportTest(TestCase):
+    def test_parse_errors_are_reported_with_line_numbers(self):
+        report = batch_import(['背景||はいけい||名词||背景*舞台の背景\n',
+                               '\n',
+                               '主人||しゅじん||名词\n',
+                               '容貌||ようぼう||形容词||容貌\n',
+                               '||ようぼう||名词||容貌\n',
+                               '得意||とくい||名词，副词||得意'])
+        self.assertEqual(report['imported'], 2)
+        self.assertEqual([line_number for line_number, message in report['errors']], [3, 4, 5])
+        self.assertIn('"形容词"', report['errors'][1][1])
+        self.assertEqual(Word.objects.get(kannji = '得意').word_classes.count(), 2)
+
+    def test_duplicates_are_skipped_across_chunks(self):
+        Word.objects.create(kannji = '背景', kana = 'はいけい')
+        lines = ['背景||はいけい||名词||背景', '主人||しゅじん||名词||主人', '容貌||ようぼう||名词||容貌',
+                 '主人||しゅじん||名词||主人', '背景||はいけい||名词||背景', '得意||とくい||名词||得意',
+                 '背景||せなか||名词||背中']
+        with mock.patch.object(batch, 'p_existing_words', wraps = batch.p_existing_words) as existing_words:
+            report = batch_import(lines, chunk_size = 2)
+        self.assertEqual(existing_words.call_count, 3)
+        self.assertEqual((report['imported'], report['duplicated'], report['errors']), (4, 3, []))
+        self.assertEqual(sorted(Word.objects.values_list('kana', flat = True)),
+                         sorted(['はいけい', 'しゅじん', 'ようぼう', 'とくい', 'せなか']))
+
+    def test_failed_line_is_reported_alone(self):
+        p_bulk_create_words = batch.p_bulk_create_words
+        def failing_bulk_create_words(word_infos):
+            if any(info['kannji'] == '容貌' for info in word_infos):
+                raise ValueError('容貌')
+            return p_bulk_create_words(word_infos)
+
+        lines = ['背景||はいけい||名词||背景', '主人||しゅじん||名词||主人', '容貌||ようぼう||名词||容貌', '得意||とくい||名词||得意']
+        with mock.patch.object(batch, 'p_bulk_create_words', failing_bulk_create_words):
+            report = batch_import(lines, chunk_size = 3)
+        self.assertEqual(report['imported'], 3)
+        self.assertEqual(report['errors'], [(3, '写入失败：容貌')])
+        self.assertEqual(sorted(Word.objects.values_list('kannji', flat = True)), sorted(['背景', '主人', '得意']))
+
+
+class WordExtractorTest(TestCase):
+    def test_analyze_matches_golden_output(self):
+        extractor = WordExtractor()
+        pages = load_pages()
+        self.assertTrue(len(pages) > 0)
+        for name, html in pages:
+            with codecs.open(os.path.join(PAGES_DIR, name + '.json'), 'r', 'utf-8') as fin:
+                expected = json.load(fin)
+            for soup in (extractor.parse(html), BeautifulSoup(html, 'html.parser')):
+                words = extractor.analyze(soup)
+                for word in words:
+                    word['word_classes'].sort()
+                self.assertEqual(words, expected, name)
+
+
+class StubDictionaryHandler(BaseHTTPRequestHandler):
+    """
+    模拟网络词典，从保存的页面中返回查询结果。每个生词的第一次请求返回 503。
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        word = urllib.parse.unquote(self.path.split('/')[-1])
+        self.server.requests.append(word)
+        if self.server.requests.count(word) == 1:
+            status, body = 503, b''
+        elif word in self.server.pages:
+            status, body = 200, self.server.pages[word].encode('utf-8')
+        else:
+            status, body = 404, b''
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubDictionaryServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class BulkLookupTest(TestCase):
+    def setUp(self):
+        self.server = StubDictionaryServer(('127.0.0.1', 0), StubDictionaryHandler)
+        self.server.requests = []
+        self.server.pages = {}
+        for name, html in load_pages():
+            with codecs.open(os.path.join(PAGES_DIR, name + '.json'), 'r', 'utf-8') as fin:
+                self.server.pages[json.load(fin)[0]['kannji']] = html
+        threading.Thread(target = self.server.serve_forever).start()
+        self.directory = tempfile.mkdtemp()
+        self.output_path = os.path.join(self.directory, 'words.jsonl')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def bulk_lookup(self, bulk_lookup_class = BulkLookup):
+        url = 'http://127.0.0.1:{0}/jp/jc/{{0}}'.format(self.server.server_port)
+        return bulk_lookup_class(dictionary_url = url, workers = 3, rate = 0, backoff = 0)
+
+    def test_bulk_lookup_retries_and_resumes(self):
+        kannjis = sorted(self.server.pages) + ['不存在']
+        summary = self.bulk_lookup().run(kannjis, self.output_path)
+        self.assertEqual(summary, {'skipped': 0, 'succeeded': len(kannjis) - 1, 'failed': 1})
+
+        with codecs.open(self.output_path, 'r', 'utf-8') as fin:
+            entries = dict((e['query'], e) for e in map(json.loads, fin))
+        self.assertEqual(entries['不存在']['error'], 'HTTP 404')
+        self.assertEqual(entries['主人']['words'][0]['kana'], 'しゅじん')
+
+        del self.server.requests[:]
+        summary = self.bulk_lookup().run(kannjis, self.output_path)
+        self.assertEqual(summary, {'skipped': len(kannjis) - 1, 'succeeded': 0, 'failed': 1})
+        self.assertEqual(self.server.requests, ['不存在', '不存在'])
+
+        summary = self.bulk_lookup().run(kannjis[:2], self.output_path)
+        self.assertEqual(summary, {'skipped': 2, 'succeeded': 0, 'failed': 0})
+
+    def test_interrupted_bulk_lookup_stops_fetching(self):
+        class InterruptedLookup(BulkLookup):
+            def lookup_entry(self, word):
+                if word == '3':
+                    raise KeyboardInterrupt()
+                return super(InterruptedLookup, self).lookup_entry(word)
+
+        bulk_lookup = self.bulk_lookup(InterruptedLookup)
+        with self.assertRaises(KeyboardInterrupt):
+            bulk_lookup.run([str(i) for i in range(100)], self.output_path)
+        # 每个生词请求两次（第一次返回 503），至多还有两倍于线程数的查询已经提交。
+        self.assertLessEqual(len(set(self.server.requests)), 4 + 2 * bulk_lookup.workers)
@@ -1,27 +1,35 @@
 from django.views import generic
 from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.cache import never_cache
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition
+from django.middleware.gzip import GZipMiddleware
 
-import json
+import hashlib, json, re
 
 from nihonngo.models import *
 from nihonngo.api import *
+from nihonngo.pool import QUESTION_POOL
+from nihonngo import metrics
 
 
 class AuthRequiredMixin(object):
     """
-    包含此 mixin 的 view 会在用户未认证时自动重定向到认证页面。
+    包含此 mixin 的 view 会在用户未认证时自动重定向到认证页面。当前用户由
+    NihonngoUserMiddleware 附加在 request.nihonngo_user 上。
     """
     def get_context_data(self, **kwargs):
         context = super(AuthRequiredMixin, self).get_context_data(**kwargs)
-        try:
-            context['current_user'] = api_auth_get_user(self.request.session['user_id'])
-        except:
-            pass
+        if self.request.nihonngo_user:
+            context['current_user'] = self.request.nihonngo_user
         return context
 
     def get(self, request, *args, **kwargs):
-        if 'user_id' not in request.session:
+        if not request.nihonngo_user:
             return HttpResponseRedirect(reverse('nihonngo:signin'))
         else:
             return super(AuthRequiredMixin, self).get(request, *args, **kwargs)
@@ -29,9 +37,16 @@ class AuthRequiredMixin(object):
 class JsonResponseMixin(object):
     """
     包含此 mixin 的 view 可以调用 json_response 方法来返回一个 JSON 格式的 Response。
+    客户端接受 gzip 时，较大的 Response 会被压缩。compress_json 为 False 时不压缩，
+    用于包含认证令牌等机密的 Response（压缩后的长度会泄露机密的内容，即 BREACH）。
     """
+    compress_json = True
+
     def json_response(self, object):
-        return HttpResponse(json.dumps(object), content_type = 'application/json')
+        response = HttpResponse(json.dumps(object), content_type = 'application/json')
+        if self.compress_json:
+            response = GZipMiddleware().process_response(self.request, response)
+        return response
 
     def json_message_response(self, success = False, message = '', **kwargs):
         obj = {'success': success, 'message': message}
@@ -48,6 +63,58 @@ class JsonResponseMixin(object):
         except:
             return self.json_message_response(success = False, message = default_message)
 
+ACCEPTS_GZIP_PATTERN = re.compile(r'\bgzip\b')
+
+class ConditionalPageMixin(object):
+    """
+    包含此 mixin 的页面支持条件请求（ETag 及 Last-Modified）并以 gzip 压缩。子类重写
+    get_page_version 方法，返回页面所依据的数据的 (版本, 最后修改时间)。版本未变化时
+    直接返回 304，不再查询数据及渲染模板；没有重写时页面只被压缩，不做条件判断。
+        ETag 由用户、视图、URL 参数、版本以及客户端是否接受 gzip 计算得到，压缩与未压缩的
+        Response 的 ETag 不同。页面在 condition 的内层渲染并压缩，因此 GZipMiddleware 不会
+        改写 condition 设置的 ETag。未登录的用户及非 GET 请求不做条件判断。
+    """
+    def get_page_version(self, request, **kwargs):
+        """
+        返回值：
+            (版本, 最后修改时间) 的元组，版本为可以转换为 JSON 的值，最后修改时间可以为
+            None。无法确定版本时返回 None。
+        """
+        return None
+
+    def page_validators(self, request, *args, **kwargs):
+        """
+        计算页面的 (ETag, 最后修改时间)，结果保存在视图实例上，每个请求只计算一次。
+        """
+        if not hasattr(self, 'validators'):
+            self.validators = (None, None)
+            page_version = self.get_page_version(request, **kwargs) if request.method in ('GET', 'HEAD') and request.nihonngo_user else None
+            if page_version is not None:
+                version, last_modified = page_version
+                accepts_gzip = ACCEPTS_GZIP_PATTERN.search(request.META.get('HTTP_ACCEPT_ENCODING', '')) is not None
+                key = json.dumps([request.nihonngo_user.id, type(self).__name__, kwargs, version, accepts_gzip], sort_keys = True, default = str)
+                self.validators = (hashlib.md5(key.encode('utf-8')).hexdigest(), last_modified)
+        return self.validators
+
+    def rendered_dispatch(self, request, *args, **kwargs):
+        # 先渲染 TemplateResponse，否则 gzip 在 condition 设置 ETag 之后才进行并改写 ETag。
+        response = super(ConditionalPageMixin, self).dispatch(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = gzip_page(self.rendered_dispatch)
+        etag, last_modified = self.page_validators(request, *args, **kwargs)
+        if etag is not None or last_modified is not None:
+            dispatch = condition(etag_func = lambda request, *args, **kwargs: etag,
+                                 last_modified_func = lambda request, *args, **kwargs: last_modified)(dispatch)
+        return dispatch(request, *args, **kwargs)
+
+def p_latest(*dates):
+    dates = [d for d in dates if d is not None]
+    return max(dates) if len(dates) > 0 else None
+
 # MARK - Views
 
 class FrameworkView(AuthRequiredMixin, generic.TemplateView):
@@ -72,6 +139,7 @@ class SignInView(JsonResponseMixin, generic.TemplateView):
             交由前端存入 cookies 中。
     """
     template_name = 'nihonngo/signin.html'
+    compress_json = False
 
     def get(self, request, *args, **kwargs):
         if 'user_id' in request.session:
@@ -80,7 +148,7 @@ class SignInView(JsonResponseMixin, generic.TemplateView):
         if 'sign_in_token' in request.COOKIES:
             try:
                 token = api_auth_validate_token(request.COOKIES['sign_in_token'])
-                request.session['user_id'] = token.user.id
+                request.session['user_id'] = token.user_id
                 request.session['token_id'] = token.id
                 return HttpResponseRedirect(reverse('nihonngo:home'))
             except:
@@ -121,20 +189,28 @@ class SignOutView(generic.View):
         response = HttpResponseRedirect(reverse('nihonngo:signin'))
 
         if 'user_id' in request.session:
+            p_invalidate_cached_user(request.session['user_id'])
             del(request.session['user_id'])
 
         if 'token_id' in request.session:
-            message = api_auth_mark_expired(request.session['token_id'])
+            try:
+                api_auth_mark_token_expired(request.session['token_id'])
+            except APIException:
+                pass
+            del(request.session['token_id'])
             response.delete_cookie('sign_in_token')
 
         return response
 
-class WordsView(AuthRequiredMixin, generic.TemplateView):
+class WordsView(ConditionalPageMixin, AuthRequiredMixin, generic.TemplateView):
     """
-    生词视图，返回一个或多个生词。
+    生词视图，返回一个或多个生词。页面的版本为生词表的版本。
     """
     template_name = 'nihonngo/words.html'
 
+    def get_page_version(self, request, **kwargs):
+        return api_get_change_version('vocabulary')
+
     def get(self, request, *args, **kwargs):
         try:
             words = api_search_word(self.kwargs['word'])
@@ -153,29 +229,40 @@ class ExamView(AuthRequiredMixin, generic.TemplateView):
     """
     template_name = 'nihonngo/exam.html'
 
-class StatisticsView(AuthRequiredMixin, generic.TemplateView):
+class StatisticsView(ConditionalPageMixin, AuthRequiredMixin, generic.TemplateView):
     """
-    统计视图，对应用户测试数据的统计页面。
+    统计视图，对应用户测试数据的统计页面。页面的版本由用户的统计数据、生词表的版本及
+    今天的日期（今日的统计在日期变化时归零）决定。
     """
     template_name = 'nihonngo/stats.html'
 
+    def get_page_version(self, request, **kwargs):
+        modified_date = api_get_statistics_modified_date(request.nihonngo_user)
+        if modified_date is None:
+            return None
+        vocabulary_version, vocabulary_date = api_get_change_version('vocabulary')
+        midnight = timezone.localtime(timezone.now()).replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+        return ((modified_date, vocabulary_version, midnight.date()), p_latest(modified_date, vocabulary_date, midnight))
+
     def get_context_data(self, **kwargs):
-        context = super(AuthRequiredMixin, self).get_context_data(**kwargs)
+        context = super(StatisticsView, self).get_context_data(**kwargs)
         try:
-            user = api_auth_get_user(self.request.session['user_id'])
-            context['statistics'] = api_get_statistics(user)
+            context['statistics'] = api_get_statistics(self.request.nihonngo_user)
         except:
             pass
         return context
 
 class GetQuestionView(AuthRequiredMixin, JsonResponseMixin, generic.View):
     """
-    获取问题视图，返回一个 JSON 格式的 Response。
+    获取问题视图，返回一个 JSON 格式的 Response。每次请求返回新的问题，不可被缓存。
     """
+    @method_decorator(never_cache)
     def get(self, request, *args, **kwargs):
+        if not request.nihonngo_user:
+            return self.json_failed_message_response('您未登录。')
+
         try:
-            user = api_auth_get_user(request.session['user_id'])
-            question = api_create_question(user)
+            question = QUESTION_POOL.pop(request.nihonngo_user)
             return self.json_message_response(success = True, message = '获取问题成功。', question = question)
         except Exception as e:
             return self.json_failed_message_response('获取问题失败。', e)
@@ -194,16 +281,25 @@ class AnswerQuestionView(JsonResponseMixin, generic.View):
 
         try:
             correct_answer = api_answer_question(request.session['user_id'], int(request.POST['question_id']), request.POST['answer'])
+            QUESTION_POOL.notify_answered(request.session['user_id'], int(request.POST['question_id']))
             return self.json_message_response(success = True, message = '回答问题成功。', correct_answer = correct_answer)
         except Exception as e:
             return self.json_failed_message_response('回答问题失败。', e)
 
-class LookupWordView(AuthRequiredMixin, generic.TemplateView):
+class LookupWordView(ConditionalPageMixin, AuthRequiredMixin, generic.TemplateView):
     """
-    查询单词视图。
+    查询单词视图。页面的版本由缓存的查询结果的获取时间及生词表的版本（是否已存在于
+    生词表中）决定，查询结果尚未缓存时不做条件判断。
     """
     template_name = 'nihonngo/lookup.html'
 
+    def get_page_version(self, request, **kwargs):
+        fetch_date = api_get_lookup_fetch_date(kwargs['word'])
+        if fetch_date is None:
+            return None
+        vocabulary_version, vocabulary_date = api_get_change_version('vocabulary')
+        return ((fetch_date, vocabulary_version), p_latest(fetch_date, vocabulary_date))
+
     def get_context_data(self, **kwargs):
         context = super(LookupWordView, self).get_context_data(**kwargs)
         context['words'] = []
@@ -231,3 +327,42 @@ class InsertWordView(JsonResponseMixin, generic.View):
                                              redirect = reverse('nihonngo:words', kwargs = {'word': new_word.kannji}))
         except Exception as e:
             return self.json_failed_message_response('插入生词失败。', e)
+
+class InsertWordsView(JsonResponseMixin, generic.View):
+    """
+    批量插入新的生词的视图，word_infos 为生词基本信息的 JSON 数组。
+    """
+    def post(self, request, *args, **kwargs):
+        if 'user_id' not in request.session:
+            return self.json_failed_message_response('您未登录。')
+        if 'word_infos' not in request.POST:
+            return self.json_failed_message_response('未给出生词的基本信息 。')
+
+        try:
+            word_infos = json.loads(request.POST['word_infos'])
+            new_words = api_insert_new_words(word_infos)
+            return self.json_message_response(success = True,
+                                             message = '插入 {0} 个生词成功。'.format(len(new_words)),
+                                             words = [{'id': word.id, 'kannji': word.kannji, 'kana': word.kana} for word in new_words])
+        except Exception as e:
+            return self.json_failed_message_response('插入生词失败。', e)
+
+class MetricsView(JsonResponseMixin, generic.View):
+    """
+    调用指标视图，仅对管理员开放。
+
+        GET 请求：
+            返回每个 API 函数及视图的调用次数、异常次数、耗时及 SQL 语句数的分位数，以及
+            问题预生成池的状态。参数 format=prometheus 时以 Prometheus 文本格式返回。
+    """
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(MetricsView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'prometheus':
+            return HttpResponse(metrics.prometheus_text(), content_type = 'text/plain; version=0.0.4; charset=utf-8')
+        return self.json_response({'calls': metrics.snapshot(), 'question_pool': QUESTION_POOL.stats()})
+
+
+metrics.instrument_views(globals())
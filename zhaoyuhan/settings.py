@@ -41,9 +41,11 @@ INSTALLED_APPS = (
 
 MIDDLEWARE_CLASSES = (
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'nihonngo.middleware.NihonngoUserMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'nihonngo.middleware.ProfilerMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 )
@@ -81,3 +83,31 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.6/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Nihonngo
+
+# 每个用户预先生成的问题个数，设为 0 则关闭问题预生成池。
+NIHONNGO_QUESTION_POOL_SIZE = 5
+
+# 用于补充问题预生成池的后台线程数。
+NIHONNGO_QUESTION_POOL_WORKERS = 2
+
+# 进程内用户缓存的有效期（秒），设为 0 则关闭缓存。
+NIHONNGO_USER_CACHE_TTL = 60
+
+# 自动认证令牌验证结果的缓存有效期（秒），设为 0 则关闭缓存。
+NIHONNGO_TOKEN_CACHE_TTL = 60
+
+# 是否记录每个 API 及视图的调用次数、耗时和 SQL 语句数，可在 /nihonngo/metrics/ 查看。
+NIHONNGO_METRICS_ENABLED = True
+
+# 以 cProfile 剖析的请求的比例，0 为只剖析带有 X-Nihonngo-Profile 头的管理员请求。
+NIHONNGO_PROFILER_SAMPLE_RATE = 0
+
+# 抽样剖析的请求是否同时用 tracemalloc 记录内存分配。
+NIHONNGO_PROFILER_TRACE_MEMORY = False
+
+# 剖析报告的目录，只保留最新的 NIHONNGO_PROFILER_MAX_REPORTS 份。
+NIHONNGO_PROFILER_DIR = os.path.join(BASE_DIR, 'profiles')
+NIHONNGO_PROFILER_MAX_REPORTS = 100